@@ -0,0 +1,144 @@
+"""
+What-if branches of ADM1 scenarios forked from a shared reactor state
+"""
+import os
+import sys
+import copy
+import numpy as np
+from parameter_sweep import iter_points, point_kwargs, point_row
+from result_cache import result_key
+
+def split_branches(branches):
+    """
+    Names and parameter changes of the branches of a fork.
+
+    Parameters
+    ----------
+    branches : list of dict
+        Per branch, the parameters that change at the fork (Q, Temp, HRT,
+        feedstock components or kinetic parameters, as for a sweep point,
+        see `parameter_sweep.point_kwargs`) and optionally a 'name'
+
+    Returns
+    -------
+    tuple
+        (names, points), one per branch
+    """
+    if not branches:
+        raise ValueError("No branches to fork.")
+    names, points = [], []
+    for i, branch in enumerate(branches):
+        if not isinstance(branch, dict):
+            raise ValueError(f"Branch {i + 1} must be a dict of parameter changes.")
+        point = dict(branch)
+        name = str(point.pop('name', None) or f"branch {i + 1}")
+        try:
+            point = {key: float(value) for key, value in point.items()}
+        except (TypeError, ValueError):
+            raise ValueError(f"Parameter values of branch '{name}' must be numeric.")
+        names.append(name)
+        points.append(point)
+    if len(set(names)) < len(names):
+        raise ValueError("Branch names must be unique.")
+    return names, points
+
+def fork_kwargs(base_kwargs, state, fork_time, duration):
+    """
+    Simulation keyword arguments that continue a scenario from a snapshot.
+
+    Parameters
+    ----------
+    base_kwargs : dict
+        `run_simulation` keyword arguments of the forked scenario
+    state : numpy.ndarray
+        Reactor state at the fork, see `SimulationResult.state_at`
+    fork_time : float
+        Time of the fork in days
+    duration : float
+        Days to simulate after the fork
+
+    Returns
+    -------
+    dict
+    """
+    if not duration or duration <= 0:
+        raise ValueError("The branches need a positive duration.")
+    return dict(base_kwargs, initial_state=np.asarray(state, dtype=float), start_time=float(fork_time),
+                simulation_time=float(fork_time) + float(duration))
+
+def fork_branches(result, branches, base_kwargs, fork_time=None, duration=30., parallel_run=True,
+                  use_cache=True, engine='individual', outputs=None):
+    """
+    Continue a finished scenario from its state at one time along several
+    divergent branches, e.g. a shock load, a temperature drop or an HRT
+    change.
+
+    The state at the fork is taken once from `result` and every branch
+    starts from it, so none of them re-integrates the run up to the fork.
+    Branches are simulated like sweep points, in parallel or as one
+    ensemble. Each archived branch holds only its rows from the fork on and
+    names `result`'s archived run as its parent, which supplies the shared
+    history before the fork (see `trajectory_archive.read_lineage_slice`).
+
+    Parameters
+    ----------
+    result : SimulationResult
+        The finished scenario
+    branches : list of dict
+        Parameter changes per branch, see `split_branches`
+    base_kwargs : dict
+        `run_simulation` keyword arguments of the scenario, which the
+        branches share apart from their changes
+    fork_time : float, optional
+        Time of the fork in days, by default the end of `result`. A steady
+        state (no stop time) is forked at t=0.
+    duration : float, optional
+        Days to simulate after the fork, by default 30
+    parallel_run : bool, optional
+        Spread the branches over the worker processes, by default True
+    use_cache : bool, optional
+        Serve branches that were simulated before from the result cache,
+        by default True
+    engine : str, optional
+        'individual' (default) or 'ensemble', see `parameter_sweep.iter_points`
+    outputs : sequence of str, optional
+        KPIs and effluent components to evaluate, see `kpis.calculate_kpis`
+
+    Returns
+    -------
+    list of dict
+        Per branch, in order: 'name', 'run_id' (archived trajectory, or
+        None) and the `parameter_sweep.point_row` summary
+    """
+    names, points = split_branches(branches)
+    stop_time = result.run_info.get('stop_time')
+    if stop_time is None:
+        if fork_time:
+            raise ValueError("A steady state has no trajectory to fork within; fork it at t=0.")
+        fork_time, state = 0., result.state_at()
+    else:
+        fork_time = stop_time if fork_time is None else float(fork_time)
+        state = result.state_at(fork_time)
+    base = fork_kwargs(base_kwargs, state, fork_time, duration)
+    parent_id = os.path.basename(result.archive_path) if result.archive_path else None
+    sys.stderr.write(f"DEBUG: Forking {len(points)} branches at t = {fork_time:g} d.\n")
+    sys.stderr.flush()
+
+    rows = [None] * len(points)
+    for i, branch, error, from_cache in iter_points(base, points, parallel_run=parallel_run,
+                                                     use_cache=use_cache, engine=engine):
+        run_id = None
+        if branch is not None:
+            # The result may be shared with the result cache; tag a copy
+            branch = copy.copy(branch)
+            branch.run_info = dict(branch.run_info, fork={'parent': parent_id, 'fork_time': float(fork_time),
+                                                          'branch': names[i]})
+            run_id = result_key(dict(point_kwargs(base, points[i]), forked_from=parent_id),
+                                engine='ensemble' if branch.run_info.get('ensemble') else 'individual')
+            if branch.archive_path is not None and os.path.basename(branch.archive_path) != run_id:
+                branch.archive_path = None  # archived for another fork; write this one's own
+            if not branch.archive(run_id):
+                run_id = None
+        rows[i] = dict(name=names[i], run_id=run_id,
+                       **point_row(points[i], branch, error, from_cache, outputs))
+    return rows
@@ -0,0 +1,262 @@
+"""
+Time-varying influent for dynamic ADM1 runs
+"""
+import os
+import json
+import numpy as np
+
+# How the influent is read between its time points: 'linear' interpolates,
+# 'previous' holds each value until the next point (batch feeding, step changes)
+INTERPOLATIONS = ('linear', 'previous')
+
+# Layout of a series stored on disk (see `plant_records`): raw float64 time
+# points and a row-major matrix of values, read back memory-mapped
+TIME_FILE = 'time.bin'
+DATA_FILE = 'data.bin'
+META_FILE = 'meta.json'
+
+def _column(values, n_points, name):
+    """A series column as floats, one per time point (scalars are broadcast)."""
+    try:
+        column = np.asarray(values, dtype=float)
+    except (TypeError, ValueError):
+        raise ValueError(f"Values of '{name}' must be numeric.")
+    if column.ndim == 0:
+        column = np.full(n_points, float(column))
+    if column.shape != (n_points,):
+        raise ValueError(f"'{name}' needs one value per time point ({n_points}), got {column.size}.")
+    if not np.all(np.isfinite(column)) or np.any(column < 0):
+        raise ValueError(f"Values of '{name}' must be finite and non-negative.")
+    return column
+
+class InfluentSeries:
+    """
+    Influent flow and concentrations over time, for diurnal profiles, batch
+    feeding or seasonal changes in one dynamic run.
+
+    The series is compiled once per run (`bind`) against the reactor's
+    influent vector: which of its columns change and their unit scaling.
+    During the integration `write` fills the vector in place at every
+    right-hand-side evaluation from the two time points around t, so no
+    WasteStream is rebuilt and a series stored on disk (`open`) is read a
+    few rows at a time; see `simulation.run_simulation`'s `influent`.
+    Components not in the series keep the scenario's constant influent
+    values.
+
+    Parameters
+    ----------
+    time : array-like
+        Time points in days, strictly increasing
+    Q : float or array-like, optional
+        Flow rate in m3/d per time point, by default the scenario's flow
+    concentrations : dict, optional
+        Component ID to concentrations in kg/m3 (as the constant influent),
+        a single value or one per time point
+    interpolation : str, optional
+        One of `INTERPOLATIONS`, by default 'linear'
+    period : float, optional
+        Repeat the series every `period` days, e.g. 1 for a diurnal profile,
+        by default None (values beyond the series are held)
+    """
+    def __init__(self, time, Q=None, concentrations=None, interpolation='linear', period=None):
+        time = np.asarray(time, dtype=float).ravel()
+        if not len(time) or not np.all(np.isfinite(time)):
+            raise ValueError("The influent series needs finite time points.")
+        if np.any(np.diff(time) <= 0):
+            raise ValueError("Time points of the influent series must be strictly increasing.")
+        labels, columns = [], []
+        for ID, values in (concentrations or {}).items():
+            labels.append(str(ID))
+            columns.append(_column(values, len(time), ID))
+        if Q is not None:
+            labels.append('Q')
+            columns.append(_column(Q, len(time), 'Q'))
+        if not columns:
+            raise ValueError("The influent series needs a flow or at least one concentration.")
+        self._setup(time, np.column_stack(columns), labels, interpolation, period)
+
+    def _setup(self, time, data, labels, interpolation, period, path=None, source=None):
+        if interpolation not in INTERPOLATIONS:
+            raise ValueError(f"Unknown interpolation '{interpolation}'. Use one of {INTERPOLATIONS}.")
+        if period is not None:
+            period = float(period)
+            if not period > time[-1] - time[0]:
+                raise ValueError("The period must be longer than the span of the time points.")
+        self.time = time
+        self.labels = list(labels)
+        self.interpolation = interpolation
+        self.period = period
+        self.path = path
+        self.source = source
+        self._data = data
+        self._columns = None
+
+    @classmethod
+    def open(cls, path, interpolation='linear', period=None):
+        """
+        Open a series stored on disk, memory-mapped.
+
+        Parameters
+        ----------
+        path : str
+            Directory of the stored series, see `plant_records.read_plant_records`
+        interpolation : str, optional
+            One of `INTERPOLATIONS`, by default 'linear'
+        period : float, optional
+            Repeat period in days, by default None
+
+        Returns
+        -------
+        InfluentSeries
+        """
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        n, labels = int(meta['points']), meta['labels']
+        time = np.memmap(os.path.join(path, TIME_FILE), dtype=float, mode='r', shape=(n,))
+        data = np.memmap(os.path.join(path, DATA_FILE), dtype=float, mode='r', shape=(n, len(labels)))
+        series = cls.__new__(cls)
+        series._setup(time, data, labels, interpolation, period, path, meta.get('source'))
+        return series
+
+    @property
+    def span(self):
+        """(first, last) time point in days."""
+        return float(self.time[0]), float(self.time[-1])
+
+    @property
+    def Q(self):
+        """Flow rates in m3/d per time point, or None if the flow is constant."""
+        return self._data[:, self.labels.index('Q')] if 'Q' in self.labels else None
+
+    @property
+    def concentrations(self):
+        """Concentrations in kg/m3 per time point, keyed by component ID."""
+        return {ID: self._data[:, j] for j, ID in enumerate(self.labels) if ID != 'Q'}
+
+    def to_dict(self):
+        """The series as plain values, e.g. to fingerprint a run (`result_cache.result_key`)."""
+        if self.source is not None:
+            # A stored series is named by the digest of its content
+            return {'source': self.source['digest'], 'interpolation': self.interpolation,
+                    'period': self.period}
+        return {'time': self.time, 'Q': self.Q, 'concentrations': self.concentrations,
+                'interpolation': self.interpolation, 'period': self.period}
+
+    def describe(self):
+        """Summary of the series for run information."""
+        info = {'points': int(len(self.time)), 'span': list(self.span),
+                'flow': 'Q' in self.labels, 'components': sorted(set(self.labels) - {'Q'}),
+                'interpolation': self.interpolation, 'period': self.period}
+        if self.source is not None:
+            info['source'] = self.source.get('file')
+        return info
+
+    def bind(self, IDs, base):
+        """
+        Compile the series against a reactor's influent vector.
+
+        Parameters
+        ----------
+        IDs : sequence of str
+            Component IDs of the influent vector
+        base : numpy.ndarray
+            The constant influent vector (mg/L, then m3/d), for the columns
+            the series leaves unchanged
+
+        Returns
+        -------
+        InfluentSeries
+            This series
+        """
+        IDs = list(IDs)
+        unknown = [ID for ID in self.labels if ID != 'Q' and ID not in IDs]
+        if unknown:
+            raise ValueError(f"Unknown influent components: {', '.join(unknown)}.")
+        self._columns = np.array([len(IDs) if ID == 'Q' else IDs.index(ID) for ID in self.labels])
+        self._scale = np.array([1. if ID == 'Q' else 1e3 for ID in self.labels])  # kg/m3 to mg/L
+        self._linear = self.interpolation == 'linear'
+        self._wrap = self._linear and self.period is not None
+        self._t0, self._t_end = float(self.time[0]), float(self.time[-1])
+        self._base = np.array(base, dtype=float)
+        return self
+
+    def _locate(self, t):
+        """Time point at or before t, with periodic wrapping and held ends."""
+        t0 = self._t0
+        if self.period is not None:
+            t = t0 + np.mod(t - t0, self.period)
+        else:
+            t = np.clip(t, t0, self._t_end)
+        i = np.clip(np.searchsorted(self.time, t, side='right') - 1, 0, len(self.time) - 1)
+        return t, i
+
+    def write(self, t, out):
+        """
+        Fill an influent vector with the series' values at time t, in place.
+
+        Parameters
+        ----------
+        t : float
+            Time in days
+        out : numpy.ndarray
+            Influent vector (mg/L, then m3/d) to update, e.g. the reactor's
+            `_ins_QC` row
+        """
+        t, i = self._locate(t)
+        value = self._data[i]
+        if self._linear:
+            if i + 1 < len(self.time):
+                ta, tb, following = self.time[i], self.time[i + 1], self._data[i + 1]
+            elif self._wrap:
+                # The last point leads back to the first one of the next period
+                ta, tb, following = self.time[i], self._t0 + self.period, self._data[0]
+            else:
+                following = None
+            if following is not None:
+                value = value + (t - ta)/(tb - ta)*(following - value)
+        out[self._columns] = self._scale*value
+
+    def __call__(self, t):
+        """
+        Influent vectors at many times.
+
+        Parameters
+        ----------
+        t : float or array-like
+            Times in days
+
+        Returns
+        -------
+        numpy.ndarray
+            One influent vector (mg/L, then m3/d) per time, as rows
+        """
+        if self._columns is None:
+            raise RuntimeError("The influent series is not bound to a reactor; see `bind`.")
+        t, i = self._locate(np.atleast_1d(np.asarray(t, dtype=float)))
+        values = np.asarray(self._data[i], dtype=float)
+        if self._linear:
+            n = len(self.time)
+            j = np.minimum(i + 1, n - 1)
+            ta, tb = np.asarray(self.time[i]), np.asarray(self.time[j], dtype=float)
+            if self._wrap:
+                tb = np.where(i == n - 1, self._t0 + self.period, tb)
+                j = np.where(i == n - 1, 0, j)
+            inner = tb > ta
+            w = np.zeros(len(t))
+            w[inner] = (t[inner] - ta[inner])/(tb[inner] - ta[inner])
+            values += w[:, None]*(np.asarray(self._data[j]) - values)
+        rows = np.tile(self._base, (len(t), 1))
+        rows[:, self._columns] = self._scale*values
+        return rows
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.path is not None:
+            state['time'] = state['_data'] = None  # reopened from disk
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.path is not None:
+            stored = InfluentSeries.open(self.path, self.interpolation, self.period)
+            self.time, self._data = stored.time, stored._data
@@ -0,0 +1,340 @@
+"""
+Ensemble integration of many ADM1 reactors as one stacked ODE system
+"""
+import os
+import sys
+import time
+import numpy as np
+from scipy import integrate, sparse
+import numba_kinetics
+from simulation import (get_reactor_system, default_init_conds, update_ph_and_alkalinity,
+                        _reset_reactor_state, _instrumented_method, SteadyStateDetector,
+                        OUTPUT_MODES, DEFAULT_OUTPUT_MODE, OUTPUT_RTOL, tracked_components,
+                        DEFAULT_TRACKED_COMPONENTS, RECORD_DTYPES, DEFAULT_RECORD_DTYPE)
+from results import (SimulationResult, record_layout, records_from_states, downsample_records,
+                     select_records)
+
+# Upper limit on the number of reactors integrated together. All members
+# share the solver's steps, so very large ensembles step at the pace of their
+# most dynamic member.
+MAX_ENSEMBLE_SIZE = int(os.environ.get('ADM1_ENSEMBLE_SIZE', 32))
+
+# Members are set up and written back through their own cached flowsheet
+ENSEMBLE_CACHE_SLOT = 'ensemble'
+
+# run_simulation arguments every member must share: they set the integration
+SHARED_KEYS = ('simulation_time', 't_step', 'method', 'stop_at_steady_state',
+               'steady_state_tol', 'steady_state_window', 'output', 'output_rtol',
+               'start_time')
+
+# Default solve_ivp tolerances, which a single run_simulation uses
+RTOL = 1e-3
+ATOL = 1e-6
+
+def _member_system(kwargs):
+    """Flowsheet of one member, from the ensemble's cached slot."""
+    sys_, inf, eff, gas = get_reactor_system(
+        kwargs['Q'], kwargs['Temp'], kwargs['HRT'], kwargs.get('concentrations') or {},
+        kwargs.get('kinetic_params') or {}, use_kinetics=kwargs.get('use_kinetics', True),
+        cache_slot=ENSEMBLE_CACHE_SLOT
+    )
+    sys_._path[0].set_init_conc(**default_init_conds)
+    return sys_, inf, eff, gas
+
+def _member_setup(kwargs):
+    """
+    Initial state and kernel parameters of one member.
+
+    The reactor is set up exactly as `run_simulation` sets it up, on the
+    numba backend, and its parameters are read from it.
+
+    Returns
+    -------
+    dict
+        'y0', 'T', 'QC_ins', 'params' (the `adm1_rhs` parameter arrays),
+        'backend_info', 'layout' (see `results.record_layout`), and the
+        tracked 'components' and record 'dtype'
+    """
+    if kwargs.get('influent') is not None:
+        raise ValueError("Ensemble members share a constant influent; a time-varying one runs on its own.")
+    dtype = kwargs.get('record_dtype') or DEFAULT_RECORD_DTYPE
+    if dtype not in RECORD_DTYPES:
+        raise ValueError(f"Unknown record dtype '{dtype}'. Use one of {RECORD_DTYPES}.")
+    track = kwargs.get('track')
+    sys_, inf, eff, gas = _member_system(kwargs)
+    components = tracked_components(DEFAULT_TRACKED_COMPONENTS if track is None else track,
+                                    eff.components.IDs)
+    y0 = _reset_reactor_state(sys_, kwargs.get('initial_state'), 'numba',
+                              kwargs.get('algebraic_h2', False))
+    AD = sys_._path[0]
+    if AD.backend_info['backend'] != 'numba':
+        raise ValueError("Reactor configuration not covered by the numba kernel; "
+                         "simulate this point on its own.")
+    T = AD.eval_exo_dynamic_vars(0.)[0] if len(AD._exovars) else AD.T
+    return {
+        'y0': y0.copy(),
+        'T': T,
+        'QC_ins': AD._ins_QC.copy(),
+        # Copies: the rate arrays belong to the model, which the next member re-targets
+        'params': tuple(np.array(a) for a in numba_kinetics._rate_arrays(AD) + numba_kinetics._kernel_args(AD)),
+        'backend_info': AD.backend_info,
+        'layout': record_layout(AD),
+        'components': components,
+        'dtype': dtype,
+    }
+
+class EnsembleODE:
+    """
+    State derivatives of an ensemble of ADM1 reactors as one system.
+
+    The ensemble state is the members' reactor state vectors one after
+    another, so the Jacobian is block diagonal. Each evaluation makes a
+    single call into the compiled kernels, which loop over the members;
+    the solver's Python overhead is paid once per step for the whole
+    ensemble.
+
+    Parameters
+    ----------
+    members : list of dict
+        Member set-ups from `_member_setup`
+    """
+    def __init__(self, members):
+        self.n_members = n_members = len(members)
+        self.n_state = n_state = len(members[0]['y0'])
+        self.T = np.array([m['T'] for m in members], dtype=float)
+        self.QC_ins = np.ascontiguousarray(np.stack([m['QC_ins'] for m in members]))
+        self.params = tuple(np.ascontiguousarray(np.stack([m['params'][k] for m in members]))
+                            for k in range(len(members[0]['params'])))
+        n_rates = self.params[-4].shape[2]  # stoichiometry, n_cmps x n_processes
+        self.algebraic_h2 = bool(self.params[-1][:, numba_kinetics.P_ALG_H2].any())
+        self._dY = np.zeros((n_members, n_state))
+        self._rhos = np.zeros((n_members, n_rates))
+        self._diag = np.zeros((n_members, numba_kinetics.N_DIAGNOSTICS))
+        self._work = np.zeros((n_members, 17))
+        self._q_gas = np.zeros(n_members)
+        self._P = np.zeros(n_members)
+        # CSR layout of the block-diagonal Jacobian: full blocks, row by row
+        cols = np.arange(n_state)[None, None, :] + n_state*np.arange(n_members)[:, None, None]
+        self._indices = np.broadcast_to(cols, (n_members, n_state, n_state)).ravel()
+        self._indptr = np.arange(n_members*n_state + 1)*n_state
+
+    def _states(self, y):
+        # Clipped as AnaerobicCSTR._update_state clips, one member per row
+        return np.where(y < 1e-16, 0., y).reshape(self.n_members, self.n_state)
+
+    def evaluate(self, y):
+        """
+        Evaluate the kernel at an ensemble state.
+
+        Returns
+        -------
+        tuple
+            (member states, with the algebraic S_h2 solution where used;
+            biogas flows in m3/d; rate function diagnostics per member)
+        """
+        Y = self._states(y)
+        numba_kinetics.adm1_rhs_batch(Y, self.T, self.QC_ins, *self.params, self._dY,
+                                      self._rhos, self._diag, self._work, self._q_gas, self._P)
+        return Y, self._q_gas.copy(), self._diag.copy()
+
+    def __call__(self, t, y):
+        numba_kinetics.adm1_rhs_batch(self._states(y), self.T, self.QC_ins, *self.params, self._dY,
+                                      self._rhos, self._diag, self._work, self._q_gas, self._P)
+        return self._dY.ravel().copy()
+
+    def jac(self, t, y):
+        """Block-diagonal analytic Jacobian (differential S_h2 only)."""
+        n_members, n_state = self.n_members, self.n_state
+        J = np.zeros((n_members, n_state, n_state))
+        D = np.zeros((n_members, self._rhos.shape[1], n_state))
+        work = np.zeros((n_members, 16))
+        numba_kinetics.adm1_jacobian_batch(self._states(y), self.T, self.QC_ins, *self.params,
+                                           J, D, work)
+        J *= (y >= 0).reshape(n_members, 1, n_state)  # clipped states, as compile_reactor_jacobian
+        return sparse.csr_matrix((J.ravel(), self._indices, self._indptr),
+                                 shape=(n_members*n_state, n_members*n_state))
+
+    def sparsity(self):
+        """Block-diagonal sparsity pattern, for finite-difference Jacobians."""
+        block = np.ones((self.n_state, self.n_state))
+        return sparse.block_diag([block]*self.n_members, format='csr')
+
+def _shared_settings(kwargs_list):
+    """Integration settings common to all members."""
+    shared = {}
+    for key in SHARED_KEYS:
+        values = {repr(kwargs.get(key)) for kwargs in kwargs_list}
+        if len(values) > 1:
+            raise ValueError(f"All ensemble members need the same '{key}'.")
+        shared[key] = kwargs_list[0].get(key)
+    if shared['simulation_time'] is None or shared['t_step'] is None:
+        raise ValueError("Ensemble members need 'simulation_time' and 't_step'.")
+    return shared
+
+def _solver_options(ode, method):
+    """solve_ivp method and Jacobian options for an ensemble."""
+    if method == 'auto':
+        method = 'BDF'  # the sparse block Jacobian suits it best
+    options = {}
+    jacobian = None
+    if method in ('BDF', 'Radau'):
+        if ode.algebraic_h2:
+            # Columns of different members never interact: a finite-difference
+            # Jacobian costs one evaluation per member state, whatever the size
+            options['jac_sparsity'] = ode.sparsity()
+            jacobian = 'finite-difference'
+        else:
+            options['jac'] = ode.jac
+            jacobian = 'analytic'
+    elif method == 'LSODA':
+        options.update(lband=ode.n_state - 1, uband=ode.n_state - 1)
+        jacobian = 'finite-difference'
+    return method, options, jacobian
+
+def _member_result(kwargs, member, state, t_end, time_series, records, columns, run_info):
+    """Write a member's final state into its flowsheet and extract the result."""
+    sys_, inf, eff, gas = _member_system(kwargs)
+    y = _reset_reactor_state(sys_, state, 'numba', kwargs.get('algebraic_h2', False))
+    # The outlets are written before the kinetics run in every evaluation,
+    # with the previous biogas flow and pH; the second one sees this state's
+    for _ in range(2):
+        sys_.DAE(t_end, y)
+    sys_._write_state()
+    AD = sys_._path[0]
+    AD.run_info = dict(run_info, warm_start=kwargs.get('initial_state') is not None,
+                       kinetics_backend=member['backend_info'],
+                       algebraic_h2=kwargs.get('algebraic_h2', False))
+    update_ph_and_alkalinity(eff)
+    result = SimulationResult.from_system(sys_, inf, eff, gas)
+    result.time_series = time_series
+    result.records = records
+    result.record_columns = columns
+    return result
+
+def simulate_ensemble(kwargs_list):
+    """
+    Integrate many reactor scenarios together as one stacked system.
+
+    Each member is set up from its `run_simulation` arguments (flow,
+    temperature, HRT, feedstock, kinetics, warm start, algebraic S_h2) on
+    the same QSDsan model and reactor `run_simulation` builds, then all
+    members are integrated in a single `solve_ivp` call on the numba
+    kernel. Stiff methods get a sparse block-diagonal Jacobian.
+
+    Scipy measures the error of a step by its root mean square over all
+    states, in which one member's error is diluted by the others. The
+    tolerances are therefore tightened by the square root of the ensemble
+    size, so every member meets the tolerances of a single run.
+
+    Parameters
+    ----------
+    kwargs_list : list of dict
+        `run_simulation` keyword arguments per member. Members must share
+        `SHARED_KEYS`; `backend` and `cache_slot` are ignored. A shared
+        steady-state stop ends the run once every member is steady. Method
+        'auto' integrates with BDF. Output modes are as for
+        `run_simulation`, except 'dense'.
+
+    Returns
+    -------
+    list of tuple
+        (SimulationResult or None, exception or None) per member, in order
+    """
+    if not kwargs_list:
+        return []
+    if len(kwargs_list) > MAX_ENSEMBLE_SIZE:
+        raise ValueError(f"An ensemble holds at most {MAX_ENSEMBLE_SIZE} members (ADM1_ENSEMBLE_SIZE).")
+    if not numba_kinetics.NUMBA_AVAILABLE:
+        raise RuntimeError("The ensemble integrator needs the numba package (pip install numba).")
+    shared = _shared_settings(kwargs_list)
+    output = shared['output'] or DEFAULT_OUTPUT_MODE
+    if output not in OUTPUT_MODES or output == 'dense':
+        raise ValueError(f"Unknown ensemble output mode '{output}'. Use 'steps', 'grid' or 'downsample'.")
+
+    outcomes = [(None, None)] * len(kwargs_list)
+    members, indices = [], []
+    for i, kwargs in enumerate(kwargs_list):
+        try:
+            members.append(_member_setup(kwargs))
+            indices.append(i)
+        except Exception as e:
+            outcomes[i] = (None, e)
+    if not members:
+        return outcomes
+
+    ode = EnsembleODE(members)
+    method, options, jacobian = _solver_options(ode, shared['method'])
+    detector = None
+    if shared['stop_at_steady_state']:
+        detector = SteadyStateDetector(tol=shared['steady_state_tol'] or 1e-4,
+                                       window=shared['steady_state_window'] or 5.0)
+    simulation_time, t_step = shared['simulation_time'], shared['t_step']
+    start_time = shared['start_time'] or 0.
+    if not 0 <= start_time < simulation_time:
+        raise ValueError(f"start_time must be in [0, {simulation_time}), got {start_time}.")
+    scale = np.sqrt(len(members))
+    stats = {}
+    sys.stderr.write(f"DEBUG: Integrating an ensemble of {len(members)} reactors with {method}.\n")
+    sys.stderr.flush()
+    try:
+        start = time.perf_counter()
+        sol = integrate.solve_ivp(
+            ode, (start_time, simulation_time), np.concatenate([m['y0'] for m in members]),
+            method=_instrumented_method(method, stats),
+            dense_output=output == 'grid', events=detector, rtol=RTOL/scale, atol=ATOL/scale, **options
+        )
+        wall_time = time.perf_counter() - start
+    except Exception as e:
+        return [(None, e if outcome[1] is None else outcome[1]) for outcome in outcomes]
+
+    # Stream records at the kept times; the kernel fills in the biogas flows
+    # and any algebraic S_h2. The last solver step is the end of the run.
+    n_members, n_state = ode.n_members, ode.n_state
+    t_end = float(sol.t[-1])
+    t, y = sol.t, sol.y
+    if output == 'grid':
+        t = np.arange(0, t_end + t_step/2, t_step).clip(max=t_end)
+        t = t[t >= start_time]
+        y = sol.sol(t)
+    states = np.empty((len(t), n_members, n_state))
+    q_gas = np.empty((len(t), n_members))
+    for k in range(len(t)):
+        states[k], q_gas[k], _ = ode.evaluate(y[:, k])
+    final = ode.evaluate(sol.y[:, -1])[0]
+    stop_reason = {0: 'end_time', 1: 'steady_state'}.get(sol.status, 'solver_failure')
+    run_info = {
+        'stop_time': t_end,
+        'stop_reason': stop_reason,
+        'solver_message': sol.message,
+        'solver_stats': {
+            'method': method,
+            'wall_time': wall_time,
+            'rhs_evaluations': int(sol.nfev),
+            'jacobian_evaluations': int(sol.njev),
+            'lu_decompositions': int(sol.nlu),
+            **stats,
+            'jacobian': jacobian,
+        },
+    }
+    if detector is not None:
+        run_info['derivative_norm'] = detector.norm
+
+    for m, (i, member) in enumerate(zip(indices, members)):
+        try:
+            records, columns = select_records(
+                member['layout'], records_from_states(member['layout'], states[:, m], q_gas[:, m]),
+                member['components'])
+            time_series = np.array(t)
+            if output == 'downsample':
+                time_series, records = downsample_records(
+                    time_series, records, shared['output_rtol'] or OUTPUT_RTOL)
+            records = {name: rec.astype(member['dtype']) for name, rec in records.items()}
+            info = dict(run_info, ensemble={'size': n_members, 'member': m},
+                        output={'mode': output, 'points': len(time_series),
+                                'components': member['components'], 'dtype': member['dtype']})
+            result = _member_result(kwargs_list[i], member, final[m], t_end, time_series,
+                                    records, columns, info)
+            outcomes[i] = (result, None)
+        except Exception as e:
+            outcomes[i] = (None, e)
+    return outcomes
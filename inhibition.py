@@ -9,8 +9,9 @@ def calculate_inhibition_factors(system_or_results):
     
     Parameters
     ----------
-    system_or_results : System or tuple
-        The simulation system with results or a tuple containing (sys, inf, eff, gas)
+    system_or_results : System, SimulationResult or tuple
+        The simulation system with results, a compact result, or a tuple
+        containing (sys, inf, eff, gas)
         
     Returns
     -------
@@ -29,9 +30,19 @@ def calculate_inhibition_factors(system_or_results):
     
     # Try to access the inhibition data stored by the ADM1 model during the last simulation step
     try:
-        # The ADM1 model in QSDsan stores inhibition data in the model's root attribute
-        # This is stored during rate calculation in the _rhos_adm1 function
-        root_data = sys._path[0].model.rate_function._params['root'].data
+        # Compact results (results.SimulationResult) carry a copy of the data
+        if hasattr(sys, 'inhibition_data'):
+            root_data = sys.inhibition_data
+        else:
+            # The ADM1 model in QSDsan stores inhibition data in the model's root attribute
+            # This is stored during rate calculation in the _rhos_adm1 function.
+            # The reactor keeps its own copy after each step; prefer it, since a
+            # cached model is shared by several reactors and its root data only
+            # reflects whichever ran last
+            unit = sys._path[0]
+            root_data = getattr(unit, '_tempstate', None)
+            if not root_data or 'pH' not in root_data:
+                root_data = unit.model.rate_function._params['root'].data
         
         if root_data is None:
             return None
@@ -291,4 +302,4 @@ def analyze_inhibition(simulation_results):
         "inhibition_factors": inhibition_factors,
         "recommendations": recommendations,
         "safety_recommendations": safety_recommendations
-    }
\ No newline at end of file
+    }
\ No newline at end of file
@@ -0,0 +1,107 @@
+"""
+Key performance indicators of ADM1 simulation results
+"""
+import sys
+from simulation import calculate_gas_properties
+from inhibition import analyze_inhibition, calculate_inhibition_factors
+from utils import FEEDSTOCK_KEYS
+
+# Volatile fatty acid components of the ADM1 state
+VFA_COMPONENTS = ('S_va', 'S_bu', 'S_pro', 'S_ac')
+
+# KPI names in table order, with units
+KPI_UNITS = {
+    'methane_flow': 'Nm3/d',
+    'methane_percent': '%',
+    'methane_yield': 'Nm3 CH4/kg COD fed',
+    'effluent_COD': 'mg/L',
+    'COD_removal': '%',
+    'total_VFA': 'mg COD/L',
+    'pH': '-',
+    'max_inhibition': '%',
+}
+
+_GAS_KPIS = {'methane_flow', 'methane_percent', 'methane_yield'}
+_COD_KPIS = {'effluent_COD', 'COD_removal', 'methane_yield'}
+_INHIBITION_KPIS = {'pH', 'max_inhibition'}
+
+def output_units(name):
+    """Unit of a KPI or of an effluent component concentration."""
+    return KPI_UNITS.get(name, 'mg/L')
+
+def check_outputs(names):
+    """Raise ValueError for names that are neither KPIs nor ADM1 components."""
+    unknown = [name for name in names if name not in KPI_UNITS and name not in FEEDSTOCK_KEYS]
+    if unknown:
+        raise ValueError(f"Unknown outputs {unknown}. Use KPIs {list(KPI_UNITS)} "
+                         "or ADM1 component IDs (effluent concentration, e.g. 'S_ac').")
+
+def _total_COD(stream):
+    """Total COD in mg/L, as WasteStream.COD."""
+    # WasteStream.COD compiles a component subgroup on every call, which costs
+    # more than a steady-state solve; over all components it is a dot product
+    cmps = stream.components
+    return float((cmps.i_COD * stream.conc * (1 - cmps.g) * (cmps.i_COD >= 0)).sum())
+
+def calculate_kpis(sim_results, names=None):
+    """
+    Summarize a simulation result in a few headline numbers.
+
+    Parameters
+    ----------
+    sim_results : tuple
+        (sys, inf, eff, gas) from `run_simulation`/`solve_steady_state`, or
+        `SimulationResult.to_tuple()`
+    names : sequence of str, optional
+        KPIs (see `KPI_UNITS`) and ADM1 component IDs (effluent
+        concentration in mg/L) to evaluate, by default all KPIs
+
+    Returns
+    -------
+    dict
+        Values keyed by name; a value that cannot be evaluated is None
+    """
+    _, inf, eff, gas = sim_results
+    names = list(KPI_UNITS) if names is None else list(names)
+    wanted = set(names)
+    kpis = dict.fromkeys(names)
+
+    if wanted & _GAS_KPIS:
+        try:
+            gas_props = calculate_gas_properties(gas)
+            kpis['methane_flow'] = gas_props['methane_flow']
+            kpis['methane_percent'] = gas_props['methane_percent']
+        except Exception as e:
+            sys.stderr.write(f"DEBUG WARNING: Could not calculate gas KPIs: {e}\n")
+
+    if wanted & _COD_KPIS:
+        try:
+            inf_COD = _total_COD(inf)  # mg/L
+            eff_COD = _total_COD(eff)
+            kpis['effluent_COD'] = eff_COD
+            if inf_COD > 0:
+                kpis['COD_removal'] = (inf_COD - eff_COD) / inf_COD * 100
+                COD_load = inf.get_total_flow('m3/d') * inf_COD / 1000  # kg COD/d
+                if kpis.get('methane_flow') is not None and COD_load > 0:
+                    kpis['methane_yield'] = kpis['methane_flow'] / COD_load
+        except Exception as e:
+            sys.stderr.write(f"DEBUG WARNING: Could not calculate COD KPIs: {e}\n")
+
+    if 'total_VFA' in wanted:
+        kpis['total_VFA'] = float(sum(eff.iconc[ID] for ID in VFA_COMPONENTS))
+    for name in wanted & FEEDSTOCK_KEYS:
+        kpis[name] = float(eff.iconc[name])
+
+    if wanted & _INHIBITION_KPIS:
+        # The reactor pH comes from the ADM1 acid-base solution kept with the
+        # inhibition data; the effluent stream's own pH is only a fallback
+        inhibition_data = calculate_inhibition_factors(sim_results)
+        if inhibition_data is not None:
+            kpis['pH'] = float(inhibition_data['pH_Value'])
+            if 'max_inhibition' in wanted:
+                analysis = analyze_inhibition(sim_results)
+                kpis['max_inhibition'] = analysis['health_assessment']['max_inhibition']
+        else:
+            kpis['pH'] = getattr(eff, 'pH', None)
+    sys.stderr.flush()
+    return {name: kpis[name] for name in names}
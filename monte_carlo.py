@@ -0,0 +1,279 @@
+"""
+Monte Carlo uncertainty propagation for ADM1 kinetic parameters
+"""
+import sys
+import bisect
+import inspect
+import numpy as np
+from scipy import stats
+from scipy.stats import qmc
+from qsdsan import processes as pc
+from utils import KINETIC_KEYS
+from kpis import check_outputs
+from parameter_sweep import iter_points, point_row
+
+# KPIs whose running percentiles are reported by default
+DEFAULT_OUTPUTS = ('methane_yield', 'effluent_COD')
+
+# Number of intermediate percentile snapshots kept over a run
+N_SNAPSHOTS = 10
+
+def default_kinetic_value(name):
+    """QSDsan default of a scalar ADM1 kinetic parameter, or None."""
+    param = inspect.signature(pc.ADM1.__new__).parameters.get(name)
+    if param is None or not isinstance(param.default, (int, float)):
+        return None
+    return float(param.default)
+
+def make_distribution(name, spec, nominal=None):
+    """
+    Build a frozen scipy distribution for one uncertain parameter.
+
+    Parameters
+    ----------
+    name : str
+        Parameter name, for error messages
+    spec : dict
+        'dist' is one of:
+
+        - 'uniform': 'low', 'high'
+        - 'loguniform': 'low', 'high' (both positive)
+        - 'triangular': 'low', 'high' and optionally 'mode' (default nominal)
+        - 'normal': 'mean' (default nominal) and 'std' or 'cv'
+        - 'lognormal': 'median' (default nominal) and 'sigma' (of the log) or 'cv'
+
+        Normal samples are truncated at zero.
+    nominal : float, optional
+        Current value of the parameter, used where a location is not given
+
+    Returns
+    -------
+    scipy.stats frozen distribution
+    """
+    if not isinstance(spec, dict):
+        raise ValueError(f"Distribution for '{name}' must be an object with a 'dist' entry.")
+    dist = spec.get('dist', 'uniform')
+
+    def get(key, default=None):
+        value = spec.get(key, default)
+        if value is None:
+            raise ValueError(f"Distribution '{dist}' for '{name}' needs '{key}'.")
+        return float(value)
+
+    if dist == 'uniform':
+        low, high = get('low'), get('high')
+        if high <= low:
+            raise ValueError(f"Uniform distribution for '{name}' needs high > low.")
+        return stats.uniform(loc=low, scale=high - low)
+    if dist == 'loguniform':
+        low, high = get('low'), get('high')
+        if not 0 < low < high:
+            raise ValueError(f"Log-uniform distribution for '{name}' needs 0 < low < high.")
+        return stats.loguniform(low, high)
+    if dist == 'triangular':
+        low, high = get('low'), get('high')
+        mode = get('mode', nominal)
+        if not low <= mode <= high or high <= low:
+            raise ValueError(f"Triangular distribution for '{name}' needs low <= mode <= high.")
+        return stats.triang((mode - low) / (high - low), loc=low, scale=high - low)
+    if dist == 'normal':
+        mean = get('mean', nominal)
+        std = get('std') if 'std' in spec else get('cv') * abs(mean)
+        if std <= 0:
+            raise ValueError(f"Normal distribution for '{name}' needs a positive 'std' or 'cv'.")
+        # Kinetic parameters are non-negative
+        return stats.truncnorm((0 - mean) / std, np.inf, loc=mean, scale=std)
+    if dist == 'lognormal':
+        median = get('median', nominal)
+        if median <= 0:
+            raise ValueError(f"Lognormal distribution for '{name}' needs a positive median.")
+        sigma = get('sigma') if 'sigma' in spec else np.sqrt(np.log(1 + get('cv')**2))
+        if sigma <= 0:
+            raise ValueError(f"Lognormal distribution for '{name}' needs a positive 'sigma' or 'cv'.")
+        return stats.lognorm(sigma, scale=median)
+    raise ValueError(f"Unknown distribution '{dist}' for '{name}'. "
+                     "Use uniform, loguniform, triangular, normal or lognormal.")
+
+def latin_hypercube_samples(distributions, n_samples, seed=None):
+    """
+    Draw Latin hypercube samples of several independent parameters.
+
+    Parameters
+    ----------
+    distributions : dict
+        Parameter name to frozen scipy distribution
+    n_samples : int
+        Number of samples
+    seed : int, optional
+        Random seed, for reproducible samples
+
+    Returns
+    -------
+    list of dict
+        One {parameter: value} dict per sample
+    """
+    names = list(distributions)
+    unit = qmc.LatinHypercube(d=len(names), seed=seed).random(n_samples)
+    columns = [distributions[name].ppf(unit[:, j]) for j, name in enumerate(names)]
+    return [{name: float(column[k]) for name, column in zip(names, columns)}
+            for k in range(n_samples)]
+
+class RunningPercentiles:
+    """
+    Percentiles of a stream of values, updated as each value arrives.
+
+    Values are kept sorted, so percentiles are exact at any point of the run.
+    The median is always tracked, whichever percentiles are reported.
+
+    Parameters
+    ----------
+    percentiles : sequence of float, optional
+        Percentiles to report, by default (5, 50, 95)
+    """
+    def __init__(self, percentiles=(5, 50, 95)):
+        self.percentiles = tuple(percentiles)
+        self.values = []
+
+    def add(self, value):
+        """Add one value; None and NaN are ignored."""
+        if value is not None and np.isfinite(value):
+            bisect.insort(self.values, float(value))
+
+    def summary(self):
+        """
+        Current statistics.
+
+        Returns
+        -------
+        dict
+            'n', 'mean', 'std', 'median' and 'p<percentile>' entries (None
+            while empty)
+        """
+        n = len(self.values)
+        summary = {'n': n, 'mean': None, 'std': None, 'median': None}
+        summary.update({f"p{p:g}": None for p in self.percentiles})
+        if n:
+            values = np.array(self.values)
+            summary['mean'] = float(values.mean())
+            summary['std'] = float(values.std(ddof=1)) if n > 1 else 0.0
+            summary['median'] = float(np.median(values))
+            for p, v in zip(self.percentiles, np.percentile(values, self.percentiles)):
+                summary[f"p{p:g}"] = float(v)
+        return summary
+
+def iter_monte_carlo(base_kwargs, distributions, n_samples=100, outputs=DEFAULT_OUTPUTS,
+                     percentiles=(5, 50, 95), seed=None, mode='dynamic',
+                     parallel_run=True, use_cache=True, engine='individual'):
+    """
+    Propagate kinetic parameter uncertainty through the model.
+
+    Kinetic parameters are sampled by Latin hypercube sampling and the
+    samples are simulated across the worker processes. After every finished
+    sample the running percentiles of the output KPIs are yielded, so a
+    caller can report or stop early as the bands settle.
+
+    Parameters
+    ----------
+    base_kwargs : dict
+        Keyword arguments of the base scenario for `run_simulation` (dynamic
+        mode) or `solve_steady_state` (steady-state mode)
+    distributions : dict
+        Kinetic parameter name to distribution spec, see `make_distribution`.
+        Locations that are not given default to the base scenario's value
+        (or the QSDsan default).
+    n_samples : int, optional
+        Number of samples, by default 100
+    outputs : sequence of str, optional
+        KPIs or effluent components to track, see `kpis.calculate_kpis`; by
+        default methane yield and effluent COD
+    percentiles : sequence of float, optional
+        Percentiles to track, by default (5, 50, 95)
+    seed : int, optional
+        Random seed, for reproducible samples
+    mode : str, optional
+        'dynamic' (default) or 'steady_state', see `parameter_sweep.iter_points`
+    parallel_run : bool, optional
+        Spread the samples over the worker processes, by default True
+    use_cache : bool, optional
+        Serve samples that were simulated before from the result cache,
+        by default True
+    engine : str, optional
+        'individual' (default) or 'ensemble' to integrate batches of
+        samples as one system, see `parameter_sweep.iter_points`
+
+    Yields
+    ------
+    dict
+        'completed', 'failed', 'n_samples', 'last' (the row of the sample
+        that just finished, see `parameter_sweep.point_row`) and 'statistics'
+        (running summary per output)
+    """
+    if not distributions:
+        raise ValueError("No uncertain parameters given.")
+    if n_samples < 2:
+        raise ValueError("Monte Carlo needs at least 2 samples.")
+    check_outputs(outputs)
+
+    base_kinetics = (base_kwargs.get('kinetic_params') or {}) if base_kwargs.get('use_kinetics', True) else {}
+    frozen = {}
+    for name, spec in distributions.items():
+        if name not in KINETIC_KEYS:
+            raise ValueError(f"'{name}' is not a kinetic parameter.")
+        nominal = base_kinetics.get(name, default_kinetic_value(name))
+        frozen[name] = make_distribution(name, spec, nominal)
+    samples = latin_hypercube_samples(frozen, n_samples, seed)
+
+    trackers = {name: RunningPercentiles(percentiles) for name in outputs}
+    completed = failed = 0
+    for i, result, error, from_cache in iter_points(base_kwargs, samples, mode, parallel_run, use_cache,
+                                                     engine=engine):
+        row = point_row(samples[i], result, error, from_cache, outputs)
+        completed += 1
+        if row['success']:
+            for name, tracker in trackers.items():
+                tracker.add(row['kpis'][name])
+        else:
+            failed += 1
+            sys.stderr.write(f"DEBUG WARNING: Monte Carlo sample {i} failed: {row['error']}\n")
+            sys.stderr.flush()
+        yield {
+            'completed': completed,
+            'failed': failed,
+            'n_samples': n_samples,
+            'last': row,
+            'statistics': {name: tracker.summary() for name, tracker in trackers.items()},
+        }
+
+def run_monte_carlo(base_kwargs, distributions, n_samples=100, outputs=DEFAULT_OUTPUTS,
+                    percentiles=(5, 50, 95), seed=None, mode='dynamic',
+                    parallel_run=True, use_cache=True, engine='individual'):
+    """
+    Run `iter_monte_carlo` to completion.
+
+    Parameters are as for `iter_monte_carlo`.
+
+    Returns
+    -------
+    dict
+        'completed', 'failed', 'n_samples', 'statistics' (final summary per
+        output) and 'convergence' (about `N_SNAPSHOTS` intermediate
+        statistics, showing how the bands settled)
+    """
+    every = max(1, n_samples // N_SNAPSHOTS)
+    convergence = []
+    progress = None
+    for progress in iter_monte_carlo(base_kwargs, distributions, n_samples, outputs, percentiles,
+                                     seed, mode, parallel_run, use_cache, engine):
+        done = progress['completed']
+        if done % every == 0 or done == n_samples:
+            medians = {name: summary['median'] for name, summary in progress['statistics'].items()}
+            sys.stderr.write(f"DEBUG: Monte Carlo {done}/{n_samples} samples, running medians {medians}\n")
+            sys.stderr.flush()
+            convergence.append({'completed': done, 'statistics': progress['statistics']})
+    return {
+        'completed': progress['completed'],
+        'failed': progress['failed'],
+        'n_samples': n_samples,
+        'statistics': progress['statistics'],
+        'convergence': convergence,
+    }
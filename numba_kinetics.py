@@ -0,0 +1,782 @@
+"""
+Numba-compiled ADM1 kinetics and AnaerobicCSTR mass balances
+"""
+import sys
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    # Keep the kernels importable (as plain Python) without numba
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
+# Universal gas constant, bar/M/K (as in qsdsan.processes)
+R = 8.3145e-2
+
+# Layout of the scalar parameter vector passed to `adm1_rhs`
+(P_KS_IN, P_KI_NH3, P_KLA, P_T_BASE, P_V_LIQ, P_V_GAS,
+ P_K_P, P_P_ATM, P_P_GAS, P_P_VAPOR, P_FIXED_P, P_ALG_H2) = range(12)
+N_SCALARS = 12
+
+# Layout of the diagnostics vector filled by `adm1_rhs`, mirroring the
+# rate function's root data: pH, Iph (8), Ih2 (4), Iin, Inh3, Monod (8)
+# and the inhibited uptake rates (8)
+N_DIAGNOSTICS = 31
+
+@njit(cache=True)
+def solve_h_ion(weak_acids, Ka, h):
+    """
+    Hydrogen ion concentration (M) from the ADM1 charge balance.
+
+    Safeguarded Newton iteration started from `h` (the previous solution),
+    bracketed in [1e-14, 1] like the QSDsan brenth solve. The charge balance
+    is increasing and concave in h, so Newton steps approach the root from
+    below and rarely need the bisection fallback.
+
+    Parameters
+    ----------
+    weak_acids : numpy.ndarray
+        S_cat, S_an, S_IN, S_IC, S_ac, S_pro, S_bu, S_va in M
+    Ka : numpy.ndarray
+        Kw, Ka_nh, Ka_co2, Ka_ac, Ka_pr, Ka_bu, Ka_va
+    h : float
+        Starting guess in M
+    """
+    lo, hi = 1e-14, 1.0
+    if not lo < h < hi:
+        h = 1e-7
+    for _ in range(100):
+        f = weak_acids[0] - weak_acids[1] + weak_acids[2] + h - Ka[0]/h
+        df = 1.0 + Ka[0]/(h*h)
+        for j in range(1, 7):
+            d = Ka[j] + h
+            f -= Ka[j]*weak_acids[j + 1]/d
+            df += Ka[j]*weak_acids[j + 1]/(d*d)
+        if f < 0:
+            lo = h
+        else:
+            hi = h
+        h_new = h - f/df
+        if not lo < h_new < hi:
+            h_new = np.sqrt(lo*hi)
+        if abs(h_new - h) <= 1e-13*h:
+            return h_new
+        h = h_new
+    return h
+
+@njit(cache=True)
+def solve_h_ion_batch(weak_acids, Ka, h):
+    """
+    `solve_h_ion` for each row of `weak_acids` and `Ka`, in place in `h`.
+
+    Parameters
+    ----------
+    weak_acids : numpy.ndarray
+        n x 8 weak acid totals in M, as for `solve_h_ion`
+    Ka : numpy.ndarray
+        n x 7 acid-base equilibrium constants
+    h : numpy.ndarray
+        n starting guesses in M, overwritten with the solutions
+    """
+    for i in range(weak_acids.shape[0]):
+        h[i] = solve_h_ion(weak_acids[i], Ka[i], h[i])
+    return h
+
+# Positions of S_cat, S_an, S_IN, S_IC, S_ac, S_pro, S_bu, S_va in the ADM1
+# state, in the order of the charge balance
+WEAK_ACID_IDX = np.array([24, 25, 10, 9, 6, 5, 4, 3])
+
+def solve_pH_batch(states, Ka, unit_conversion, h=None):
+    """
+    Hydrogen ion concentrations for a batch of ADM1 states.
+
+    Parameters
+    ----------
+    states : array-like
+        ADM1 states (kg/m3) as rows, or a single state
+    Ka : array-like
+        Acid-base equilibrium constants, shared (7) or per state (n x 7)
+    unit_conversion : numpy.ndarray
+        Mass to molar conversion factors of the components
+    h : array-like, optional
+        Starting guesses in M (e.g. the previous solutions), by default 1e-7
+
+    Returns
+    -------
+    numpy.ndarray
+        Hydrogen ion concentration of each state in M
+    """
+    states = np.atleast_2d(np.asarray(states, dtype=float))
+    n = len(states)
+    weak_acids = np.ascontiguousarray(states[:, WEAK_ACID_IDX]*unit_conversion[WEAK_ACID_IDX])
+    Ka = np.ascontiguousarray(np.broadcast_to(np.asarray(Ka, dtype=float), (n, 7)))
+    h = np.full(n, 1e-7) if h is None else np.array(np.broadcast_to(h, (n,)), dtype=float)
+    return solve_h_ion_batch(weak_acids, Ka, h)
+
+# Last solution of `solve_pH_newton`, its next starting guess
+_h_guess = np.full(1, 1e-7)
+
+def solve_pH_newton(state_arr, Ka, unit_conversion):
+    """
+    Drop-in for QSDsan's ADM1 `solve_pH` on `solve_h_ion`.
+
+    Consecutive calls come from nearby states of one integration, so each
+    Newton solve starts from the previous solution and typically converges
+    in two or three iterations instead of a bracketing Brent search.
+    """
+    weak_acids = state_arr[WEAK_ACID_IDX]*unit_conversion[WEAK_ACID_IDX]
+    h = solve_h_ion(weak_acids, np.asarray(Ka, dtype=float), _h_guess[0])
+    _h_guess[0] = h
+    return h
+
+@njit(cache=True)
+def solve_s_h2(S_h2, production, KIs_h2, uptake, K_h2, M_h2, other, load, D, transfer, p_h2):
+    """
+    Quasi-steady-state S_h2 (kg/m3) from dS_h2/dt = 0 (Rosen & Jeppsson).
+
+    The balance is production by the four H2-inhibited uptakes, uptake by
+    hydrogen degraders, gas transfer and washout; every other rate is held
+    at its current value. It is convex and decreasing in S_h2, so a Newton
+    iteration bracketed in [0, upper bound] converges from any start.
+
+    Parameters
+    ----------
+    S_h2 : float
+        Starting guess (the previous solution)
+    production : numpy.ndarray
+        Rates of the H2-inhibited uptakes without their inhibition term
+    KIs_h2 : numpy.ndarray
+        Their H2 inhibition constants
+    uptake, K_h2 : float
+        Hydrogen uptake rate without its Monod term, and its half-saturation
+    M_h2 : numpy.ndarray
+        S_h2 stoichiometry of the four uptakes, the hydrogen uptake and the
+        gas transfer
+    other : float
+        S_h2 formation by all other processes
+    load, D : float
+        Influent S_h2 load and dilution rate, both per liquid volume
+    transfer, p_h2 : float
+        kLa, and the liquid concentration in equilibrium with the headspace
+    """
+    def balance(S):
+        f = load - D*S + other + M_h2[4]*uptake*S/(K_h2 + S) + M_h2[5]*transfer*(S - p_h2)
+        df = -D + M_h2[4]*uptake*K_h2/((K_h2 + S)**2) + M_h2[5]*transfer
+        for i in range(4):
+            f += M_h2[i]*production[i]*KIs_h2[i]/(KIs_h2[i] + S)
+            df -= M_h2[i]*production[i]*KIs_h2[i]/((KIs_h2[i] + S)**2)
+        return f, df
+
+    f0, df0 = balance(0.0)
+    if f0 <= 0:
+        return 0.0
+    lo, hi = 0.0, f0/(D - M_h2[5]*transfer)
+    if not lo < S_h2 < hi:
+        S_h2 = 0.5*hi
+    for _ in range(100):
+        f, df = balance(S_h2)
+        if f > 0:
+            lo = S_h2
+        else:
+            hi = S_h2
+        S_new = S_h2 - f/df
+        if not lo < S_new < hi:
+            S_new = 0.5*(lo + hi)
+        if abs(S_new - S_h2) <= 1e-13*S_new:
+            return S_new
+        S_h2 = S_new
+    return S_h2
+
+@njit(cache=True)
+def adm1_rhs(y, T, QC_ins, ks, Ks, pH_ULs, pH_LLs, KIs_h2, Ka_base, Ka_dH,
+             KH_base, KH_dH, unit_conv, M, f_rtn, gas_conv, scalars,
+             dy, rhos, diag, work):
+    """
+    ADM1 process rates and AnaerobicCSTR state derivatives.
+
+    Same equations as `qsdsan.processes._adm1._rhos_adm1` and
+    `AnaerobicCSTR._compile_ODE` (differential or algebraic S_h2, variable
+    or fixed headspace pressure, no pH control). With algebraic S_h2 the
+    solution of `solve_s_h2` is written into `y` and its derivative is 0.
+
+    Parameters
+    ----------
+    y : numpy.ndarray
+        Reactor state: 27 liquid components (kg/m3), 3 headspace gases (M), Q
+    T : float
+        Operating temperature in K
+    QC_ins : numpy.ndarray
+        Influent concentrations (mg/L) and flows (m3/d), one row per inlet
+    ks, Ks, pH_ULs, pH_LLs, KIs_h2, Ka_base, Ka_dH, KH_base, KH_dH : numpy.ndarray
+        Rate function parameters, as in the model's `rate_function._params`
+    unit_conv : numpy.ndarray
+        kg/m3 to M conversion per component
+    M : numpy.ndarray
+        Stoichiometry, components x processes
+    f_rtn : numpy.ndarray
+        Retained fraction per component
+    gas_conv : numpy.ndarray
+        kg/m3 to M conversion of the biogas components
+    scalars : numpy.ndarray
+        Scalar parameters, see the P_* indices
+    dy, rhos, diag : numpy.ndarray
+        Outputs: state derivatives, process rates and diagnostics
+    work : numpy.ndarray
+        Scratch space of length 17; work[0] and work[16] carry the last [H+]
+        and algebraic S_h2 between calls
+
+    Returns
+    -------
+    tuple
+        (biogas flow in m3/d, headspace pressure in bar)
+    """
+    n_cmps = unit_conv.shape[0]
+    KS_IN = scalars[P_KS_IN]
+    KI_nh3 = scalars[P_KI_NH3]
+    kLa = scalars[P_KLA]
+    T_base = scalars[P_T_BASE]
+    V_liq = scalars[P_V_LIQ]
+    V_gas = scalars[P_V_GAS]
+
+    # Temperature-corrected acid-base and Henry's law constants
+    Ka = work[1:8]
+    for j in range(7):
+        Ka[j] = Ka_base[j]
+        if T != T_base:
+            Ka[j] *= np.exp(Ka_dH[j]/(R*100)*(1/T_base - 1/T))
+
+    # Uninhibited rates: disintegration, hydrolysis, uptake and decay
+    for i in range(8):
+        rhos[i] = ks[i]*y[12 + i]
+    for i in range(8, 12):
+        rhos[i] = ks[i]*y[11 + i]
+    for i in range(12, 19):
+        rhos[i] = ks[i]*y[4 + i]
+
+    # Substrate limitation and competition between valerate and butyrate
+    for i in range(8):
+        monod = y[i]/(y[i] + Ks[i])
+        diag[15 + i] = monod
+        rhos[4 + i] *= monod
+    S_va, S_bu, S_h2, S_IN = y[3], y[4], y[7], y[10]
+    if S_va > 0:
+        rhos[7] *= 1/(1 + S_bu/S_va)
+    if S_bu > 0:
+        rhos[8] *= 1/(1 + S_va/S_bu)
+
+    # pH from the charge balance, warm-started at the previous solution
+    weak_acids = work[8:16]
+    for k in range(8):
+        i = WEAK_ACID_IDX[k]
+        weak_acids[k] = y[i]*unit_conv[i]
+    h = solve_h_ion(weak_acids, Ka, work[0])
+    work[0] = h
+    nh3 = S_IN*unit_conv[10]*Ka[1]/(Ka[1] + h)
+    co2 = y[9]*h/(Ka[2] + h)
+
+    # Inhibition
+    Iin = S_IN/(S_IN + KS_IN)
+    Inh3 = KI_nh3/(KI_nh3 + nh3)
+    for i in range(8):
+        n = 3/(pH_ULs[i] - pH_LLs[i])
+        K = 10**(-(pH_ULs[i] + pH_LLs[i])/2)
+        Iph = 1/(1 + (h/K)**n)
+        diag[1 + i] = Iph
+        rhos[4 + i] *= Iph*Iin
+    Q = 0.0
+    for r in range(QC_ins.shape[0]):
+        Q += QC_ins[r, n_cmps]
+
+    if scalars[P_ALG_H2] > 0:
+        # S_h2 from its quasi-steady-state balance, all other rates fixed
+        M_h2 = np.empty(6)
+        for i in range(4):
+            M_h2[i] = M[7, 6 + i]
+        M_h2[4] = M[7, 11]
+        M_h2[5] = M[7, 19]
+        other = 0.0
+        for p in range(19):
+            if not (6 <= p <= 9 or p == 11):
+                other += M[7, p]*rhos[p]
+        load = 0.0
+        for r in range(QC_ins.shape[0]):
+            load += QC_ins[r, n_cmps]*QC_ins[r, 7]*1e-3
+        KH = KH_base[0]/unit_conv[7]
+        if T != T_base:
+            KH *= np.exp(KH_dH[0]/(R*100)*(1/T_base - 1/T))
+        uptake = ks[11]*y[22]*diag[8]*Iin
+        S_h2 = solve_s_h2(work[16] if work[16] > 0 else y[7], rhos[6:10], KIs_h2,
+                          uptake, Ks[7], M_h2, other, load/V_liq,
+                          Q*(1 - f_rtn[7])/V_liq, kLa, KH*R*T*y[n_cmps])
+        work[16] = S_h2
+        y[7] = S_h2
+        monod = S_h2/(S_h2 + Ks[7])
+        diag[22] = monod
+        rhos[11] = uptake*monod
+
+    for i in range(4):
+        Ih2 = KIs_h2[i]/(KIs_h2[i] + S_h2)
+        diag[9 + i] = Ih2
+        rhos[6 + i] *= Ih2
+    rhos[10] *= Inh3
+    diag[0] = -np.log10(h)
+    diag[13] = Iin
+    diag[14] = Inh3
+    for i in range(8):
+        diag[23 + i] = rhos[4 + i]
+
+    # Gas-liquid transfer of H2, CH4 and CO2
+    for j in range(3):
+        S_liq = co2 if j == 2 else y[7 + j]
+        KH = KH_base[j]/unit_conv[7 + j]
+        if T != T_base:
+            KH *= np.exp(KH_dH[j]/(R*100)*(1/T_base - 1/T))
+        rhos[19 + j] = kLa*(S_liq - KH*R*T*y[n_cmps + j])
+
+    # Liquid mass balances
+    for i in range(n_cmps):
+        load = 0.0
+        for r in range(QC_ins.shape[0]):
+            load += QC_ins[r, n_cmps]*QC_ins[r, i]*1e-3  # mg/L to kg/m3
+        rxn = 0.0
+        for p in range(rhos.shape[0]):
+            rxn += M[i, p]*rhos[p]
+        dy[i] = (load - Q*y[i]*(1 - f_rtn[i]))/V_liq + rxn
+    if scalars[P_ALG_H2] > 0:
+        dy[7] = 0.0
+
+    # Headspace
+    if scalars[P_FIXED_P] > 0:
+        P = scalars[P_P_GAS]
+        transfer = 0.0
+        for j in range(3):
+            transfer += rhos[19 + j]*gas_conv[j]
+        q_gas = R*T/(P - scalars[P_P_VAPOR])*V_liq*transfer
+    else:
+        P = scalars[P_P_VAPOR]
+        for j in range(3):
+            P += y[n_cmps + j]*R*T
+        q_gas = max(0.0, scalars[P_K_P]*(P - scalars[P_P_ATM]))
+    for j in range(3):
+        dy[n_cmps + j] = -q_gas*y[n_cmps + j]/V_gas + rhos[19 + j]*V_liq/V_gas*gas_conv[j]
+    dy[n_cmps + 3] = 0.0
+    return q_gas, P
+
+@njit(cache=True)
+def adm1_jacobian(y, T, QC_ins, ks, Ks, pH_ULs, pH_LLs, KIs_h2, Ka_base, Ka_dH,
+                  KH_base, KH_dH, unit_conv, M, f_rtn, gas_conv, scalars,
+                  J, D, work):
+    """
+    Analytic Jacobian of the state derivatives of `adm1_rhs`.
+
+    Every process rate is a product of factors (rate constant times
+    biomass, Monod terms, competition, inhibition), differentiated by the
+    product rule. The pH depends on all weak acids and cations through the
+    charge balance; its sensitivities follow from implicit differentiation,
+    dh/dy = -(df/dy)/(df/dh), and enter through the pH and ammonia
+    inhibition and the dissolved CO2.
+
+    Parameters
+    ----------
+    y, T, QC_ins, ... scalars
+        As for `adm1_rhs`
+    J : numpy.ndarray
+        Output, state x state
+    D : numpy.ndarray
+        Scratch space for the rate sensitivities, processes x state
+    work : numpy.ndarray
+        Scratch space of length 16; work[0] carries the last [H+] between calls
+    """
+    n_cmps = unit_conv.shape[0]
+    n_state = J.shape[0]
+    n_rxn = M.shape[1]
+    KS_IN = scalars[P_KS_IN]
+    KI_nh3 = scalars[P_KI_NH3]
+    kLa = scalars[P_KLA]
+    T_base = scalars[P_T_BASE]
+    V_liq = scalars[P_V_LIQ]
+    V_gas = scalars[P_V_GAS]
+
+    Ka = work[1:8]
+    for j in range(7):
+        Ka[j] = Ka_base[j]
+        if T != T_base:
+            Ka[j] *= np.exp(Ka_dH[j]/(R*100)*(1/T_base - 1/T))
+    weak_acids = work[8:16]
+    for k in range(8):
+        i = WEAK_ACID_IDX[k]
+        weak_acids[k] = y[i]*unit_conv[i]
+    h = solve_h_ion(weak_acids, Ka, work[0])
+    work[0] = h
+
+    # Sensitivity of [H+] to the state, from the charge balance
+    df_dh = 1.0 + Ka[0]/(h*h)
+    for j in range(1, 7):
+        df_dh += Ka[j]*weak_acids[j + 1]/((Ka[j] + h)**2)
+    dh = np.zeros(n_state)
+    dh[24] = -unit_conv[24]/df_dh
+    dh[25] = unit_conv[25]/df_dh
+    dh[10] = -h/(Ka[1] + h)*unit_conv[10]/df_dh
+    for j, i in enumerate((9, 6, 5, 4, 3)):
+        dh[i] = Ka[j + 2]/(Ka[j + 2] + h)*unit_conv[i]/df_dh
+
+    S_va, S_bu, S_h2, S_IN = y[3], y[4], y[7], y[10]
+    nh3 = S_IN*unit_conv[10]*Ka[1]/(Ka[1] + h)
+    dnh3_dSIN = unit_conv[10]*Ka[1]/(Ka[1] + h)
+    dnh3_dh = -S_IN*unit_conv[10]*Ka[1]/((Ka[1] + h)**2)
+    Iin = S_IN/(S_IN + KS_IN)
+    dIin = KS_IN/((S_IN + KS_IN)**2)
+    Inh3 = KI_nh3/(KI_nh3 + nh3)
+    dInh3 = -KI_nh3/((KI_nh3 + nh3)**2)
+
+    D[:, :] = 0.0
+    # Disintegration, hydrolysis and decay are first order in one state
+    for i in range(4):
+        D[i, 12 + i] = ks[i]
+    for i in range(12, 19):
+        D[i, 4 + i] = ks[i]
+
+    # Uptake: k X Monod(S) C Iph(h) Iin(S_IN) Ih2(S_h2) Inh3(S_IN, h)
+    for i in range(4, 12):
+        X_idx = 12 + i if i < 8 else 11 + i
+        S_idx = i - 4
+        S, K_S = y[S_idx], Ks[i - 4]
+        f1 = ks[i]*y[X_idx]
+        f2 = S/(S + K_S)
+        f3 = 1.0
+        dC_va = dC_bu = 0.0
+        if i == 7 and S_va > 0:
+            tot = S_va + S_bu
+            f3 = S_va/tot
+            dC_va, dC_bu = S_bu/(tot*tot), -S_va/(tot*tot)
+        elif i == 8 and S_bu > 0:
+            tot = S_va + S_bu
+            f3 = S_bu/tot
+            dC_va, dC_bu = -S_bu/(tot*tot), S_va/(tot*tot)
+        n = 3/(pH_ULs[i - 4] - pH_LLs[i - 4])
+        K = 10**(-(pH_ULs[i - 4] + pH_LLs[i - 4])/2)
+        f4 = 1/(1 + (h/K)**n)
+        df4_dh = -n*f4*(1 - f4)/h
+        f5 = Iin
+        f6 = 1.0
+        df6 = 0.0
+        if 6 <= i <= 9:
+            KI = KIs_h2[i - 6]
+            f6 = KI/(KI + S_h2)
+            df6 = -KI/((KI + S_h2)**2)
+        f7 = Inh3 if i == 10 else 1.0
+
+        D[i, X_idx] += ks[i]*f2*f3*f4*f5*f6*f7
+        D[i, S_idx] += f1*K_S/((S + K_S)**2)*f3*f4*f5*f6*f7
+        D[i, 3] += f1*f2*dC_va*f4*f5*f6*f7
+        D[i, 4] += f1*f2*dC_bu*f4*f5*f6*f7
+        D[i, 10] += f1*f2*f3*f4*dIin*f6*f7
+        D[i, 7] += f1*f2*f3*f4*f5*df6*f7
+        drho_dh = f1*f2*f3*df4_dh*f5*f6*f7
+        if i == 10:
+            D[i, 10] += f1*f2*f3*f4*f5*f6*dInh3*dnh3_dSIN
+            drho_dh += f1*f2*f3*f4*f5*f6*dInh3*dnh3_dh
+        for k in range(n_state):
+            D[i, k] += drho_dh*dh[k]
+
+    # Gas-liquid transfer; dissolved CO2 depends on the pH
+    rho_gas = np.zeros(3)
+    Ka_co2 = Ka[2]
+    for j in range(3):
+        KH = KH_base[j]/unit_conv[7 + j]
+        if T != T_base:
+            KH *= np.exp(KH_dH[j]/(R*100)*(1/T_base - 1/T))
+        S_liq = y[9]*h/(Ka_co2 + h) if j == 2 else y[7 + j]
+        rho_gas[j] = kLa*(S_liq - KH*R*T*y[n_cmps + j])
+        D[19 + j, n_cmps + j] = -kLa*KH*R*T
+    D[19, 7] = kLa
+    D[20, 8] = kLa
+    D[21, 9] = kLa*h/(Ka_co2 + h)
+    dco2_dh = y[9]*Ka_co2/((Ka_co2 + h)**2)
+    for k in range(n_state):
+        D[21, k] += kLa*dco2_dh*dh[k]
+
+    # Liquid balances
+    J[:, :] = 0.0
+    Q = 0.0
+    for r in range(QC_ins.shape[0]):
+        Q += QC_ins[r, n_cmps]
+    for i in range(n_cmps):
+        for k in range(n_state):
+            acc = 0.0
+            for p in range(n_rxn):
+                acc += M[i, p]*D[p, k]
+            J[i, k] = acc
+        J[i, i] -= Q*(1 - f_rtn[i])/V_liq
+
+    # Headspace balances
+    dq = np.zeros(n_state)
+    if scalars[P_FIXED_P] > 0:
+        c = R*T/(scalars[P_P_GAS] - scalars[P_P_VAPOR])*V_liq
+        q_gas = 0.0
+        for j in range(3):
+            q_gas += c*rho_gas[j]*gas_conv[j]
+            for k in range(n_state):
+                dq[k] += c*gas_conv[j]*D[19 + j, k]
+    else:
+        P = scalars[P_P_VAPOR]
+        for j in range(3):
+            P += y[n_cmps + j]*R*T
+        q_gas = max(0.0, scalars[P_K_P]*(P - scalars[P_P_ATM]))
+        if q_gas > 0:
+            for j in range(3):
+                dq[n_cmps + j] = scalars[P_K_P]*R*T
+    for j in range(3):
+        r = n_cmps + j
+        for k in range(n_state):
+            J[r, k] = -dq[k]*y[r]/V_gas + D[19 + j, k]*V_liq/V_gas*gas_conv[j]
+        J[r, r] -= q_gas/V_gas
+
+@njit(cache=True)
+def adm1_rhs_batch(Y, T, QC_ins, ks, Ks, pH_ULs, pH_LLs, KIs_h2, Ka_base, Ka_dH,
+                   KH_base, KH_dH, unit_conv, M, f_rtn, gas_conv, scalars,
+                   dY, rhos, diag, work, q_gas, P):
+    """
+    `adm1_rhs` for an ensemble of reactors, one member per row of `Y`.
+
+    Every other argument has the member axis first and is otherwise as in
+    `adm1_rhs`; the biogas flows and headspace pressures are written into
+    `q_gas` and `P`.
+    """
+    for m in range(Y.shape[0]):
+        q_gas[m], P[m] = adm1_rhs(Y[m], T[m], QC_ins[m], ks[m], Ks[m], pH_ULs[m], pH_LLs[m],
+                                  KIs_h2[m], Ka_base[m], Ka_dH[m], KH_base[m], KH_dH[m],
+                                  unit_conv[m], M[m], f_rtn[m], gas_conv[m], scalars[m],
+                                  dY[m], rhos[m], diag[m], work[m])
+
+@njit(cache=True)
+def adm1_jacobian_batch(Y, T, QC_ins, ks, Ks, pH_ULs, pH_LLs, KIs_h2, Ka_base, Ka_dH,
+                        KH_base, KH_dH, unit_conv, M, f_rtn, gas_conv, scalars,
+                        J, D, work):
+    """
+    `adm1_jacobian` for an ensemble of reactors, one member per row of `Y`,
+    filling the diagonal blocks `J[m]`.
+    """
+    for m in range(Y.shape[0]):
+        adm1_jacobian(Y[m], T[m], QC_ins[m], ks[m], Ks[m], pH_ULs[m], pH_LLs[m],
+                      KIs_h2[m], Ka_base[m], Ka_dH[m], KH_base[m], KH_dH[m],
+                      unit_conv[m], M[m], f_rtn[m], gas_conv[m], scalars[m],
+                      J[m], D[m], work[m])
+
+def supports(unit):
+    """Whether `compile_reactor_ode` covers this reactor's configuration."""
+    model = unit.model
+    return (model is not None and not model._dyn_params
+            and not unit.pH_ctrl and len(model._biogas_IDs) == 3
+            and model.rate_function.params.get('root') is not None)
+
+def _kernel_args(unit):
+    """Parameter arguments of `adm1_rhs`/`adm1_jacobian` for a reactor, from `unit_conv` on."""
+    model = unit.model
+    params = model.rate_function.params
+    cmps = unit.components
+    unit_conv = np.ascontiguousarray(cmps.i_mass/cmps.chem_MW, dtype=float)
+    M = np.ascontiguousarray(model.stoichio_eval().T, dtype=float)
+    f_rtn = np.ascontiguousarray(unit._f_retain, dtype=float)
+    gas_conv = unit_conv[unit._gas_cmp_idx].copy()
+    scalars = np.zeros(N_SCALARS)
+    scalars[P_KS_IN] = params['KS_IN']
+    scalars[P_KI_NH3] = params['KI_nh3']
+    scalars[P_KLA] = params['kLa']
+    scalars[P_T_BASE] = params['T_base']
+    scalars[P_V_LIQ] = unit.V_liq
+    scalars[P_V_GAS] = unit.V_gas
+    scalars[P_K_P] = unit.pipe_resistance
+    scalars[P_P_ATM] = unit.external_P
+    scalars[P_P_GAS] = unit.headspace_P
+    scalars[P_P_VAPOR] = unit.p_vapor(convert_to_bar=True)
+    scalars[P_FIXED_P] = float(unit.fixed_headspace_P)
+    scalars[P_ALG_H2] = float(unit.algebraic_h2)
+    return unit_conv, M, f_rtn, gas_conv, scalars
+
+def _rate_arrays(unit):
+    """Rate function parameter arrays, in the order `adm1_rhs` takes them."""
+    params = unit.model.rate_function.params
+    return tuple(np.ascontiguousarray(params[key], dtype=float) for key in (
+        'rate_constants', 'half_sat_coeffs', 'pH_ULs', 'pH_LLs', 'KIs_h2',
+        'Ka_base', 'Ka_dH', 'K_H_base', 'K_H_dH'))
+
+def compile_reactor_ode(unit):
+    """
+    Build a drop-in replacement for an AnaerobicCSTR's `ODE` on `adm1_rhs`.
+
+    Rate parameters, volumes and the stoichiometry are read when the
+    function is built, so it must be rebuilt after they change (the
+    reactor discards its ODE whenever its cache is reset). Besides the
+    state derivatives it keeps the rate function's root data and the
+    reactor's biogas flow and headspace pressure up to date, as the QSDsan
+    ODE does.
+
+    Parameters
+    ----------
+    unit : AnaerobicCSTR
+        Reactor with an ADM1 model and an initialized state, see `supports`
+
+    Returns
+    -------
+    callable
+        dy_dt(t, QC_ins, QC, dQC_ins), writing into `unit._dstate`
+    """
+    arrays = _rate_arrays(unit)
+    unit_conv, M, f_rtn, gas_conv, scalars = _kernel_args(unit)
+    n_state = len(unit.components) + 4
+    dstate = unit._dstate
+    rhos = np.zeros(M.shape[1])
+    diag = np.zeros(N_DIAGNOSTICS)
+    work = np.zeros(17)
+    root = unit.model.rate_function.params['root']
+    has_exo = bool(len(unit._exovars))
+    f_exo = unit.eval_exo_dynamic_vars
+    update_dstate = unit._update_dstate
+    fixed_P = unit.fixed_headspace_P
+
+    def dy_dt(t, QC_ins, QC, dQC_ins):
+        T = f_exo(t)[0] if has_exo else unit.T
+        q_gas, P = adm1_rhs(QC[:n_state], T, QC_ins, *arrays, unit_conv, M, f_rtn,
+                            gas_conv, scalars, dstate, rhos, diag, work)
+        unit._q_gas = q_gas
+        if not fixed_P:
+            unit._P_gas = P
+        root.data = {
+            'pH': diag[0],
+            'Iph': diag[1:9].copy(),
+            'Ih2': diag[9:13].copy(),
+            'Iin': diag[13],
+            'Inh3': diag[14],
+            'Monod': diag[15:23].copy(),
+            'rhos': diag[23:31].copy(),
+        }
+        update_dstate()
+
+    return dy_dt
+
+def compile_reactor_jacobian(unit):
+    """
+    Build the Jacobian of an AnaerobicCSTR's state derivatives on `adm1_jacobian`.
+
+    As with `compile_reactor_ode`, parameters are read when the function is
+    built. The state is clipped like the reactor clips it before every
+    derivative evaluation.
+
+    Parameters
+    ----------
+    unit : AnaerobicCSTR
+        Reactor with an ADM1 model and an initialized state, see `supports`,
+        and differential S_h2
+
+    Returns
+    -------
+    callable
+        jac(t, y) for `solve_ivp`, y being the reactor state vector
+    """
+    arrays = _rate_arrays(unit)
+    unit_conv, M, f_rtn, gas_conv, scalars = _kernel_args(unit)
+    n_state = len(unit.components) + 4
+    D = np.zeros((M.shape[1], n_state))
+    work = np.zeros(16)
+    has_exo = bool(len(unit._exovars))
+    f_exo = unit.eval_exo_dynamic_vars
+
+    def jac(t, y):
+        T = f_exo(t)[0] if has_exo else unit.T
+        state = np.where(y < 1e-16, 0., y)  # as AnaerobicCSTR._update_state
+        J = np.zeros((n_state, n_state))
+        adm1_jacobian(state, T, unit._ins_QC, *arrays, unit_conv, M, f_rtn,
+                      gas_conv, scalars, J, D, work)
+        J[:, y < 0] = 0.  # the clipped derivatives do not depend on negative states
+        return J
+
+    return jac
+
+def evaluate_states(unit, t, states, influent=None):
+    """
+    Evaluate `adm1_rhs` at reactor states, e.g. the output of an integration.
+
+    Parameters
+    ----------
+    unit : AnaerobicCSTR
+        Reactor the states belong to, see `supports`
+    t : numpy.ndarray
+        Times of the states in days
+    states : numpy.ndarray
+        Reactor state vectors as rows
+    influent : callable, optional
+        Influent vectors at times `t` as rows, e.g. an
+        `dynamic_influent.InfluentSeries`, by default the reactor's current
+        influent
+
+    Returns
+    -------
+    tuple
+        (clipped states with the algebraic S_h2 solution where used, biogas
+        flows in m3/d)
+    """
+    arrays = _rate_arrays(unit)
+    unit_conv, M, f_rtn, gas_conv, scalars = _kernel_args(unit)
+    states = np.where(states < 1e-16, 0., states)  # as AnaerobicCSTR._update_state
+    dy = np.zeros(states.shape[1])
+    rhos = np.zeros(M.shape[1])
+    diag = np.zeros(N_DIAGNOSTICS)
+    work = np.zeros(17)
+    q_gas = np.empty(len(states))
+    has_exo = bool(len(unit._exovars))
+    QC_ins = unit._ins_QC.copy()
+    rows = None if influent is None else influent(t)
+    for k in range(len(states)):
+        T = unit.eval_exo_dynamic_vars(t[k])[0] if has_exo else unit.T
+        if rows is not None:
+            QC_ins[0] = rows[k]
+        q_gas[k], _ = adm1_rhs(states[k], T, QC_ins, *arrays, unit_conv, M, f_rtn,
+                               gas_conv, scalars, dy, rhos, diag, work)
+    return states, q_gas
+
+def check_reactor_ode(unit, ode, t=0.0):
+    """
+    Compare an ODE function with the reactor's QSDsan ODE at its current state.
+
+    Parameters
+    ----------
+    unit : AnaerobicCSTR
+        Reactor with an initialized state
+    ode : callable
+        Candidate ODE, e.g. from `compile_reactor_ode`
+    t : float, optional
+        Time at which to evaluate, by default 0
+
+    Returns
+    -------
+    float
+        Largest difference between the two derivative vectors, relative to
+        the reference derivative plus the state's washout rate. Derivatives
+        near a balance point are small differences of large terms; the
+        washout rate keeps their comparison to the size of those terms.
+    """
+    args = (t, unit._ins_QC, unit._state, unit._ins_dQC)
+    state = unit._state.copy()
+    q_gas, P_gas = unit._q_gas, unit._P_gas
+    unit._ODE = None
+    unit.ODE(*args)
+    reference = unit._dstate.copy()
+    n_cmps = len(unit.components)
+    washout = np.abs(state)*unit._ins_QC[:, -1].sum()/unit.V_liq
+    washout[n_cmps:n_cmps + 3] = np.abs(state[n_cmps:n_cmps + 3])*unit._q_gas/unit.V_gas
+    washout[n_cmps + 3:] = 0
+    unit._state[:] = state
+    ode(*args)
+    candidate = unit._dstate.copy()
+    unit._state[:] = state
+    unit._q_gas, unit._P_gas = q_gas, P_gas
+    error = float(np.max(np.abs(candidate - reference)/(np.abs(reference) + washout + 1e-12)))
+    sys.stderr.write(f"DEBUG: Numba ADM1 kernel checked against QSDsan, max relative difference {error:.2e}\n")
+    sys.stderr.flush()
+    return error
@@ -0,0 +1,108 @@
+"""
+Process-pool execution of ADM1 simulations
+"""
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+# Number of worker processes (0 or unset lets the executor use all cores)
+MAX_WORKERS = int(os.environ.get('ADM1_MAX_WORKERS', 0)) or None
+
+_executor = None
+
+def _init_worker():
+    """Prepare a worker process: keep stdout clean and load ADM1 components."""
+    # stdout carries the MCP stdio protocol in the parent; anything a worker
+    # prints must go to stderr instead
+    sys.stdout = sys.stderr
+    from qsdsan import processes as pc
+    pc.create_adm1_cmps()
+
+def get_executor():
+    """Return the shared process pool, creating it on first use."""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS, initializer=_init_worker)
+    return _executor
+
+def shutdown_executor():
+    """Shut down the shared process pool (it is recreated on next use)."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+def simulate_to_result(kwargs):
+    """
+    Worker entry point: run one simulation and return a compact result.
+
+    Parameters
+    ----------
+    kwargs : dict
+        Keyword arguments for `simulation.run_simulation`
+
+    Returns
+    -------
+    SimulationResult
+    """
+    from simulation import run_simulation
+    from results import SimulationResult
+    return SimulationResult.from_system(*run_simulation(**kwargs), release=True)
+
+def map_unordered(func, items):
+    """
+    Run `func` over `items` in the process pool, yielding results as they finish.
+
+    Parameters
+    ----------
+    func : callable
+        Picklable, module-level function of one argument
+    items : list
+        Arguments for `func`
+
+    Yields
+    ------
+    tuple
+        (index into `items`, result or None, exception or None)
+
+    Raises
+    ------
+    BrokenProcessPool
+        If the pool dies; it is discarded so the next call starts a fresh one.
+    """
+    executor = get_executor()
+    try:
+        futures = {executor.submit(func, item): i for i, item in enumerate(items)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                yield i, future.result(), None
+            except BrokenProcessPool:
+                raise
+            except Exception as e:
+                yield i, None, e
+    except BrokenProcessPool:
+        shutdown_executor()
+        raise
+
+def run_simulations_parallel(scenario_kwargs):
+    """
+    Run several simulations across the process pool.
+
+    Wall time scales with the slowest scenario rather than the sum of all.
+
+    Parameters
+    ----------
+    scenario_kwargs : list of dict
+        Keyword arguments for `simulation.run_simulation`, one dict per scenario
+
+    Returns
+    -------
+    list
+        (SimulationResult or None, exception or None) per scenario, in order
+    """
+    outcomes = [(None, None)] * len(scenario_kwargs)
+    for i, result, error in map_unordered(simulate_to_result, scenario_kwargs):
+        outcomes[i] = (result, error)
+    return outcomes
@@ -0,0 +1,437 @@
+"""
+Parameter sweeps over ADM1 reactor scenarios
+"""
+import os
+import sys
+import itertools
+import numpy as np
+import parallel
+from utils import FEEDSTOCK_KEYS, KINETIC_KEYS
+from simulation import _split_kinetics, _kinetics_key, select_integration_method
+from results import SimulationResult
+from result_cache import result_key, get_cached_result, put_cached_result
+from kpis import calculate_kpis
+
+# Parameters that describe the reactor scenario rather than the influent or kinetics
+SCENARIO_KEYS = ('Q', 'Temp', 'HRT')
+
+# Upper limit on the number of points in one sweep
+MAX_SWEEP_POINTS = int(os.environ.get('ADM1_MAX_SWEEP_POINTS', 500))
+
+# Sweep points are simulated on their own cached flowsheet in every process
+SWEEP_CACHE_SLOT = 'sweep'
+
+# Sweep modes and the simulation function behind each
+SWEEP_MODES = {
+    'dynamic': 'run_simulation',
+    'steady_state': 'solve_steady_state',
+}
+
+# Sweep engines: 'individual' simulates the points one by one, 'ensemble'
+# integrates batches of dynamic points together as one stacked system
+SWEEP_ENGINES = ('individual', 'ensemble')
+
+def _check_size(n_points, max_points=None):
+    if max_points is None and n_points > MAX_SWEEP_POINTS:
+        raise ValueError(f"Sweep has {n_points} points, more than the limit of {MAX_SWEEP_POINTS} "
+                         "(ADM1_MAX_SWEEP_POINTS).")
+    if max_points is not None and n_points > max_points:
+        raise ValueError(f"{n_points} points are more than the limit of {max_points}.")
+
+def expand_values(name, spec):
+    """
+    Turn the values given for one swept parameter into a list.
+
+    Parameters
+    ----------
+    name : str
+        Parameter name, for error messages
+    spec : float, list or dict
+        A single value, a list of values, or {'start', 'stop', 'num'} for
+        evenly spaced values (add 'log': true for logarithmic spacing)
+
+    Returns
+    -------
+    list of float
+    """
+    if isinstance(spec, dict):
+        try:
+            start, stop = float(spec['start']), float(spec['stop'])
+            num = int(spec.get('num', 5))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Range for '{name}' needs numeric 'start' and 'stop' (and optionally 'num').")
+        if num < 1:
+            raise ValueError(f"Range for '{name}' needs at least one point.")
+        if spec.get('log', False):
+            if start <= 0 or stop <= 0:
+                raise ValueError(f"Logarithmic range for '{name}' needs positive bounds.")
+            return [float(v) for v in np.geomspace(start, stop, num)]
+        return [float(v) for v in np.linspace(start, stop, num)]
+    values = spec if isinstance(spec, (list, tuple, np.ndarray)) else [spec]
+    try:
+        values = [float(v) for v in values]
+    except (TypeError, ValueError):
+        raise ValueError(f"Values for '{name}' must be numeric.")
+    if not values:
+        raise ValueError(f"No values given for '{name}'.")
+    return values
+
+def expand_grid(parameters, combine='grid'):
+    """
+    Expand swept parameter values into sweep points.
+
+    Parameters
+    ----------
+    parameters : dict
+        Parameter name to values, see `expand_values`
+    combine : str, optional
+        'grid' for every combination of the values (default), or 'zip' to
+        pair the i-th values of all parameters (all lists the same length)
+
+    Returns
+    -------
+    list of dict
+        One {parameter: value} dict per sweep point
+    """
+    if not parameters:
+        raise ValueError("No parameters to sweep.")
+    names = list(parameters)
+    values = [expand_values(name, parameters[name]) for name in names]
+    if combine == 'grid':
+        _check_size(int(np.prod([len(v) for v in values])))
+        combos = itertools.product(*values)
+    elif combine == 'zip':
+        lengths = set(len(v) for v in values)
+        if len(lengths) > 1:
+            raise ValueError("With combine='zip' every parameter needs the same number of values.")
+        combos = zip(*values)
+    else:
+        raise ValueError(f"Unknown combine mode '{combine}'. Use 'grid' or 'zip'.")
+    return [dict(zip(names, combo)) for combo in combos]
+
+def point_kwargs(base_kwargs, point):
+    """
+    Simulation keyword arguments for one sweep point.
+
+    Parameters
+    ----------
+    base_kwargs : dict
+        Keyword arguments of the base scenario
+    point : dict
+        Swept parameter values; Q, Temp and HRT set the scenario, feedstock
+        keys the influent concentrations and kinetic keys the kinetics
+
+    Returns
+    -------
+    dict
+    """
+    kwargs = dict(base_kwargs)
+    concentrations = dict(kwargs.get('concentrations') or {})
+    kinetic_params = dict(kwargs.get('kinetic_params') or {}) if kwargs.get('use_kinetics', True) else {}
+    for name, value in point.items():
+        if name in SCENARIO_KEYS:
+            kwargs[name] = value
+        elif name in FEEDSTOCK_KEYS:
+            concentrations[name] = value
+        elif name in KINETIC_KEYS:
+            kinetic_params[name] = value
+            kwargs['use_kinetics'] = True
+        else:
+            raise ValueError(f"Cannot sweep '{name}'. Use Q, Temp, HRT, a feedstock component or a kinetic parameter.")
+    kwargs['concentrations'] = concentrations
+    kwargs['kinetic_params'] = kinetic_params
+    kwargs['cache_slot'] = SWEEP_CACHE_SLOT
+    return kwargs
+
+def resolve_method(base_kwargs, engine='individual'):
+    """
+    Resolve integration method 'auto' once for a sweep.
+
+    The method is chosen from pilot runs of the base scenario (see
+    `simulation.select_integration_method`) before the points are hashed
+    and sent to the workers, so the result cache is keyed on the method
+    that runs and the workers do not repeat the pilots. Ensembles integrate
+    with BDF.
+
+    Parameters
+    ----------
+    base_kwargs : dict
+        Keyword arguments of the base scenario
+    engine : str, optional
+        Sweep engine, see `iter_points`
+
+    Returns
+    -------
+    dict
+        `base_kwargs`, with the chosen method if it was 'auto'
+    """
+    if base_kwargs.get('method') != 'auto':
+        return base_kwargs
+    if engine == 'ensemble':
+        return dict(base_kwargs, method='BDF')
+    try:
+        method = select_integration_method(
+            base_kwargs['Q'], base_kwargs['Temp'], base_kwargs['HRT'], base_kwargs.get('concentrations'),
+            base_kwargs.get('kinetic_params'), base_kwargs.get('use_kinetics', True),
+            backend=base_kwargs.get('backend'), algebraic_h2=base_kwargs.get('algebraic_h2', False)
+        )['method']
+    except Exception as e:
+        sys.stderr.write(f"DEBUG WARNING: Automatic method selection failed ({e}); using BDF.\n")
+        sys.stderr.flush()
+        method = 'BDF'
+    return dict(base_kwargs, method=method)
+
+def simulate_batch(job):
+    """
+    Worker entry point: simulate a batch of sweep points one after another.
+
+    In steady-state mode each solve starts from the previous point's
+    solution, which is close by when neighbouring grid points share a batch.
+    The starting state is not part of the point's result key, so a cached
+    steady state can differ from a cold solve of the same point within the
+    solver tolerance, depending on which point ran before it.
+
+    Parameters
+    ----------
+    job : tuple
+        (mode, [(index, kwargs), ...])
+
+    Returns
+    -------
+    list
+        (index, SimulationResult or None, exception or None) per point
+    """
+    from simulation import run_simulation, solve_steady_state
+    mode, items = job
+    simulate = solve_steady_state if mode == 'steady_state' else run_simulation
+    outcomes = []
+    previous_state = None
+    for i, kwargs in items:
+        try:
+            if mode == 'steady_state' and previous_state is not None:
+                kwargs = dict(kwargs, initial_state=previous_state)
+            result = SimulationResult.from_system(*simulate(**kwargs), release=True)
+            previous_state = result.reactor_state
+            outcomes.append((i, result, None))
+        except Exception as e:
+            outcomes.append((i, None, e))
+    return outcomes
+
+def simulate_ensemble_batch(job):
+    """
+    Worker entry point: integrate a batch of dynamic sweep points as one
+    ensemble (see `ensemble.simulate_ensemble`).
+
+    Points the ensemble cannot take, or that fail in it, are simulated on
+    their own.
+
+    Parameters
+    ----------
+    job : tuple
+        (mode, [(index, kwargs), ...]), mode being 'dynamic'
+
+    Returns
+    -------
+    list
+        (index, SimulationResult or None, exception or None) per point
+    """
+    from ensemble import simulate_ensemble
+    mode, items = job
+    try:
+        results = simulate_ensemble([kwargs for _, kwargs in items])
+    except Exception as e:
+        sys.stderr.write(f"DEBUG WARNING: Ensemble integration failed ({e}); simulating the points one by one.\n")
+        sys.stderr.flush()
+        return simulate_batch(job)
+    outcomes = []
+    for (i, kwargs), (result, error) in zip(items, results):
+        if result is None:
+            (_, result, error), = simulate_batch((mode, [(i, kwargs)]))
+        outcomes.append((i, result, error))
+    return outcomes
+
+def _make_batches(indices, kwargs_list, n_batches):
+    """
+    Split sweep points into contiguous batches.
+
+    Points that need the same compiled model are kept together, so a worker
+    compiles each model once rather than once per point.
+    """
+    order = sorted(indices, key=lambda i: repr(_kinetics_key(
+        _split_kinetics(kwargs_list[i]['kinetic_params'], kwargs_list[i]['use_kinetics'])[0])))
+    return [[int(i) for i in batch] for batch in np.array_split(order, min(n_batches, len(order))) if len(batch)]
+
+def iter_points(base_kwargs, points, mode='dynamic', parallel_run=True, use_cache=True,
+                max_points=None, engine='individual'):
+    """
+    Simulate sweep points, yielding each result as soon as it is available.
+
+    Cached points come first, then the rest in order of completion.
+
+    Parameters
+    ----------
+    base_kwargs : dict
+        Keyword arguments of the base scenario for `run_simulation` (dynamic
+        mode) or `solve_steady_state` (steady-state mode)
+    points : list of dict
+        Swept parameter values per point, see `point_kwargs`
+    mode : str, optional
+        'dynamic' to integrate each point (default) or 'steady_state' to
+        solve for its steady state directly
+    parallel_run : bool, optional
+        Spread the points over the worker processes, by default True
+    use_cache : bool, optional
+        Serve points that were simulated before from the result cache,
+        by default True
+    max_points : int, optional
+        Limit on the number of points, by default MAX_SWEEP_POINTS
+    engine : str, optional
+        'individual' (default) to simulate each point on its own, or
+        'ensemble' (dynamic mode) to integrate up to
+        `ensemble.MAX_ENSEMBLE_SIZE` points at a time as one system
+
+    Yields
+    ------
+    tuple
+        (index into `points`, SimulationResult or None, exception or None, from cache)
+    """
+    if mode not in SWEEP_MODES:
+        raise ValueError(f"Unknown sweep mode '{mode}'. Use 'dynamic' or 'steady_state'.")
+    if engine not in SWEEP_ENGINES:
+        raise ValueError(f"Unknown sweep engine '{engine}'. Use one of {SWEEP_ENGINES}.")
+    if engine == 'ensemble' and mode != 'dynamic':
+        raise ValueError("The ensemble engine integrates dynamic runs; use mode='dynamic'.")
+    _check_size(len(points), max_points)
+    base_kwargs = resolve_method(base_kwargs, engine)
+    kwargs_list = [point_kwargs(base_kwargs, point) for point in points]
+    keys = [result_key(kwargs, kind=SWEEP_MODES[mode], engine=engine) for kwargs in kwargs_list]
+
+    def store(i, result):
+        # Points the ensemble could not take ran on their own and are cached
+        # as single runs
+        produced = 'ensemble' if result.run_info.get('ensemble') else 'individual'
+        key = keys[i] if produced == engine else result_key(kwargs_list[i], kind=SWEEP_MODES[mode],
+                                                              engine=produced)
+        put_cached_result(key, result)
+
+    pending = []
+    for i, key in enumerate(keys):
+        cached = get_cached_result(key) if use_cache else None
+        if cached is not None:
+            yield i, cached, None, True
+        else:
+            pending.append(i)
+    sys.stderr.write(f"DEBUG: Sweep with {len(points)} points, {len(pending)} to simulate.\n")
+    sys.stderr.flush()
+
+    if engine == 'ensemble':
+        from ensemble import MAX_ENSEMBLE_SIZE
+        worker = simulate_ensemble_batch
+        n_ensembles = int(np.ceil(len(pending) / MAX_ENSEMBLE_SIZE))
+    else:
+        worker = simulate_batch
+
+    done = set()
+    if parallel_run and len(pending) > 1:
+        # Several batches per worker balance the load when points differ in
+        # cost; ensembles are split evenly over the workers instead
+        n_workers = parallel.MAX_WORKERS or os.cpu_count() or 1
+        n_batches = max(n_workers, n_ensembles) if engine == 'ensemble' else 4 * n_workers
+        batches = _make_batches(pending, kwargs_list, n_batches)
+        jobs = [(mode, [(i, kwargs_list[i]) for i in batch]) for batch in batches]
+        try:
+            for j, outcomes, error in parallel.map_unordered(worker, jobs):
+                if error is not None:
+                    outcomes = [(i, None, error) for i in batches[j]]
+                for i, result, e in outcomes:
+                    if result is not None:
+                        store(i, result)
+                    done.add(i)
+                    yield i, result, e, False
+        except Exception as e_pool:
+            sys.stderr.write(f"DEBUG WARNING: Parallel execution unavailable ({e_pool}); running sweep points serially.\n")
+            sys.stderr.flush()
+
+    remaining = [i for i in pending if i not in done]
+    if engine == 'ensemble' and remaining:
+        for batch in _make_batches(remaining, kwargs_list, n_ensembles):
+            for i, result, e in simulate_ensemble_batch((mode, [(i, kwargs_list[i]) for i in batch])):
+                if result is not None:
+                    store(i, result)
+                yield i, result, e, False
+        return
+    for i in remaining:
+        (_, result, e), = simulate_batch((mode, [(i, kwargs_list[i])]))
+        if result is not None:
+            store(i, result)
+        yield i, result, e, False
+
+def sweep_parameters(base_kwargs, parameters, combine='grid', mode='dynamic',
+                     parallel_run=True, use_cache=True, engine='individual'):
+    """
+    Simulate every point of a parameter sweep and summarize each in KPIs.
+
+    Parameters
+    ----------
+    base_kwargs : dict
+        Keyword arguments of the base scenario for `run_simulation` (dynamic
+        mode) or `solve_steady_state` (steady-state mode)
+    parameters : dict
+        Parameter name to values, see `expand_values`
+    combine : str, optional
+        'grid' (default) or 'zip', see `expand_grid`
+    mode : str, optional
+        'dynamic' (default) or 'steady_state', see `iter_points`
+    parallel_run : bool, optional
+        Spread the points over the worker processes, by default True
+    use_cache : bool, optional
+        Serve points that were simulated before from the result cache,
+        by default True
+    engine : str, optional
+        'individual' (default) or 'ensemble', see `iter_points`
+
+    Returns
+    -------
+    list of dict
+        Per point, in sweep order: 'point', 'success', 'kpis' or 'error',
+        'from_cache' and 'run_info'
+    """
+    points = expand_grid(parameters, combine)
+    rows = [None] * len(points)
+    for i, result, error, from_cache in iter_points(base_kwargs, points, mode, parallel_run, use_cache,
+                                                    engine=engine):
+        rows[i] = point_row(points[i], result, error, from_cache)
+    return rows
+
+def point_row(point, result, error, from_cache=False, outputs=None):
+    """
+    Summarize one simulated point in KPIs.
+
+    Parameters
+    ----------
+    point : dict
+        Swept parameter values
+    result : SimulationResult or None
+        Result of the point, None if it failed
+    error : Exception or None
+        Why the point failed
+    from_cache : bool, optional
+        Whether the result came from the result cache
+    outputs : sequence of str, optional
+        KPIs and effluent components to evaluate, see `kpis.calculate_kpis`
+
+    Returns
+    -------
+    dict
+        'point', 'success', 'kpis' or 'error', 'from_cache' and 'run_info'
+    """
+    if result is None:
+        return {'point': point, 'success': False, 'error': str(error),
+                'from_cache': False, 'run_info': {}}
+    try:
+        kpis = calculate_kpis(result.to_tuple(), outputs)
+    except Exception as e:
+        return {'point': point, 'success': False, 'error': f"KPI evaluation failed: {e}",
+                'from_cache': from_cache, 'run_info': result.run_info}
+    return {'point': point, 'success': True, 'kpis': kpis,
+            'from_cache': from_cache, 'run_info': result.run_info}
@@ -0,0 +1,299 @@
+"""
+Streaming reader of plant influent records (CSV or Parquet) for dynamic runs
+"""
+import os
+import sys
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+from utils import FEEDSTOCK_KEYS
+from dynamic_influent import InfluentSeries, TIME_FILE, DATA_FILE, META_FILE
+
+# Converted records are written once per source file and settings, named by
+# a hash of both, and read back memory-mapped (see `InfluentSeries.open`).
+# Files are read this many rows at a time, so memory use does not grow with
+# the length of the records.
+INFLUENT_DIR = os.environ.get(
+    'ADM1_INFLUENT_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'influent_series')
+)
+READ_CHUNK_ROWS = int(os.environ.get('ADM1_READ_CHUNK_ROWS', 100000))
+
+# Units of a numeric time column, in days; 'datetime' parses timestamps and
+# counts days from the first record
+TIME_UNITS = {'d': 1., 'h': 1/24, 'min': 1/1440, 's': 1/86400, 'datetime': None}
+
+RECORD_FORMATS = ('csv', 'parquet')
+
+def parse_column_map(columns):
+    """
+    Check a mapping of record columns to the influent.
+
+    Parameters
+    ----------
+    columns : dict
+        Record column name to its target: a component ID or 'Q' (value used
+        as is), or {target: factor} to convert units or split one measured
+        column over several components, e.g. {"flow_m3h": {"Q": 24},
+        "COD_mgL": {"X_ch": 0.0003, "X_pr": 0.0004}}. Concentrations are in
+        kg/m3 and the flow in m3/d; contributions to a target are summed.
+
+    Returns
+    -------
+    tuple
+        (record column names, target labels with 'Q' last, weight matrix
+        of shape (columns, targets))
+    """
+    if not columns:
+        raise ValueError("Map at least one record column to the influent.")
+    spec = {}
+    for name, target in columns.items():
+        if isinstance(target, str):
+            target = {target: 1.}
+        if not isinstance(target, dict) or not target:
+            raise ValueError(f"Column '{name}' must map to a target name or {{target: factor}}.")
+        try:
+            spec[str(name)] = {str(k): float(v) for k, v in target.items()}
+        except (TypeError, ValueError):
+            raise ValueError(f"Factors of column '{name}' must be numeric.")
+    targets = sorted({t for target in spec.values() for t in target} - {'Q'})
+    unknown = [t for t in targets if t not in FEEDSTOCK_KEYS]
+    if unknown:
+        raise ValueError(f"Unknown influent components: {', '.join(unknown)}. Map columns to "
+                         "ADM1 components or 'Q'.")
+    if any('Q' in target for target in spec.values()):
+        targets.append('Q')
+    names = list(spec)
+    weights = np.zeros((len(names), len(targets)))
+    for i, name in enumerate(names):
+        for target, factor in spec[name].items():
+            weights[i, targets.index(target)] = factor
+    return names, targets, weights
+
+def _record_format(path, fmt=None):
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt in ('pq', 'parq'):
+        fmt = 'parquet'
+    if fmt not in RECORD_FORMATS:
+        raise ValueError(f"Unknown record format '{fmt}'. Use one of {RECORD_FORMATS}.")
+    return fmt
+
+def iter_record_chunks(path, usecols, fmt=None, chunk_rows=None):
+    """
+    Read a CSV or Parquet file a chunk of rows at a time.
+
+    Parameters
+    ----------
+    path : str
+        Record file
+    usecols : list of str
+        Columns to read
+    fmt : str, optional
+        'csv' or 'parquet', by default from the file extension
+    chunk_rows : int, optional
+        Rows per chunk, by default READ_CHUNK_ROWS
+
+    Yields
+    ------
+    pandas.DataFrame
+    """
+    chunk_rows = chunk_rows or READ_CHUNK_ROWS
+    if _record_format(path, fmt) == 'csv':
+        yield from pd.read_csv(path, usecols=usecols, chunksize=chunk_rows)
+        return
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Reading Parquet records needs the pyarrow package (pip install pyarrow).")
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=usecols):
+        yield batch.to_pandas()
+
+class _Binner:
+    """Average rows into bins of a fixed width, carrying the open bin between chunks."""
+    def __init__(self, width, at_start):
+        self.width = width
+        self.offset = 0. if at_start else width/2
+        self.open = None  # (bin index, sum of rows, count)
+
+    def add(self, t, values):
+        bins = np.floor(t/self.width).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+        sums = np.add.reduceat(values, starts, axis=0)
+        counts = np.diff(np.r_[starts, len(bins)])
+        keys = bins[starts]
+        if self.open is not None:
+            if keys[0] == self.open[0]:
+                sums[0] += self.open[1]
+                counts[0] += self.open[2]
+            else:
+                keys = np.r_[self.open[0], keys]
+                sums = np.vstack([self.open[1], sums])
+                counts = np.r_[self.open[2], counts]
+        self.open = (keys[-1], sums[-1], counts[-1])
+        return self._rows(keys[:-1], sums[:-1], counts[:-1])
+
+    def flush(self):
+        if self.open is None:
+            return self._rows(np.empty(0), np.empty((0, 0)), np.empty(0))
+        key, total, count = self.open
+        self.open = None
+        return self._rows(np.array([key]), total[None, :], np.array([count]))
+
+    def _rows(self, keys, sums, counts):
+        return keys*self.width + self.offset, sums/np.maximum(counts, 1)[:, None]
+
+def _source_key(path, settings):
+    """Hash of a record file's identity and the settings it is read with."""
+    st = os.stat(path)
+    identity = {'path': os.path.abspath(path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                'settings': settings}
+    return hashlib.sha256(json.dumps(identity, sort_keys=True).encode('utf-8')).hexdigest()
+
+def read_plant_records(path, time_column, columns, time_unit='d', resample=None,
+                       interpolation='linear', period=None, fmt=None, chunk_rows=None):
+    """
+    Stream plant records (SCADA or lab exports) into a time-varying influent.
+
+    The file is read in chunks of rows: mapped columns are converted to
+    influent flow and concentrations, gaps are filled with the last value
+    (rows before the first complete one are dropped), rows out of time order
+    are dropped, negative values are clipped to zero, and rows are
+    optionally averaged into bins of `resample` days. Converted rows are
+    appended to an on-disk series that the run reads memory-mapped, so
+    memory use stays flat however long the records are. Reading the same
+    file with the same settings again reuses the stored series.
+
+    Parameters
+    ----------
+    path : str
+        CSV or Parquet file
+    time_column : str
+        Column holding the time of each record
+    columns : dict
+        Record columns mapped to influent flow and components, see
+        `parse_column_map`
+    time_unit : str, optional
+        Unit of a numeric time column, or 'datetime' for timestamps, one of
+        `TIME_UNITS`, by default 'd'. Time starts at the first record.
+    resample : float, optional
+        Average the records over bins of this many days (e.g. 1/24 for
+        hourly means), by default None (every record)
+    interpolation : str, optional
+        One of `dynamic_influent.INTERPOLATIONS`, by default 'linear'
+    period : float, optional
+        Repeat the series every `period` days, by default None
+    fmt : str, optional
+        'csv' or 'parquet', by default from the file extension
+    chunk_rows : int, optional
+        Rows read at a time, by default READ_CHUNK_ROWS
+
+    Returns
+    -------
+    InfluentSeries
+        Memory-mapped series; its `source` holds the file, the digest of
+        the converted rows and counts of the rows read, kept and dropped,
+        and of the values clipped
+    """
+    if time_unit not in TIME_UNITS:
+        raise ValueError(f"Unknown time unit '{time_unit}'. Use one of {tuple(TIME_UNITS)}.")
+    if resample is not None and not resample > 0:
+        raise ValueError("resample must be a positive number of days.")
+    if not INFLUENT_DIR:
+        raise RuntimeError("Plant records are converted into ADM1_INFLUENT_DIR, which is not set.")
+    if not os.path.isfile(path):
+        raise ValueError(f"Record file not found: {path}")
+    names, targets, weights = parse_column_map(columns)
+    settings = {'time_column': time_column, 'time_unit': time_unit, 'resample': resample,
+                'columns': [names, targets, weights.tolist()], 'fmt': fmt}
+    store = os.path.join(INFLUENT_DIR, _source_key(path, settings))
+    if os.path.isfile(os.path.join(store, META_FILE)):
+        return InfluentSeries.open(store, interpolation, period)
+
+    tmp = f"{store}.{os.getpid()}.tmp"
+    os.makedirs(tmp, exist_ok=True)
+    digest = hashlib.sha256()
+    counts = {'read': 0, 'kept': 0, 'incomplete': 0, 'out_of_order': 0, 'clipped_values': 0}
+    origin = None
+    last_t, last_row = -np.inf, np.full(len(names), np.nan)
+    binner = _Binner(resample, interpolation == 'previous') if resample else None
+    sys.stderr.write(f"DEBUG: Reading plant records from {path}\n")
+    sys.stderr.flush()
+
+    def append(t, rows):
+        if len(t):
+            t, rows = np.ascontiguousarray(t, dtype=float), np.ascontiguousarray(rows, dtype=float)
+            f_time.write(t.tobytes())
+            f_data.write(rows.tobytes())
+            digest.update(t.tobytes())
+            digest.update(rows.tobytes())
+            counts['kept'] += len(t)
+
+    try:
+        with open(os.path.join(tmp, TIME_FILE), 'wb') as f_time, open(os.path.join(tmp, DATA_FILE), 'wb') as f_data:
+            for chunk in iter_record_chunks(path, [time_column] + names, fmt, chunk_rows):
+                counts['read'] += len(chunk)
+                if time_unit == 'datetime':
+                    stamps = pd.to_datetime(chunk[time_column], errors='coerce')
+                    if stamps.dt.tz is not None:
+                        stamps = stamps.dt.tz_convert(None)  # UTC
+                    ns = stamps.to_numpy(dtype='datetime64[ns]').astype(np.int64).astype(float)
+                    ns[stamps.isna().to_numpy()] = np.nan
+                    if origin is None and np.isfinite(ns).any():
+                        origin = ns[np.isfinite(ns)][0]
+                    t = (ns - (origin or 0.))/86400e9
+                else:
+                    t = pd.to_numeric(chunk[time_column], errors='coerce').to_numpy(dtype=float)
+                    if origin is None and np.isfinite(t).any():
+                        origin = t[np.isfinite(t)][0]
+                    t = (t - (origin or 0.))*TIME_UNITS[time_unit]
+                values = np.column_stack([pd.to_numeric(chunk[name], errors='coerce').to_numpy(dtype=float)
+                                          for name in names])
+                # Gaps take the last value, carried over from the previous chunk
+                values = pd.DataFrame(np.vstack([last_row, values])).ffill().to_numpy()[1:]
+                if len(values):
+                    last_row = values[-1]
+                ok = np.isfinite(t)
+                complete = np.isfinite(values).all(axis=1)
+                counts['incomplete'] += int(np.sum(ok & ~complete))
+                ok &= complete
+                t, values = t[ok], values[ok]
+                # Keep strictly increasing times only
+                previous = np.maximum.accumulate(np.r_[last_t, t])[:-1]
+                ordered = t > previous
+                counts['out_of_order'] += int(np.sum(~ordered))
+                t, values = t[ordered], values[ordered]
+                if len(t):
+                    last_t = t[-1]
+                rows = values @ weights
+                counts['clipped_values'] += int(np.sum(rows < 0))
+                np.maximum(rows, 0., out=rows)
+                if binner is not None and len(t):
+                    t, rows = binner.add(t, rows)
+                append(t, rows)
+            if binner is not None:
+                append(*binner.flush())
+        if not counts['kept']:
+            raise ValueError(f"No complete, time-ordered records found in {path}.")
+        meta = {'points': counts['kept'], 'labels': targets,
+                'source': {'file': os.path.abspath(path), 'digest': digest.hexdigest(),
+                           'settings': settings, 'rows': counts}}
+        with open(os.path.join(tmp, META_FILE), 'w') as f:
+            json.dump(meta, f)
+        if os.path.isdir(store):
+            shutil.rmtree(tmp, ignore_errors=True)  # converted meanwhile by another process
+        else:
+            os.replace(tmp, store)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    sys.stderr.write(f"DEBUG: Plant records converted: {counts}\n")
+    sys.stderr.flush()
+    return InfluentSeries.open(store, interpolation, period)
+
+def clear_plant_records():
+    """Delete every converted record file."""
+    if INFLUENT_DIR and os.path.isdir(INFLUENT_DIR):
+        for name in os.listdir(INFLUENT_DIR):
+            shutil.rmtree(os.path.join(INFLUENT_DIR, name), ignore_errors=True)
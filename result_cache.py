@@ -0,0 +1,194 @@
+"""
+Content-addressed cache of ADM1 simulation results
+"""
+import os
+import sys
+import json
+import hashlib
+import pickle
+from collections import OrderedDict
+import numpy as np
+import qsdsan
+from simulation import _cache_get, _cache_put, active_ph_solver, DEFAULT_KINETICS_BACKEND
+from simulation import DEFAULT_OUTPUT_MODE, OUTPUT_RTOL, DEFAULT_TRACKED_COMPONENTS, DEFAULT_RECORD_DTYPE
+from simulation import track_key
+
+# In-memory tier (LRU, number of results) and on-disk tier (one pickle per
+# result, oldest files removed beyond the limit). Set ADM1_RESULT_CACHE_DIR to
+# an empty string to keep the cache in memory only.
+RESULT_CACHE_SIZE = int(os.environ.get('ADM1_RESULT_CACHE_SIZE', 32))
+RESULT_CACHE_DIR = os.environ.get(
+    'ADM1_RESULT_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'result_cache')
+)
+RESULT_CACHE_MAX_FILES = int(os.environ.get('ADM1_RESULT_CACHE_MAX_FILES', 500))
+
+# Bump when the stored result layout or the simulation itself changes
+CACHE_VERSION = 1
+
+# Arguments that do not change the result of a run
+_IGNORED_KEYS = ('cache_slot', 'checkpoint_interval', 'checkpoint_path')
+
+_memory_cache = OrderedDict()
+
+def _canonical(value):
+    """Convert a run argument to a JSON-stable form."""
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in sorted(value.items())}
+    if hasattr(value, 'to_dict'):
+        return _canonical(value.to_dict())  # e.g. a time-varying influent
+    if isinstance(value, np.ndarray):
+        arr = np.ascontiguousarray(value, dtype=float)
+        return {'ndarray': hashlib.sha256(arr.tobytes()).hexdigest(), 'shape': list(arr.shape)}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, (bool, np.bool_)) or value is None:
+        return None if value is None else bool(value)
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return repr(float(value))  # 30 and 30.0 give the same key
+    return str(value)
+
+def result_key(run_kwargs, kind='run_simulation', engine='individual'):
+    """
+    Stable hash of the arguments of a `simulation.run_simulation` call.
+
+    Process-wide settings a run depends on are resolved first, so the key
+    names the kinetics backend actually used when `backend` is None
+    (ADM1_KINETICS_BACKEND) and the active pH solver (ADM1_PH_SOLVER), and
+    for dynamic runs the output mode (ADM1_OUTPUT_MODE) and its tolerance,
+    the tracked components (ADM1_TRACKED_COMPONENTS, groups expanded) and
+    the record type (ADM1_RECORD_DTYPE).
+
+    Steady-state sweep points are warm-started from their neighbour's
+    solution, which is not part of the key: their cached roots agree with a
+    cold solve only to within the steady-state tolerance.
+
+    Parameters
+    ----------
+    run_kwargs : dict
+        Keyword arguments for `run_simulation`
+    kind : str, optional
+        Simulation function the arguments are for, 'run_simulation' (default)
+        or 'solve_steady_state'
+    engine : str, optional
+        How the run was integrated: 'individual' (default) or 'ensemble'.
+        Ensemble members are integrated with tighter tolerances (see
+        `ensemble.simulate_ensemble`), so they are kept apart from single
+        runs of the same arguments.
+
+    Returns
+    -------
+    str
+        Hex digest identifying the run
+    """
+    payload = {k: v for k, v in run_kwargs.items() if k not in _IGNORED_KEYS}
+    if not payload.get('use_kinetics', True):
+        payload['kinetic_params'] = None  # ignored by the run
+    if kind != 'run_simulation':
+        payload['_kind'] = kind
+    if engine != 'individual':
+        payload['_engine'] = engine
+    payload['backend'] = payload.get('backend') or DEFAULT_KINETICS_BACKEND
+    payload['_ph_solver'] = active_ph_solver()
+    if kind != 'solve_steady_state':
+        payload['output'] = payload.get('output') or DEFAULT_OUTPUT_MODE
+        rtol = payload.get('output_rtol')
+        payload['output_rtol'] = (OUTPUT_RTOL if rtol is None else rtol) \
+            if payload['output'] == 'downsample' else None
+        track = payload.get('track')
+        payload['track'] = track_key(DEFAULT_TRACKED_COMPONENTS if track is None else track)
+        payload['record_dtype'] = payload.get('record_dtype') or DEFAULT_RECORD_DTYPE
+    payload['_cache_version'] = CACHE_VERSION
+    payload['_qsdsan_version'] = qsdsan.__version__
+    text = json.dumps(_canonical(payload), sort_keys=True)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def _disk_path(key):
+    return os.path.join(RESULT_CACHE_DIR, f"{key}.pkl")
+
+def get_cached_result(key):
+    """
+    Look up a result, first in memory and then on disk.
+
+    Parameters
+    ----------
+    key : str
+        Key from `result_key`
+
+    Returns
+    -------
+    SimulationResult or None
+    """
+    result = _cache_get(_memory_cache, key)
+    if result is not None or not RESULT_CACHE_DIR:
+        return result
+    path = _disk_path(key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            result = pickle.load(f)
+        os.utime(path)  # recently used files survive pruning
+    except Exception as e:
+        sys.stderr.write(f"DEBUG WARNING: Could not read cached result {path}: {e}\n")
+        sys.stderr.flush()
+        return None
+    _cache_put(_memory_cache, key, result, RESULT_CACHE_SIZE)
+    return result
+
+def put_cached_result(key, result):
+    """
+    Store a result in memory and on disk.
+
+    Parameters
+    ----------
+    key : str
+        Key from `result_key`
+    result : SimulationResult
+        Result of the run
+    """
+    _cache_put(_memory_cache, key, result, RESULT_CACHE_SIZE)
+    if not RESULT_CACHE_DIR:
+        return
+    try:
+        os.makedirs(RESULT_CACHE_DIR, exist_ok=True)
+        path = _disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)  # atomic, so readers never see a partial file
+        _prune_disk_cache()
+    except Exception as e:
+        sys.stderr.write(f"DEBUG WARNING: Could not write cached result: {e}\n")
+        sys.stderr.flush()
+
+def _prune_disk_cache():
+    """Remove the oldest cached results beyond RESULT_CACHE_MAX_FILES."""
+    entries = [os.path.join(RESULT_CACHE_DIR, name) for name in os.listdir(RESULT_CACHE_DIR)
+               if name.endswith('.pkl')]
+    if len(entries) <= RESULT_CACHE_MAX_FILES:
+        return
+    entries.sort(key=os.path.getmtime)
+    for path in entries[:len(entries) - RESULT_CACHE_MAX_FILES]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def clear_result_cache(disk=True):
+    """
+    Drop cached results.
+
+    Parameters
+    ----------
+    disk : bool, optional
+        Also delete the on-disk tier, by default True
+    """
+    _memory_cache.clear()
+    if disk and RESULT_CACHE_DIR and os.path.isdir(RESULT_CACHE_DIR):
+        for name in os.listdir(RESULT_CACHE_DIR):
+            if name.endswith('.pkl'):
+                try:
+                    os.remove(os.path.join(RESULT_CACHE_DIR, name))
+                except OSError:
+                    pass
@@ -0,0 +1,526 @@
+"""
+Compact simulation results for ADM1 MCP server
+"""
+import numpy as np
+from qsdsan import WasteStream
+from simulation import update_ph_and_alkalinity, release_run_data
+from numba_kinetics import R
+from trajectory_archive import archive_trajectory, load_trajectory
+
+def _stream_state(stream):
+    """Picklable description of a WasteStream (IDs, conditions and mass flows)."""
+    return {
+        'ID': stream.ID,
+        'phase': stream.phase,
+        'T': stream.T,
+        'P': stream.P,
+        'mass': np.array(stream.mass, dtype=float),  # kg/hr, in component order
+    }
+
+def _restore_stream(state):
+    """Rebuild a WasteStream from `_stream_state` output."""
+    ws = WasteStream(state['ID'], T=state['T'], P=state['P'], phase=state['phase'])
+    ws.mass[:] = state['mass']
+    if state['phase'] != 'g':
+        update_ph_and_alkalinity(ws)
+    return ws
+
+def record_layout(unit):
+    """
+    Constants that turn AnaerobicCSTR states into its outlet stream records.
+
+    Records hold what the reactor writes to its effluent and biogas (as in
+    `AnaerobicCSTR._update_state`): concentrations in mg/L followed by the
+    flow in m3/d. The biogas flow follows from the headspace pressure.
+    With algebraic S_h2 or a fixed headspace pressure, the S_h2 or biogas
+    flow columns also depend on the process rates; they are listed under
+    'interpolated' and taken from the solver steps when sampling a dense
+    trajectory.
+
+    Parameters
+    ----------
+    unit : AnaerobicCSTR
+        Reactor with an initialized state
+
+    Returns
+    -------
+    dict
+    """
+    cmps = unit.components
+    n_cmps = len(cmps)
+    T = unit.eval_exo_dynamic_vars(0.)[0] if len(unit._exovars) else unit.T
+    i_mass = np.asarray(cmps.i_mass, dtype=float)
+    mg_per_M = np.zeros(n_cmps)
+    np.divide(np.asarray(cmps.chem_MW, dtype=float)*1e3, i_mass, out=mg_per_M, where=i_mass != 0)
+    interpolated = []
+    if unit.algebraic_h2:
+        interpolated.append(('effluent', cmps.index('S_h2')))
+    if unit.fixed_headspace_P:
+        interpolated.append(('biogas', n_cmps))
+    return {
+        'IDs': tuple(cmps.IDs),
+        'n_cmps': n_cmps,
+        'f_rtn': np.array(unit._f_retain, dtype=float),
+        'gas_idx': np.array(unit._gas_cmp_idx),
+        'h2o_idx': cmps.index('H2O'),
+        'S_vapor': float(unit._S_vapor),
+        'mg_per_M': mg_per_M,
+        'RT': R*T,
+        'p_vapor': unit.p_vapor(convert_to_bar=True),
+        'k_p': unit.pipe_resistance,
+        'P_atm': unit.external_P,
+        'interpolated': interpolated,
+    }
+
+def records_from_states(layout, states, q_gas=None):
+    """
+    Effluent and biogas records of reactor states.
+
+    Parameters
+    ----------
+    layout : dict
+        From `record_layout`
+    states : numpy.ndarray
+        Reactor state vectors as rows
+    q_gas : numpy.ndarray, optional
+        Biogas flows in m3/d, by default from the headspace pressure
+
+    Returns
+    -------
+    dict
+        Records (one row per state) keyed by 'effluent' and 'biogas'
+    """
+    states = np.atleast_2d(states)
+    states = np.where(states < 1e-16, 0., states)  # as AnaerobicCSTR._update_state
+    n_cmps = layout['n_cmps']
+    gas_idx = layout['gas_idx']
+    gas = states[:, n_cmps:n_cmps + len(gas_idx)]
+    effluent = np.empty((len(states), n_cmps + 1))
+    effluent[:, :n_cmps] = states[:, :n_cmps]*(1 - layout['f_rtn'])*1e3
+    effluent[:, -1] = states[:, -1]
+    biogas = np.zeros((len(states), n_cmps + 1))
+    biogas[:, gas_idx] = gas
+    biogas[:, layout['h2o_idx']] = layout['S_vapor']
+    biogas[:, :n_cmps] *= layout['mg_per_M']
+    if q_gas is None:
+        P = layout['p_vapor'] + gas.sum(axis=1)*layout['RT']
+        q_gas = np.maximum(0., layout['k_p']*(P - layout['P_atm']))
+    biogas[:, -1] = q_gas
+    return {'effluent': effluent, 'biogas': biogas}
+
+def states_from_records(layout, effluent, biogas):
+    """
+    Reactor states that give the outlet stream records (the inverse of
+    `records_from_states`).
+
+    Parameters
+    ----------
+    layout : dict
+        From `record_layout`
+    effluent, biogas : numpy.ndarray
+        Full records (every component, then the flow), one row per state
+
+    Returns
+    -------
+    numpy.ndarray
+        Reactor state vectors as rows
+    """
+    f_rtn = layout['f_rtn']
+    if np.any(f_rtn >= 1):
+        raise ValueError("Fully retained components do not reach the effluent; "
+                         "their states cannot be recovered from the records.")
+    effluent, biogas = np.atleast_2d(effluent), np.atleast_2d(biogas)
+    n_cmps, gas_idx = layout['n_cmps'], layout['gas_idx']
+    states = np.empty((len(effluent), n_cmps + len(gas_idx) + 1))
+    states[:, :n_cmps] = effluent[:, :n_cmps]/((1 - f_rtn)*1e3)
+    states[:, n_cmps:-1] = biogas[:, gas_idx]/layout['mg_per_M'][gas_idx]
+    states[:, -1] = effluent[:, -1]
+    return states
+
+def select_records(layout, records, components=None):
+    """
+    Keep the columns of tracked components, and the flow, of the records.
+
+    Parameters
+    ----------
+    layout : dict
+        From `record_layout`
+    records : dict
+        Full records, as from `records_from_states`
+    components : sequence, optional
+        Tracked component IDs, by default all
+
+    Returns
+    -------
+    tuple
+        (records, column labels keyed like the records)
+    """
+    IDs = layout['IDs']
+    if components is None:
+        idx = list(range(len(IDs)))
+    else:
+        idx = sorted(IDs.index(ID) for ID in components)
+    labels = [IDs[i] for i in idx] + ['Q']
+    if len(idx) < len(IDs):
+        idx.append(len(IDs))
+        records = {name: rec[:, idx] for name, rec in records.items()}
+    return records, {name: list(labels) for name in records}
+
+def downsample_records(time_series, records, rtol=1e-3):
+    """
+    Keep the fewest rows from which the records are recovered within a tolerance.
+
+    Rows are kept greedily: each segment runs as far as linear interpolation
+    between its end rows stays within `rtol` of every dropped value, or of
+    1e-3 times the column's largest magnitude for values near zero.
+
+    Parameters
+    ----------
+    time_series : numpy.ndarray
+        Time points
+    records : dict
+        Records with one row per time point
+    rtol : float, optional
+        Relative tolerance, by default 1e-3
+
+    Returns
+    -------
+    tuple
+        (kept time points, kept records)
+    """
+    t = np.asarray(time_series, dtype=float)
+    if len(t) < 3:
+        return t, records
+    names = list(records)
+    values = np.hstack([records[name] for name in names])
+    floor = 1e-3*np.abs(values).max(axis=0)
+    tol = rtol*np.maximum(np.abs(values), floor)
+
+    def fits(i, k):
+        # Linear interpolation from row i to row k reproduces the rows between
+        w = ((t[i+1:k] - t[i])/(t[k] - t[i]))[:, None]
+        error = np.abs(values[i] + w*(values[k] - values[i]) - values[i+1:k])
+        return bool((error <= tol[i+1:k]).all())
+
+    n = len(t)
+    keep = [0]
+    i = 0
+    while i < n - 1:
+        # Double the segment while it fits, then bisect for its end
+        good, step = i + 1, 1
+        while good + step < n and fits(i, good + step):
+            good += step
+            step *= 2
+        bad = min(good + step, n)
+        while bad - good > 1:
+            mid = (good + bad)//2
+            if fits(i, mid):
+                good = mid
+            else:
+                bad = mid
+        keep.append(good)
+        i = good
+    keep = np.array(keep)
+    offsets = np.cumsum([0] + [records[name].shape[1] for name in names])
+    return t[keep], {name: values[keep, offsets[j]:offsets[j+1]] for j, name in enumerate(names)}
+
+class SimulationResult:
+    """
+    Snapshot of a finished reactor run that can be sent between processes
+    and kept for queries in place of the System.
+
+    Holds the final influent, effluent and biogas streams as mass flow
+    arrays, the reactor's inhibition data and the recorded time series in
+    place of the live QSDsan System. `to_tuple` gives back the
+    (result, Influent, Effluent, Biogas) layout that the analysis functions
+    expect, with the result standing in for the System.
+
+    Parameters
+    ----------
+    streams : dict
+        Stream states keyed by 'influent', 'effluent' and 'biogas'
+    inhibition_data : dict
+        Copy of the ADM1 rate function root data at the end of the run
+    time_series : numpy.ndarray, optional
+        Recorded time points in days
+    records : dict, optional
+        Stream records (mg/L and m3/d) keyed like `streams`, one row per
+        time point
+    run_info : dict, optional
+        How the run ended, see `simulation.get_run_info`
+    reactor_state : numpy.ndarray, optional
+        Final reactor state vector, see `simulation.get_reactor_state`
+    trajectory : callable, optional
+        Dense reactor state trajectory, state(t) as from `solve_ivp`'s
+        dense output (runs with output='dense')
+    record_layout : dict, optional
+        Conversion of states to records for `sample`, see `record_layout`
+    record_columns : dict, optional
+        Labels of the record columns keyed like `records` (component IDs
+        then 'Q'), by default every component
+    """
+    def __init__(self, streams, inhibition_data, time_series=None, records=None,
+                 run_info=None, reactor_state=None, trajectory=None, record_layout=None,
+                 record_columns=None):
+        self.streams = streams
+        self.inhibition_data = inhibition_data
+        self.time_series = time_series
+        self.records = records or {}
+        self.run_info = run_info or {}
+        self.reactor_state = reactor_state
+        self.trajectory = trajectory
+        self.record_layout = record_layout
+        self.record_columns = record_columns
+        self.archive_path = None
+        self._restored = {}
+
+    @classmethod
+    def from_system(cls, sys, inf, eff, gas, release=False):
+        """
+        Extract a result from a simulated system.
+
+        Parameters
+        ----------
+        sys : System
+            The simulated system
+        inf, eff, gas : WasteStream
+            Influent, effluent and biogas streams of the system
+        release : bool, optional
+            Drop the trajectory data from the System once extracted (see
+            `simulation.release_run_data`), by default False
+
+        Returns
+        -------
+        SimulationResult
+        """
+        unit = sys._path[0]
+        root_data = getattr(unit, '_tempstate', None)
+        if not root_data or 'pH' not in root_data:
+            root_data = unit.model.rate_function._params['root'].data or {}
+        inhibition_data = {k: np.copy(v) if isinstance(v, np.ndarray) else v
+                           for k, v in root_data.items()}
+
+        streams = {
+            'influent': _stream_state(inf),
+            'effluent': _stream_state(eff),
+            'biogas': _stream_state(gas),
+        }
+        time_series = None
+        records = {}
+        output = getattr(unit, 'output_records', None) or {}
+        if output:
+            time_series = output['time_series']
+            records = output['records']
+        else:
+            try:
+                time_series = eff.scope.time_series
+                records = {
+                    'effluent': eff.scope.record,
+                    'biogas': gas.scope.record,
+                }
+            except Exception:
+                pass  # Tracker not set up or empty; keep final states only
+        run_info = dict(getattr(unit, 'run_info', None) or {})
+        reactor_state = None if unit._state is None else np.array(unit._state, dtype=float)
+        if release:
+            release_run_data(sys)
+        return cls(streams, inhibition_data, time_series, records, run_info, reactor_state,
+                   output.get('trajectory'), output.get('record_layout'), output.get('columns'))
+
+    def sample(self, t):
+        """
+        Evaluate the stream records at any times of a dense run.
+
+        Parameters
+        ----------
+        t : float or array-like
+            Times in days within the run
+
+        Returns
+        -------
+        dict
+            Records keyed by 'effluent' and 'biogas', one row per time
+        """
+        if self.trajectory is None:
+            raise ValueError("The result holds no dense trajectory; run with output='dense'.")
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+        layout = self.record_layout
+        states = np.asarray(self.trajectory(t)).reshape(-1, len(t)).T
+        components = None
+        if self.record_columns:
+            components = self.record_columns['effluent'][:-1]
+        records, columns = select_records(layout, records_from_states(layout, states), components)
+        labels = layout['IDs'] + ('Q',)
+        for name, col in layout['interpolated']:
+            if labels[col] in columns[name]:
+                j = columns[name].index(labels[col])
+                records[name][:, j] = np.interp(t, self.time_series, self.records[name][:, j])
+        dtype = self.records['effluent'].dtype if self.records else float
+        return {name: rec.astype(dtype) for name, rec in records.items()}
+
+    def state_at(self, t=None):
+        """
+        Reactor state at a time of the run, to start other runs from.
+
+        The final state is exact, and so is any time of a dense run. Other
+        times are recovered from the stream records, interpolated linearly
+        between recorded points, which needs every component tracked; fork
+        on the 'grid' output points, or at solver steps, to start exactly.
+
+        Parameters
+        ----------
+        t : float, optional
+            Time in days within the run, by default its end
+
+        Returns
+        -------
+        numpy.ndarray
+            Reactor state vector, see `simulation.get_reactor_state`
+        """
+        stop_time = self.run_info.get('stop_time')
+        if t is None or (stop_time is not None and abs(t - stop_time) <= 1e-9*max(1., stop_time)):
+            if self.reactor_state is None:
+                raise ValueError("The result holds no final reactor state.")
+            return np.array(self.reactor_state, dtype=float)
+        if self.time_series is None or not len(self.time_series):
+            raise ValueError("The result holds no time series; only its final state is available.")
+        t0, t1 = float(self.time_series[0]), float(self.time_series[-1])
+        if not t0 <= t <= t1:
+            raise ValueError(f"Time {t} is outside the run ({t0:g} to {t1:g} d).")
+        if self.trajectory is not None:
+            return np.asarray(self.trajectory(t), dtype=float).ravel()
+        layout = self.record_layout
+        if layout is None or any(self.columns(name)[:-1] != list(layout['IDs']) for name in self.records):
+            raise ValueError("States within a run are recovered from records of every component; "
+                             "run with track=None, or with output='dense'.")
+        # Only the two rows around t are read from archived records
+        i = min(max(int(np.searchsorted(self.time_series, t)), 1), len(self.time_series) - 1)
+        ta, tb = float(self.time_series[i - 1]), float(self.time_series[i])
+        w = 1. if tb == ta else (t - ta)/(tb - ta)
+        rows = {name: (1 - w)*np.asarray(self.records[name][i - 1], dtype=float)
+                      + w*np.asarray(self.records[name][i], dtype=float)
+                for name in ('effluent', 'biogas')}
+        return states_from_records(layout, rows['effluent'], rows['biogas'])[0]
+
+    def columns(self, name):
+        """Labels of the record columns of a stream (component IDs, then 'Q')."""
+        columns = (self.record_columns or {}).get(name)
+        if columns is None:
+            columns = list(self.stream(name).components.IDs) + ['Q']
+        return columns
+
+    def record(self, name, column):
+        """
+        Recorded time series of one column of a stream.
+
+        Parameters
+        ----------
+        name : str
+            'effluent' or 'biogas'
+        column : str
+            Component ID, or 'Q' for the flow
+
+        Returns
+        -------
+        numpy.ndarray
+        """
+        columns = self.columns(name)
+        if column not in columns:
+            raise KeyError(f"'{column}' is not tracked in the {name} records; "
+                           f"tracked columns are {columns}.")
+        return self.records[name][:, columns.index(column)]
+
+    def extend(self, segment):
+        """
+        Combine this result with a run that continued it.
+
+        Parameters
+        ----------
+        segment : SimulationResult
+            Run started from this result's final state and stop time (see
+            `simulation.run_simulation`'s `start_time`), with the same
+            tracked components
+
+        Returns
+        -------
+        SimulationResult
+            Final streams, state and inhibition data of `segment`, the
+            records of both runs and `segment`'s run info, with the start
+            of every run under 'segments'. A dense trajectory only covers
+            `segment` and is dropped.
+        """
+        time_series, records = segment.time_series, segment.records
+        if self.time_series is not None and len(self.time_series) and time_series is not None:
+            if any(self.columns(name) != segment.columns(name) for name in records):
+                raise ValueError("The continuation must track the same components as the result it extends.")
+            kept = np.asarray(time_series) > self.time_series[-1]
+            time_series = np.concatenate([self.time_series, np.asarray(time_series)[kept]])
+            records = {name: np.concatenate([self.records[name], np.asarray(rec)[kept]]).astype(rec.dtype)
+                       for name, rec in records.items()}
+        run_info = dict(segment.run_info)
+        start = float(segment.time_series[0]) if segment.time_series is not None else None
+        run_info['segments'] = (self.run_info.get('segments') or [0.]) + [start]
+        if run_info.get('output'):
+            run_info['output'] = dict(run_info['output'], points=0 if time_series is None else len(time_series))
+        return SimulationResult(segment.streams, segment.inhibition_data, time_series, records,
+                                run_info, segment.reactor_state, None, segment.record_layout,
+                                segment.record_columns)
+
+    def stream(self, name):
+        """Return the final 'influent', 'effluent' or 'biogas' WasteStream."""
+        if name not in self._restored:
+            self._restored[name] = _restore_stream(self.streams[name])
+        return self._restored[name]
+
+    def to_tuple(self):
+        """Return (result, Influent, Effluent, Biogas) for the analysis functions."""
+        return (self, self.stream('influent'), self.stream('effluent'), self.stream('biogas'))
+
+    def archive(self, key):
+        """
+        Move the time series and records to the trajectory archive.
+
+        The arrays are written once under the run's fingerprint and read back
+        memory-mapped, so they are paged in from disk as they are sliced.
+        Pickles of an archived result leave them out and reopen the archive. A
+        forked result (see `branching`) names the run it was forked from.
+
+        Parameters
+        ----------
+        key : str
+            Run fingerprint, see `result_cache.result_key`
+
+        Returns
+        -------
+        bool
+            Whether the result is now backed by the archive
+        """
+        if self.archive_path is not None:
+            return True
+        columns = {name: self.columns(name) for name in self.records}
+        fork = self.run_info.get('fork') or {}
+        parent = {'run_id': fork['parent'], 'fork_time': fork['fork_time']} if fork.get('parent') else None
+        path = archive_trajectory(key, self.time_series, self.records, columns, parent)
+        loaded = load_trajectory(path) if path else None
+        if loaded is None:
+            return False
+        self.time_series, self.records, _ = loaded
+        self.archive_path = path
+        return True
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_restored'] = {}  # Streams are rebuilt on the receiving side
+        if state.get('archive_path'):
+            state['time_series'], state['records'] = None, {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('archive_path', None)
+        if self.archive_path:
+            loaded = load_trajectory(self.archive_path)
+            if loaded is None:
+                self.archive_path = None  # pruned: final states only
+            else:
+                self.time_series, self.records, _ = loaded
@@ -0,0 +1,221 @@
+"""
+Global sensitivity analysis (Morris screening and Sobol indices) of ADM1 reactor performance
+"""
+import os
+import sys
+import math
+import numpy as np
+from SALib.sample import morris as morris_sample
+from SALib.sample import sobol as sobol_sample
+from SALib.analyze import morris as morris_analyze
+from SALib.analyze import sobol as sobol_analyze
+from utils import FEEDSTOCK_KEYS, KINETIC_KEYS
+from kpis import check_outputs
+from parameter_sweep import SCENARIO_KEYS, iter_points, point_row
+from monte_carlo import default_kinetic_value
+
+# KPIs and effluent components ranked by default
+DEFAULT_OUTPUTS = ('methane_flow', 'S_ac', 'pH')
+
+# Default number of Morris trajectories and Sobol base samples
+DEFAULT_SAMPLES = {'morris': 10, 'sobol': 64}
+
+# Grid levels of the Morris design
+MORRIS_LEVELS = 4
+
+# Upper limit on the number of model evaluations in one analysis
+MAX_GSA_EVALUATIONS = int(os.environ.get('ADM1_MAX_GSA_EVALUATIONS', 5000))
+
+def nominal_value(base_kwargs, name):
+    """Value of a parameter in the base scenario, or None if it has none."""
+    if name in SCENARIO_KEYS:
+        return base_kwargs.get(name)
+    if name in FEEDSTOCK_KEYS:
+        return (base_kwargs.get('concentrations') or {}).get(name)
+    if name in KINETIC_KEYS:
+        kinetics = (base_kwargs.get('kinetic_params') or {}) if base_kwargs.get('use_kinetics', True) else {}
+        return kinetics.get(name, default_kinetic_value(name))
+    raise ValueError(f"Cannot vary '{name}'. Use Q, Temp, HRT, a feedstock component or a kinetic parameter.")
+
+def parameter_bounds(name, spec, nominal=None):
+    """
+    Lower and upper bound of one input.
+
+    Parameters
+    ----------
+    name : str
+        Parameter name, for error messages
+    spec : list or dict
+        [low, high], {'low': ..., 'high': ...}, or {'rel': r} for
+        nominal * (1 - r) to nominal * (1 + r)
+    nominal : float, optional
+        Base value of the parameter, needed for relative bounds
+
+    Returns
+    -------
+    list of float
+    """
+    if isinstance(spec, dict) and 'rel' in spec and nominal is None:
+        raise ValueError(f"'{name}' has no base value; give 'low' and 'high' instead of 'rel'.")
+    try:
+        if isinstance(spec, dict) and 'rel' in spec:
+            rel = float(spec['rel'])
+            low, high = sorted((nominal * (1 - rel), nominal * (1 + rel)))
+        elif isinstance(spec, dict):
+            low, high = float(spec['low']), float(spec['high'])
+        else:
+            low, high = (float(v) for v in spec)
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"Bounds for '{name}' must be [low, high], {{'low', 'high'}} or {{'rel'}}.")
+    if not high > low:
+        raise ValueError(f"Bounds for '{name}' need high > low.")
+    return [low, high]
+
+def sample_inputs(problem, method, n_samples, seed=None):
+    """
+    Draw the input design of a sensitivity analysis.
+
+    Parameters
+    ----------
+    problem : dict
+        SALib problem ('num_vars', 'names', 'bounds')
+    method : str
+        'morris' (`n_samples` trajectories of D + 1 points) or 'sobol'
+        (`n_samples` base samples, rounded up to a power of 2, of D + 2 points)
+    n_samples : int
+        Number of trajectories or base samples
+    seed : int, optional
+        Random seed, for a reproducible design
+
+    Returns
+    -------
+    tuple
+        (input matrix, number of consecutive rows that belong together)
+    """
+    D = problem['num_vars']
+    if method == 'morris':
+        X = morris_sample.sample(problem, N=n_samples, num_levels=MORRIS_LEVELS, seed=seed)
+        return X, D + 1
+    if method == 'sobol':
+        n_samples = 2**math.ceil(math.log2(max(n_samples, 2)))  # Sobol' sequences balance at powers of 2
+        X = sobol_sample.sample(problem, N=n_samples, calc_second_order=False, seed=seed)
+        return X, D + 2
+    raise ValueError(f"Unknown method '{method}'. Use 'morris' or 'sobol'.")
+
+def _rank(problem, method, X, y, seed=None):
+    """Sensitivity indices of one output, most influential input first."""
+    names = problem['names']
+    if np.ptp(y) == 0:
+        # A constant output is insensitive to every input (and SALib divides by its variance)
+        zero = {'mu_star': 0.0, 'mu_star_conf': 0.0, 'sigma': 0.0} if method == 'morris' else \
+               {'S1': 0.0, 'S1_conf': 0.0, 'ST': 0.0, 'ST_conf': 0.0}
+        return [dict(parameter=name, **zero) for name in names]
+    if method == 'morris':
+        Si = morris_analyze.analyze(problem, X, y, num_levels=MORRIS_LEVELS, seed=seed)
+        rows = [{'parameter': name, 'mu_star': float(Si['mu_star'][j]),
+                 'mu_star_conf': float(Si['mu_star_conf'][j]), 'sigma': float(Si['sigma'][j])}
+                for j, name in enumerate(names)]
+        return sorted(rows, key=lambda row: -row['mu_star'])
+    # SALib passes the input names to pandas.unique, which needs an array in pandas >= 3
+    Si = sobol_analyze.analyze(dict(problem, names=np.array(names)), y, calc_second_order=False, seed=seed)
+    rows = [{'parameter': name, 'S1': float(Si['S1'][j]), 'S1_conf': float(Si['S1_conf'][j]),
+             'ST': float(Si['ST'][j]), 'ST_conf': float(Si['ST_conf'][j])}
+            for j, name in enumerate(names)]
+    return sorted(rows, key=lambda row: -row['ST'])
+
+def analyze_sensitivity(base_kwargs, parameters, method='morris', outputs=DEFAULT_OUTPUTS,
+                        n_samples=None, seed=None, mode='steady_state',
+                        parallel_run=True, use_cache=True):
+    """
+    Rank kinetic, feedstock and operating inputs by their influence on the outputs.
+
+    Morris screening gives the mean absolute elementary effect (mu_star,
+    in output units over the full input range) and its spread (sigma,
+    interactions and non-linearity) at a cost of about 10 (D + 1) runs.
+    Sobol analysis gives first-order (S1) and total (ST) variance shares
+    at a cost of N (D + 2) runs. Identical design points are simulated
+    once, and points simulated before come from the result cache.
+
+    Parameters
+    ----------
+    base_kwargs : dict
+        Keyword arguments of the base scenario for `solve_steady_state`
+        (steady-state mode) or `run_simulation` (dynamic mode)
+    parameters : dict
+        Input name (Q, Temp, HRT, feedstock component or kinetic parameter)
+        to bounds, see `parameter_bounds`
+    method : str, optional
+        'morris' (default) or 'sobol'
+    outputs : sequence of str, optional
+        KPIs and effluent components to rank inputs for, see
+        `kpis.calculate_kpis`; by default methane flow, S_ac and pH
+    n_samples : int, optional
+        Morris trajectories (default 10) or Sobol base samples (default 64)
+    seed : int, optional
+        Random seed, for a reproducible design
+    mode : str, optional
+        'steady_state' to solve each point directly (default) or 'dynamic'
+    parallel_run : bool, optional
+        Spread the evaluations over the worker processes, by default True
+    use_cache : bool, optional
+        Serve points that were simulated before from the result cache,
+        by default True
+
+    Returns
+    -------
+    dict
+        'method', 'n_evaluations', 'n_simulations' (distinct points),
+        'n_discarded' (evaluations dropped with a failed point), 'bounds'
+        and 'sensitivities' (ranked indices per output)
+    """
+    if method not in DEFAULT_SAMPLES:
+        raise ValueError(f"Unknown method '{method}'. Use 'morris' or 'sobol'.")
+    if not parameters or len(parameters) < 2:
+        raise ValueError("Give bounds for at least two inputs.")
+    outputs = list(outputs)
+    check_outputs(outputs)
+
+    names = list(parameters)
+    bounds = [parameter_bounds(name, parameters[name], nominal_value(base_kwargs, name)) for name in names]
+    problem = {'num_vars': len(names), 'names': names, 'bounds': bounds}
+    X, block = sample_inputs(problem, method, n_samples or DEFAULT_SAMPLES[method], seed)
+    if len(X) > MAX_GSA_EVALUATIONS:
+        raise ValueError(f"Design needs {len(X)} evaluations, more than the limit of {MAX_GSA_EVALUATIONS} "
+                         "(ADM1_MAX_GSA_EVALUATIONS). Use fewer samples or inputs.")
+
+    # Morris trajectories on a coarse grid often revisit the same point
+    unique_X, inverse = np.unique(X, axis=0, return_inverse=True)
+    points = [{name: float(v) for name, v in zip(names, row)} for row in unique_X]
+    sys.stderr.write(f"DEBUG: {method} sensitivity analysis: {len(X)} evaluations, {len(points)} distinct points.\n")
+    sys.stderr.flush()
+
+    Y = np.full((len(points), len(outputs)), np.nan)
+    every = max(1, len(points) // 10)
+    for done, (i, result, error, from_cache) in enumerate(
+            iter_points(base_kwargs, points, mode, parallel_run, use_cache, max_points=MAX_GSA_EVALUATIONS), 1):
+        row = point_row(points[i], result, error, from_cache, outputs)
+        if row['success']:
+            Y[i] = [np.nan if row['kpis'][name] is None else row['kpis'][name] for name in outputs]
+        else:
+            sys.stderr.write(f"DEBUG WARNING: Sensitivity point {points[i]} failed: {row['error']}\n")
+        if done % every == 0:
+            sys.stderr.write(f"DEBUG: Sensitivity analysis {done}/{len(points)} points evaluated.\n")
+        sys.stderr.flush()
+    Y = Y[np.ravel(inverse)]
+
+    # A failed evaluation invalidates its trajectory (Morris) or base sample
+    # (Sobol); the analysis continues with the complete ones
+    complete = np.isfinite(Y).all(axis=1).reshape(-1, block).all(axis=1)
+    if complete.sum() < 2:
+        raise RuntimeError("Too few successful evaluations for a sensitivity analysis.")
+    keep = np.repeat(complete, block)
+    X, Y = X[keep], Y[keep]
+
+    return {
+        'method': method,
+        'n_evaluations': int(keep.size),
+        'n_simulations': len(points),
+        'n_discarded': int((~keep).sum()),
+        'bounds': dict(zip(names, bounds)),
+        'sensitivities': {name: _rank(problem, method, X, Y[:, k], seed) for k, name in enumerate(outputs)},
+    }
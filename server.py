@@ -15,7 +15,21 @@ from numbers import Number # To check if a value is numeric
 from qsdsan import processes as pc
 # from qsdsan.utils import load_components # Import necessary QSDsan functions
 from mcp.server.fastmcp import FastMCP
-from simulation import run_simulation, create_influent_stream
+from simulation import run_simulation, create_influent_stream, get_run_info
+from simulation import solve_steady_state, get_reactor_state, select_integration_method
+from simulation import KINETICS_BACKENDS, DEFAULT_KINETICS_BACKEND, OUTPUT_MODES, RECORD_DTYPES
+from parallel import run_simulations_parallel
+from results import SimulationResult
+from result_cache import result_key, get_cached_result, put_cached_result
+from trajectory_archive import load_trajectory, read_slice, read_lineage_slice, trajectory_path
+from parameter_sweep import sweep_parameters
+from branching import fork_branches
+from dynamic_influent import InfluentSeries, INTERPOLATIONS
+from plant_records import read_plant_records, TIME_UNITS
+from utils import FEEDSTOCK_KEYS
+from monte_carlo import run_monte_carlo
+from sensitivity import analyze_sensitivity
+from kpis import KPI_UNITS, output_units
 from ai_assistant import GeminiClient  # Keep import
 from inhibition import analyze_inhibition
 from stream_analysis import analyze_liquid_stream, analyze_gas_stream, analyze_biomass_yields
@@ -46,9 +60,11 @@ class ADM1SimulationState:
             {'Temp': 308.15, 'HRT': 45.0, 'method': 'BDF'},
             {'Temp': 308.15, 'HRT': 60.0, 'method': 'BDF'}
         ]
-        self.sim_results = [None, None, None]  # To store (sys, inf, eff, gas) tuples
+        self.sim_results = [None, None, None]  # (SimulationResult, inf, eff, gas) per scenario
+        self.final_states = [None, None, None]  # Final reactor state per scenario, kept for warm starts
         self.simulation_time = 150.0  # Default sim time in days
         self.t_step = 0.1  # Default time step in days
+        self.influent_profile = None  # Time-varying influent (InfluentSeries) of dynamic runs, if any
         self.ai_recommendations = None  # Store raw AI response if needed
         self.cmps = None # Store the components
         self.tool_responses = {}  # Dictionary to store tool responses by name and timestamp
@@ -694,6 +710,145 @@ def set_flow_parameters(flow_rate: float, simulation_time: float, time_step: flo
         }, indent=2)
 
 
+@mcp.tool()
+@capture_response
+def set_influent_profile(time: list = None, flow_rate: list = None, concentrations: dict = None,
+                         interpolation: str = "linear", period: float = None) -> str:
+    """
+    Set a time-varying influent for dynamic simulations, e.g. a diurnal flow profile, batch feeding or
+    seasonal changes, instead of chaining separate runs.
+
+    The profile applies on top of the constant influent from describe_feedstock and set_flow_parameters:
+    the flow and components it lists follow it, the rest stay constant. It is read by
+    run_simulation_tool, extend_simulation and fork_simulation. Call without a time list to go back
+    to the constant influent. Setting or clearing a profile clears existing results, which were
+    computed with the previous influent.
+
+    Args:
+        time: Time points in days, strictly increasing (e.g. [0, 0.25, 0.5, 0.75])
+        flow_rate: Flow rate (m3/d) at each time point, or omit to keep the constant flow
+        concentrations: Influent component concentrations (kg/m3) at each time point, keyed by component ID
+                        (e.g. {"S_su": [0.01, 0.5, 0.01, 0.01]})
+        interpolation: "linear" between time points (default), or "previous" to hold each value until the
+                       next point (batch feeding, step changes)
+        period: Repeat the profile every period days (e.g. 1.0 for a diurnal profile); by default values
+                beyond the last time point are held
+
+    Returns:
+        JSON string with a summary of the profile.
+    """
+    sys.stderr.write(f"DEBUG: Tool set_influent_profile called with {0 if not time else len(time)} time points\n")
+    sys.stderr.flush()
+    try:
+        if not time:
+            simulation_state.influent_profile = None
+            simulation_state.sim_results = [None] * len(simulation_state.sim_params)
+            return json.dumps({
+                "success": True,
+                "message": "Influent profile cleared; dynamic runs use the constant influent. Results cleared.",
+                "results_cleared": True
+            }, indent=2)
+        if interpolation not in INTERPOLATIONS:
+            return json.dumps({
+                "success": False,
+                "message": f"Interpolation must be one of: {', '.join(INTERPOLATIONS)}."
+            }, indent=2)
+        try:
+            profile = InfluentSeries(time, Q=flow_rate, concentrations=concentrations,
+                                     interpolation=interpolation, period=period)
+        except ValueError as e:
+            return json.dumps({"success": False, "message": str(e)}, indent=2)
+        unknown = [ID for ID in profile.concentrations if ID not in FEEDSTOCK_KEYS]
+        if unknown:
+            return json.dumps({
+                "success": False,
+                "message": f"Unknown influent components: {', '.join(unknown)}."
+            }, indent=2)
+        simulation_state.influent_profile = profile
+        simulation_state.sim_results = [None] * len(simulation_state.sim_params)
+        return json.dumps({
+            "success": True,
+            "message": "Influent profile set for dynamic simulations. Results cleared.",
+            "profile": profile.describe(),
+            "results_cleared": True
+        }, indent=2)
+    except Exception as e:
+        sys.stderr.write(f"DEBUG ERROR in set_influent_profile: {str(e)}\n")
+        sys.stderr.flush()
+        traceback.print_exc(file=sys.stderr)
+        return json.dumps({
+            "success": False,
+            "error": f"An unexpected error occurred: {str(e)}"
+        }, indent=2)
+
+
+@mcp.tool()
+@capture_response
+def load_plant_records(file_path: str, time_column: str, columns: dict, time_unit: str = "datetime",
+                       resample_hours: float = None, interpolation: str = "linear") -> str:
+    """
+    Load plant influent records (SCADA or lab exports, CSV or Parquet) as the time-varying influent.
+
+    The file is streamed in chunks and converted to an on-disk series that dynamic runs read
+    memory-mapped, so multi-year, minute-level historian exports replay through the model with
+    flat memory use. Loading the same file with the same settings again reuses the conversion.
+    Time starts at the first record; set simulation_time with set_flow_parameters to cover the
+    span to replay. As with set_influent_profile, existing results are cleared.
+
+    Args:
+        file_path: Path of the .csv or .parquet file
+        time_column: Column with the time of each record
+        columns: Record columns mapped to the influent: a component ID or "Q" to use the value as is
+                 (kg/m3, m3/d), or {target: factor} to convert units or split a measurement over several
+                 components, e.g. {"flow_m3h": {"Q": 24}, "COD_mgL": {"X_ch": 0.0003, "X_pr": 0.0004}}
+        time_unit: "datetime" for timestamps (default), or "d", "h", "min", "s" for a numeric time column
+        resample_hours: Average the records over bins of this many hours (e.g. 1 for hourly means);
+                        by default every record is kept
+        interpolation: "linear" (default) or "previous" to hold each record until the next
+
+    Returns:
+        JSON string with the loaded span, the number of records kept and dropped, and the mapped columns.
+    """
+    sys.stderr.write(f"DEBUG: Tool load_plant_records called for {file_path}\n")
+    sys.stderr.flush()
+    try:
+        if time_unit not in TIME_UNITS:
+            return json.dumps({
+                "success": False,
+                "message": f"Time unit must be one of: {', '.join(TIME_UNITS)}."
+            }, indent=2)
+        if interpolation not in INTERPOLATIONS:
+            return json.dumps({
+                "success": False,
+                "message": f"Interpolation must be one of: {', '.join(INTERPOLATIONS)}."
+            }, indent=2)
+        try:
+            profile = read_plant_records(
+                file_path, time_column, columns, time_unit=time_unit,
+                resample=resample_hours/24 if resample_hours else None, interpolation=interpolation
+            )
+        except (ValueError, KeyError, RuntimeError) as e:
+            return json.dumps({"success": False, "message": f"Could not read the records: {e}"}, indent=2)
+        simulation_state.influent_profile = profile
+        simulation_state.sim_results = [None] * len(simulation_state.sim_params)
+        summary = profile.describe()
+        return json.dumps({
+            "success": True,
+            "message": f"Loaded {summary['points']} influent records spanning {summary['span'][1] - summary['span'][0]:.2f} days. Results cleared.",
+            "profile": summary,
+            "rows": profile.source.get("rows"),
+            "results_cleared": True
+        }, indent=2)
+    except Exception as e:
+        sys.stderr.write(f"DEBUG ERROR in load_plant_records: {str(e)}\n")
+        sys.stderr.flush()
+        traceback.print_exc(file=sys.stderr)
+        return json.dumps({
+            "success": False,
+            "error": f"An unexpected error occurred: {str(e)}"
+        }, indent=2)
+
+
 @mcp.tool()
 @capture_response
 def set_reactor_parameters(reactor_index: int, temperature: float, hrt: float, integration_method: str) -> str:
@@ -704,7 +859,8 @@ def set_reactor_parameters(reactor_index: int, temperature: float, hrt: float, i
         reactor_index: Reactor simulation index (1, 2, or 3)
         temperature: Temperature (K)
         hrt: Hydraulic retention time (days)
-        integration_method: Integration method (e.g., "BDF", "RK45")
+        integration_method: Integration method (e.g., "BDF", "RK45"), or "auto" to pick the
+                            fastest stiff solver from short pilot runs
 
     Returns:
         Confirmation message
@@ -730,7 +886,7 @@ def set_reactor_parameters(reactor_index: int, temperature: float, hrt: float, i
             }, indent=2)
 
         # Validate integration method
-        valid_methods = ["BDF", "RK45", "RK23", "DOP853", "Radau", "LSODA"]
+        valid_methods = ["BDF", "RK45", "RK23", "DOP853", "Radau", "LSODA", "auto"]
         if integration_method not in valid_methods:
             return json.dumps({
                 "success": False,
@@ -765,18 +921,105 @@ def set_reactor_parameters(reactor_index: int, temperature: float, hrt: float, i
         }, indent=2)
 
 
+def _store_final_state(index, sim_result_tuple):
+    """Keep a scenario's final reactor state for later warm starts."""
+    state = get_reactor_state(sim_result_tuple[0])
+    if state is not None:
+        while len(simulation_state.final_states) <= index:
+            simulation_state.final_states.append(None)
+        simulation_state.final_states[index] = state
+
+def _warm_start_state(index):
+    """Final reactor state of a scenario's last successful run, or None."""
+    if index < len(simulation_state.final_states):
+        return simulation_state.final_states[index]
+    return None
+
+# solve_ivp integrators a stored run may be continued with
+IVP_METHODS = ("RK45", "RK23", "DOP853", "Radau", "BDF", "LSODA")
+
+def _continuation_method(run_info, params):
+    """
+    Integration method to continue a stored scenario with (extend or fork).
+
+    A dynamic run is continued with the integrator it used. A steady state
+    records its root solver instead, so it falls back to the scenario's
+    method, with 'auto' taken as BDF.
+    """
+    method = (run_info.get("solver_stats") or {}).get("method")
+    steady = str(run_info.get("stop_reason") or "").startswith("steady_state_")
+    if steady or method not in IVP_METHODS:
+        method = params['method']
+    return 'BDF' if method == 'auto' else method
+
+
 @mcp.tool()
 @capture_response
-def run_simulation_tool() -> str:  # Renamed to avoid conflict with imported run_simulation
+def run_simulation_tool(parallel: bool = True, stop_at_steady_state: bool = False,
+                        steady_state_tol: float = 1e-4, steady_state_window: float = 5.0,
+                        warm_start: bool = False, use_cache: bool = True,
+                        kinetics_backend: str = None, algebraic_h2: bool = False,
+                        output: str = None, track: str = None,
+                        record_dtype: str = None,
+                        checkpoint_interval: float = None) -> str:  # Renamed to avoid conflict with imported run_simulation
     """
     Run the ADM1 simulation(s) with the current parameters.
 
+    Args:
+        parallel: Run the reactor scenarios concurrently in worker processes (default True).
+                  Falls back to running them one after another if the process pool is unavailable.
+        stop_at_steady_state: End each run early once the reactor reaches steady state
+                              instead of always integrating the full simulation time (default False).
+        steady_state_tol: Steady-state tolerance on the normalized state-derivative norm (1/d, default 1e-4).
+        steady_state_window: Days the derivative norm must stay below the tolerance (default 5.0).
+        warm_start: Start each scenario from the final reactor state of its last successful run
+                    instead of the default initial conditions (default False). Useful after small
+                    parameter changes; scenarios without a previous run start from the defaults.
+        use_cache: Return stored results for configurations that were already simulated, without
+                   running the solver (default True). Results persist on disk across server restarts.
+        kinetics_backend: "qsdsan" to evaluate the QSDsan rate equations, or "numba" for the compiled
+                          kernel with the same equations (much faster per step, checked against QSDsan
+                          at the start of each run). Default from ADM1_KINETICS_BACKEND ("qsdsan").
+        algebraic_h2: Solve dissolved hydrogen from its quasi-steady-state balance at every step
+                      instead of integrating it (default False). Mainly speeds up explicit methods
+                      (RK45, RK23); best used with kinetics_backend "numba".
+        output: Time series to keep of each run: "steps" (the solver's own steps), "grid" (every
+                time_step), "dense" (the steps plus the solver's interpolant, for any time) or
+                "downsample" (the fewest steps that reproduce the others within 0.1%).
+                Default from ADM1_OUTPUT_MODE ("steps").
+        track: Components to keep in the time series, as comma-separated component IDs and the groups
+               "vfa", "inorganics" (S_IC, S_IN), "gas", "biomass" and "ions"; the flow is always kept.
+               Default from ADM1_TRACKED_COMPONENTS (all components).
+        record_dtype: "float64" or "float32" (half the memory) for the time series.
+                      Default from ADM1_RECORD_DTYPE ("float64").
+        checkpoint_interval: Simulated days between checkpoints of each run (0 for none). A run that
+                             was interrupted (crash, timeout, restart) resumes from its last checkpoint
+                             when run again with the same settings. Not available with output "dense".
+                             Default from ADM1_CHECKPOINT_INTERVAL (0).
+
     Returns:
         Success/failure message for each simulation scenario.
     """
     sys.stderr.write("DEBUG: Tool run_simulation_tool called.\n")
     sys.stderr.flush()
     try:
+        kinetics_backend = kinetics_backend or DEFAULT_KINETICS_BACKEND
+        if kinetics_backend not in KINETICS_BACKENDS:
+            return json.dumps({
+                "success": False,
+                "message": f"Kinetics backend must be one of: {', '.join(KINETICS_BACKENDS)}."
+            }, indent=2)
+        if output is not None and output not in OUTPUT_MODES:
+            return json.dumps({
+                "success": False,
+                "message": f"Output must be one of: {', '.join(OUTPUT_MODES)}."
+            }, indent=2)
+        if record_dtype is not None and record_dtype not in RECORD_DTYPES:
+            return json.dumps({
+                "success": False,
+                "message": f"Record dtype must be one of: {', '.join(RECORD_DTYPES)}."
+            }, indent=2)
+
         # Validate that we have influent values
         if not simulation_state.influent_values:
             sys.stderr.write("DEBUG: No influent values found in state.\n")
@@ -790,38 +1033,126 @@ def run_simulation_tool() -> str:  # Renamed to avoid conflict with imported run
         results_summary = []
         simulation_state.sim_results = [None] * len(simulation_state.sim_params)  # Reset results
 
-        for i, params in enumerate(simulation_state.sim_params):
-            sys.stderr.write(f"DEBUG: Starting simulation for reactor scenario {i + 1} with params: {params}\n")
+        scenario_kwargs = [
+            dict(
+                Q=simulation_state.Q,
+                Temp=params['Temp'],
+                HRT=params['HRT'],
+                concentrations=simulation_state.influent_values,
+                kinetic_params=simulation_state.kinetic_params,  # Pass current kinetics
+                simulation_time=simulation_state.simulation_time,
+                t_step=simulation_state.t_step,
+                method=params['method'],
+                use_kinetics=simulation_state.use_kinetics,  # Use flag
+                cache_slot=i,  # Reuse this scenario's compiled model and flowsheet
+                stop_at_steady_state=stop_at_steady_state,
+                steady_state_tol=steady_state_tol,
+                steady_state_window=steady_state_window,
+                initial_state=_warm_start_state(i) if warm_start else None,
+                backend=kinetics_backend,
+                algebraic_h2=algebraic_h2,
+                output=output,
+                track=track,
+                record_dtype=record_dtype,
+                checkpoint_interval=checkpoint_interval,
+                influent=simulation_state.influent_profile
+            )
+            for i, params in enumerate(simulation_state.sim_params)
+        ]
+
+        # Resolve method 'auto' here, so the result cache is keyed on the
+        # chosen method and the workers do not repeat the pilot runs
+        method_selections = [None] * len(scenario_kwargs)
+        for i, kwargs in enumerate(scenario_kwargs):
+            if kwargs['method'] == 'auto':
+                try:
+                    method_selections[i] = select_integration_method(
+                        kwargs['Q'], kwargs['Temp'], kwargs['HRT'], kwargs['concentrations'],
+                        kwargs['kinetic_params'], kwargs['use_kinetics'], backend=kinetics_backend,
+                        algebraic_h2=algebraic_h2
+                    )
+                    kwargs['method'] = method_selections[i]['method']
+                except Exception as e_auto:
+                    sys.stderr.write(f"DEBUG WARNING: Automatic method selection failed ({e_auto}); using BDF.\n")
+                    sys.stderr.flush()
+                    kwargs['method'] = 'BDF'
+
+        # Serve configurations that were already simulated from the result cache
+        outcomes = [None] * len(scenario_kwargs)
+        cache_keys = [result_key(kwargs) for kwargs in scenario_kwargs]
+        from_cache = [False] * len(scenario_kwargs)
+        if use_cache:
+            for i, key in enumerate(cache_keys):
+                cached = get_cached_result(key)
+                if cached is not None:
+                    sys.stderr.write(f"DEBUG: Reactor scenario {i + 1} served from the result cache.\n")
+                    sys.stderr.flush()
+                    outcomes[i] = (cached.to_tuple(), None)
+                    from_cache[i] = True
+        pending = [i for i, outcome in enumerate(outcomes) if outcome is None]
+
+        # Spread the scenarios across worker processes; each returns a compact,
+        # picklable SimulationResult instead of the live System
+        if parallel and len(pending) > 1:
+            sys.stderr.write(f"DEBUG: Starting {len(pending)} reactor scenarios in parallel.\n")
             sys.stderr.flush()
             try:
-                # Call the simulation logic from simulation.py
-                sim_result_tuple = run_simulation(
-                    Q=simulation_state.Q,
-                    Temp=params['Temp'],
-                    HRT=params['HRT'],
-                    concentrations=simulation_state.influent_values,
-                    kinetic_params=simulation_state.kinetic_params,  # Pass current kinetics
-                    simulation_time=simulation_state.simulation_time,
-                    t_step=simulation_state.t_step,
-                    method=params['method'],
-                    use_kinetics=simulation_state.use_kinetics  # Use flag
-                )
+                parallel_outcomes = run_simulations_parallel([scenario_kwargs[i] for i in pending])
+                for i, (result, error) in zip(pending, parallel_outcomes):
+                    if result is not None:
+                        result.archive(cache_keys[i])
+                        put_cached_result(cache_keys[i], result)
+                    outcomes[i] = (result.to_tuple() if result is not None else None, error)
+            except Exception as e_pool:
+                sys.stderr.write(f"DEBUG WARNING: Parallel execution unavailable ({e_pool}); running scenarios serially.\n")
+                sys.stderr.flush()
 
-                # Store the full result tuple (sys, inf, eff, gas)
+        for i in pending:
+            if outcomes[i] is not None:
+                continue
+            sys.stderr.write(f"DEBUG: Starting simulation for reactor scenario {i + 1} with params: {simulation_state.sim_params[i]}\n")
+            sys.stderr.flush()
+            try:
+                # Call the simulation logic from simulation.py; keep the compact
+                # result and release the System's trajectory data
+                result = SimulationResult.from_system(*run_simulation(**scenario_kwargs[i]), release=True)
+                result.archive(cache_keys[i])
+                put_cached_result(cache_keys[i], result)
+                outcomes[i] = (result.to_tuple(), None)
+            except Exception as e_sim:
+                traceback.print_exc(file=sys.stderr)  # Print detailed error to stderr
+                outcomes[i] = (None, e_sim)
+
+        for i, (sim_result_tuple, e_sim) in enumerate(outcomes):
+            params = simulation_state.sim_params[i]
+            if e_sim is None:
+                # Store the compact result tuple (result, inf, eff, gas)
                 simulation_state.sim_results[i] = sim_result_tuple
                 sys.stderr.write(f"DEBUG: Simulation {i + 1} completed successfully.\n")
                 sys.stderr.flush()
+                _store_final_state(i, sim_result_tuple)
+                run_info = get_run_info(sim_result_tuple[0])
                 results_summary.append({
                     "reactor_scenario": i + 1,
                     "success": True,
                     "parameters": params,
-                    "message": "Simulation successful."
+                    "message": "Simulation successful.",
+                    "stop_time": run_info.get("stop_time"),
+                    "stop_reason": run_info.get("stop_reason"),
+                    "warm_start": run_info.get("warm_start", False),
+                    "from_cache": from_cache[i],
+                    "run_id": cache_keys[i],
+                    "solver_stats": run_info.get("solver_stats"),
+                    "method_selection": method_selections[i],
+                    "kinetics_backend": run_info.get("kinetics_backend"),
+                    "algebraic_h2": run_info.get("algebraic_h2", False),
+                    "output": run_info.get("output"),
+                    "checkpoint": run_info.get("checkpoint"),
+                    "influent": run_info.get("influent")
                 })
-
-            except Exception as e_sim:
+            else:
                 sys.stderr.write(f"DEBUG ERROR: Simulation scenario {i + 1} failed: {str(e_sim)}\n")
                 sys.stderr.flush()
-                traceback.print_exc(file=sys.stderr)  # Print detailed error to stderr
                 simulation_state.sim_results[i] = None  # Ensure failed result is None
                 results_summary.append({
                     "reactor_scenario": i + 1,
@@ -849,6 +1180,605 @@ def run_simulation_tool() -> str:  # Renamed to avoid conflict with imported run
         }, indent=2)
 
 
+@mcp.tool()
+@capture_response
+def solve_steady_state_tool(use_previous_solution: bool = True, tolerance: float = 1e-6,
+                            kinetics_backend: str = None) -> str:
+    """
+    Solve directly for the steady state of each reactor scenario, without time integration.
+
+    Much faster than run_simulation_tool when only the steady-state effluent and biogas
+    are of interest. A short dynamic run is made only if the root finder does not converge.
+
+    Args:
+        use_previous_solution: Start from the final reactor state of each scenario's last successful
+                               simulation or steady-state solve, if one exists (default True).
+                               Otherwise start from the default initial conditions.
+        tolerance: Convergence tolerance on the normalized state-derivative norm (1/d, default 1e-6).
+        kinetics_backend: "qsdsan" or "numba", as for run_simulation_tool.
+
+    Returns:
+        Success/failure message and convergence details for each simulation scenario.
+    """
+    sys.stderr.write("DEBUG: Tool solve_steady_state_tool called.\n")
+    sys.stderr.flush()
+    try:
+        kinetics_backend = kinetics_backend or DEFAULT_KINETICS_BACKEND
+        if kinetics_backend not in KINETICS_BACKENDS:
+            return json.dumps({
+                "success": False,
+                "message": f"Kinetics backend must be one of: {', '.join(KINETICS_BACKENDS)}."
+            }, indent=2)
+
+        # Validate that we have influent values
+        if not simulation_state.influent_values:
+            return json.dumps({
+                "success": False,
+                "message": "Influent state variables are not set. Use describe_feedstock or describe_kinetics first."
+            }, indent=2)
+
+        results_summary = []
+        simulation_state.sim_results = [None] * len(simulation_state.sim_params)  # Reset results
+
+        for i, params in enumerate(simulation_state.sim_params):
+            initial_state = _warm_start_state(i) if use_previous_solution else None
+            sys.stderr.write(f"DEBUG: Solving steady state for reactor scenario {i + 1} "
+                             f"({'previous solution' if initial_state is not None else 'default initial conditions'}).\n")
+            sys.stderr.flush()
+            try:
+                steady_tuple = solve_steady_state(
+                    Q=simulation_state.Q,
+                    Temp=params['Temp'],
+                    HRT=params['HRT'],
+                    concentrations=simulation_state.influent_values,
+                    kinetic_params=simulation_state.kinetic_params,
+                    use_kinetics=simulation_state.use_kinetics,
+                    cache_slot=i,
+                    initial_state=initial_state,
+                    tol=tolerance,
+                    method=params['method'],
+                    backend=kinetics_backend
+                )
+                sim_result_tuple = SimulationResult.from_system(*steady_tuple, release=True).to_tuple()
+                run_info = get_run_info(sim_result_tuple[0])
+                simulation_state.sim_results[i] = sim_result_tuple
+                _store_final_state(i, sim_result_tuple)
+                results_summary.append({
+                    "reactor_scenario": i + 1,
+                    "success": True,
+                    "parameters": params,
+                    "message": "Steady state converged." if run_info.get("converged")
+                               else "Steady state did not fully converge; results are the best estimate found.",
+                    "converged": run_info.get("converged"),
+                    "derivative_norm": run_info.get("derivative_norm"),
+                    "solver": run_info.get("solver"),
+                    "wall_time": (run_info.get("solver_stats") or {}).get("wall_time"),
+                    "started_from": "previous solution" if initial_state is not None else "default initial conditions"
+                })
+            except Exception as e_sim:
+                sys.stderr.write(f"DEBUG ERROR: Steady-state solve for scenario {i + 1} failed: {str(e_sim)}\n")
+                sys.stderr.flush()
+                traceback.print_exc(file=sys.stderr)
+                results_summary.append({
+                    "reactor_scenario": i + 1,
+                    "success": False,
+                    "parameters": params,
+                    "error": f"Steady-state solve failed: {str(e_sim)}"
+                })
+
+        overall_success = any(r["success"] for r in results_summary)
+
+        return json.dumps({
+            "success": overall_success,
+            "message": "Steady-state solve finished. Check results for individual scenario outcomes.",
+            "results": results_summary
+        }, indent=2)
+
+    except Exception as e:
+        sys.stderr.write(f"DEBUG ERROR in solve_steady_state_tool: {str(e)}\n")
+        sys.stderr.flush()
+        traceback.print_exc(file=sys.stderr)
+        return json.dumps({
+            "success": False,
+            "error": f"An unexpected error occurred during the steady-state solve: {str(e)}"
+        }, indent=2)
+
+
+@mcp.tool()
+@capture_response
+def extend_simulation(simulation_index: int = 1, additional_days: float = 30.0,
+                      stop_at_steady_state: bool = False, steady_state_tol: float = 1e-4,
+                      steady_state_window: float = 5.0) -> str:
+    """
+    Continue a completed simulation scenario for more days from its final state.
+
+    The new segment is appended to the scenario's stored time series, so checking whether a digester
+    has settled does not mean rerunning from t=0 with a longer simulation time. The scenario's
+    integration method, kinetics backend, S_h2 treatment and output settings are reused. A scenario
+    solved with solve_steady_state_tool is continued from its steady state, starting at t=0.
+
+    Args:
+        simulation_index: Simulation scenario index (1, 2, or 3) (default 1)
+        additional_days: Days to simulate beyond the end of the current results (default 30)
+        stop_at_steady_state: End the continuation early once the reactor reaches steady state (default False)
+        steady_state_tol: Steady-state tolerance on the normalized state-derivative norm (1/d, default 1e-4)
+        steady_state_window: Days the derivative norm must stay below the tolerance (default 5.0)
+
+    Returns:
+        JSON string with the new time span, how the continuation ended and its solver statistics.
+    """
+    sys.stderr.write(f"DEBUG: Tool extend_simulation called for index: {simulation_index}, days: {additional_days}\n")
+    sys.stderr.flush()
+    try:
+        if not (1 <= simulation_index <= len(simulation_state.sim_params)):
+            return json.dumps({"success": False, "message": f"Simulation index must be between 1 and {len(simulation_state.sim_params)}."}, indent=2)
+        if not additional_days or additional_days <= 0:
+            return json.dumps({"success": False, "message": "additional_days must be positive."}, indent=2)
+
+        idx = simulation_index - 1
+        sim_result_tuple = simulation_state.sim_results[idx]
+        if not sim_result_tuple:
+            return json.dumps({
+                "success": False,
+                "message": f"Simulation scenario {simulation_index} has not been run successfully or results are missing."
+            }, indent=2)
+        result = sim_result_tuple[0]
+        state = get_reactor_state(result)
+        if state is None:
+            return json.dumps({
+                "success": False,
+                "message": f"No final reactor state was kept for simulation scenario {simulation_index}."
+            }, indent=2)
+
+        # Dynamic runs continue from their stop time; steady states start a new trajectory
+        run_info = get_run_info(result)
+        dynamic = run_info.get("stop_time") is not None and result.time_series is not None
+        start_time = float(run_info["stop_time"]) if dynamic else 0.0
+        output_info = run_info.get("output") or {}
+        params = simulation_state.sim_params[idx]
+        kwargs = dict(
+            Q=simulation_state.Q,
+            Temp=params['Temp'],
+            HRT=params['HRT'],
+            concentrations=simulation_state.influent_values,
+            kinetic_params=simulation_state.kinetic_params,
+            simulation_time=start_time + additional_days,
+            t_step=simulation_state.t_step,
+            method=_continuation_method(run_info, params),
+            use_kinetics=simulation_state.use_kinetics,
+            cache_slot=idx,
+            stop_at_steady_state=stop_at_steady_state,
+            steady_state_tol=steady_state_tol,
+            steady_state_window=steady_state_window,
+            initial_state=state,
+            backend=(run_info.get("kinetics_backend") or {}).get("backend"),
+            algebraic_h2=run_info.get("algebraic_h2", False),
+            output=output_info.get("mode"),
+            track=output_info.get("components"),
+            record_dtype=output_info.get("dtype"),
+            start_time=start_time,
+            influent=simulation_state.influent_profile
+        )
+        segment = SimulationResult.from_system(*run_simulation(**kwargs), release=True)
+        combined = result.extend(segment) if dynamic else segment
+        previous_id = os.path.basename(result.archive_path) if result.archive_path else None
+        run_id = result_key(dict(kwargs, extends=previous_id))
+        combined.archive(run_id)
+        simulation_state.sim_results[idx] = combined.to_tuple()
+        _store_final_state(idx, simulation_state.sim_results[idx])
+
+        segment_info = segment.run_info
+        return json.dumps({
+            "success": True,
+            "simulation_index": simulation_index,
+            "message": f"Simulation scenario {simulation_index} continued from t = {start_time:g} d.",
+            "start_time": start_time,
+            "stop_time": segment_info.get("stop_time"),
+            "stop_reason": segment_info.get("stop_reason"),
+            "derivative_norm": segment_info.get("derivative_norm"),
+            "points": 0 if combined.time_series is None else len(combined.time_series),
+            "solver_stats": segment_info.get("solver_stats"),
+            "run_id": run_id
+        }, indent=2)
+
+    except Exception as e:
+        sys.stderr.write(f"DEBUG ERROR in extend_simulation: {str(e)}\n")
+        sys.stderr.flush()
+        traceback.print_exc(file=sys.stderr)
+        return json.dumps({
+            "success": False,
+            "error": f"An unexpected error occurred: {str(e)}"
+        }, indent=2)
+
+
+@mcp.tool()
+@capture_response
+def fork_simulation(branches: list, simulation_index: int = 1, fork_time: float = None,
+                    duration: float = 30.0, parallel: bool = True, use_cache: bool = True,
+                    engine: str = "individual") -> str:
+    """
+    Branch a completed simulation scenario into several what-if continuations from its state at one time.
+
+    The reactor state at the fork is taken from the scenario's results and every branch starts from it,
+    so studying upsets (a shock load, a temperature drop, an HRT change) does not re-integrate the
+    start-up once per branch. Branches run in parallel and keep only their own trajectory after the
+    fork; get_time_series with a branch's run_id returns the shared history before the fork as well.
+    The scenario's integration method, kinetics backend, S_h2 treatment and tracked components are reused.
+
+    Args:
+        branches: One dict per branch with the parameters that change at the fork, keyed like
+                  run_parameter_sweep parameters (Q, Temp, HRT, influent components, kinetic parameters),
+                  plus an optional "name", e.g. [{"name": "control"}, {"name": "cold", "Temp": 298.15},
+                  {"name": "shock", "S_su": 20.0}]. An empty change list continues unchanged as a control.
+        simulation_index: Simulation scenario index (1, 2, or 3) to fork (default 1)
+        fork_time: Time of the fork in days (default the end of the run). Times within a run need the
+                   records of every component, or output="dense"; "grid" output points fork exactly.
+        duration: Days to simulate after the fork (default 30)
+        parallel: Run the branches in worker processes (default True)
+        use_cache: Reuse stored results of branches that were simulated before (default True)
+        engine: "individual" (default) or "ensemble" to integrate the branches together as one system
+
+    Returns:
+        JSON string with the fork time and, per branch, its changes, run_id and key performance indicators.
+    """
+    sys.stderr.write(f"DEBUG: Tool fork_simulation called for index: {simulation_index}, fork_time: {fork_time}, branches: {branches}\n")
+    sys.stderr.flush()
+    try:
+        if not (1 <= simulation_index <= len(simulation_state.sim_params)):
+            return json.dumps({"success": False, "message": f"Simulation index must be between 1 and {len(simulation_state.sim_params)}."}, indent=2)
+        idx = simulation_index - 1
+        sim_result_tuple = simulation_state.sim_results[idx]
+        if not sim_result_tuple:
+            return json.dumps({
+                "success": False,
+                "message": f"Simulation scenario {simulation_index} has not been run successfully or results are missing."
+            }, indent=2)
+        result = sim_result_tuple[0]
+        run_info = get_run_info(result)
+        output_info = run_info.get("output") or {}
+        params = simulation_state.sim_params[idx]
+        base_kwargs = dict(
+            Q=simulation_state.Q,
+            Temp=params['Temp'],
+            HRT=params['HRT'],
+            concentrations=simulation_state.influent_values,
+            kinetic_params=simulation_state.kinetic_params,
+            t_step=simulation_state.t_step,
+            method=_continuation_method(run_info, params),
+            use_kinetics=simulation_state.use_kinetics,
+            backend=(run_info.get("kinetics_backend") or {}).get("backend"),
+            algebraic_h2=run_info.get("algebraic_h2", False),
+            output=None if output_info.get("mode") == "dense" else output_info.get("mode"),
+            track=output_info.get("components"),
+            record_dtype=output_info.get("dtype"),
+            influent=simulation_state.influent_profile
+        )
+        try:
+            rows = fork_branches(result, branches, base_kwargs, fork_time=fork_time, duration=duration,
+                                 parallel_run=parallel, use_cache=use_cache, engine=engine)
+        except ValueError as e:
+            return json.dumps({"success": False, "message": str(e)}, indent=2)
+
+        def compact(value):
+            return float(f"{value:.5g}") if isinstance(value, Number) else value
+
+        table = []
+        for row in rows:
+            entry = {"name": row['name'], "changes": row['point'], "run_id": row['run_id']}
+            if row['success']:
+                entry["kpis"] = {name: compact(value) for name, value in row['kpis'].items()}
+                entry["stop_time"] = row['run_info'].get("stop_time")
+            else:
+                entry["error"] = row['error']
+            table.append(entry)
+        fork = next((row['run_info']['fork'] for row in rows if row['run_info'].get('fork')), {})
+        n_ok = sum(row['success'] for row in rows)
+        return json.dumps({
+            "success": n_ok > 0,
+            "message": f"Forked simulation scenario {simulation_index} into {len(rows)} branches: {n_ok} succeeded "
+                       f"({sum(row['from_cache'] for row in rows)} from cache).",
+            "fork_time": fork.get("fork_time"),
+            "parent_run_id": fork.get("parent"),
+            "engine": engine,
+            "units": {name: KPI_UNITS[name] for name in KPI_UNITS},
+            "branches": table
+        }, indent=2)
+
+    except Exception as e:
+        sys.stderr.write(f"DEBUG ERROR in fork_simulation: {str(e)}\n")
+        sys.stderr.flush()
+        traceback.print_exc(file=sys.stderr)
+        return json.dumps({
+            "success": False,
+            "error": f"An unexpected error occurred: {str(e)}"
+        }, indent=2)
+
+
+def _scenario_base_kwargs(index, mode, stop_at_steady_state=True):
+    """Simulation arguments of a reactor scenario, as the base of sweeps and sampling studies."""
+    params = simulation_state.sim_params[index]
+    base_kwargs = dict(
+        Q=simulation_state.Q,
+        Temp=params['Temp'],
+        HRT=params['HRT'],
+        concentrations=simulation_state.influent_values,
+        kinetic_params=simulation_state.kinetic_params,
+        use_kinetics=simulation_state.use_kinetics,
+        method=params['method'],
+        backend=DEFAULT_KINETICS_BACKEND
+    )
+    if mode == "dynamic":
+        base_kwargs.update(
+            simulation_time=simulation_state.simulation_time,
+            t_step=simulation_state.t_step,
+            stop_at_steady_state=stop_at_steady_state
+        )
+    return base_kwargs
+
+
+@mcp.tool()
+@capture_response
+def run_parameter_sweep(parameters: dict, combine: str = "grid", reactor_index: int = 1,
+                        mode: str = "dynamic", stop_at_steady_state: bool = True,
+                        parallel: bool = True, use_cache: bool = True, engine: str = "individual") -> str:
+    """
+    Sweep one or more parameters around a reactor scenario and tabulate the key performance indicators.
+
+    All sweep points are simulated in one call, spread over the worker processes.
+
+    Args:
+        parameters: Values to sweep, keyed by parameter name. Names can be Q (m3/d), Temp (K), HRT (days),
+                    any influent component (e.g. "S_su", "X_ch") or any kinetic parameter (e.g. "k_ac", "KI_nh3").
+                    Each value is a list (e.g. {"HRT": [15, 20, 30]}) or a range
+                    {"start": 15, "stop": 40, "num": 6} (add "log": true for logarithmic spacing).
+        combine: "grid" to simulate every combination of the values (default), or "zip" to pair the
+                 i-th values of all parameters.
+        reactor_index: Reactor scenario (1-based) whose temperature, HRT and integration method are the
+                       base for parameters that are not swept (default 1).
+        mode: "dynamic" to integrate each point over the simulation time (default), or "steady_state" to
+              solve for each point's steady state directly (much faster).
+        stop_at_steady_state: In dynamic mode, end each run once the reactor reaches steady state (default True).
+        parallel: Run the sweep points in worker processes (default True).
+        use_cache: Reuse stored results of points that were simulated before (default True).
+        engine: "individual" to simulate each point on its own (default), or "ensemble" to integrate
+                batches of dynamic points together as one system (faster for many points; needs numba).
+
+    Returns:
+        A table with one row per sweep point: the swept values, methane flow, CH4 %, methane yield,
+        effluent COD, COD removal, total VFA, pH and maximum inhibition.
+    """
+    sys.stderr.write(f"DEBUG: Tool run_parameter_sweep called with parameters={parameters}, combine={combine}, mode={mode}, engine={engine}\n")
+    sys.stderr.flush()
+    try:
+        if not simulation_state.influent_values:
+            return json.dumps({
+                "success": False,
+                "message": "Influent state variables are not set. Use describe_feedstock or describe_kinetics first."
+            }, indent=2)
+        if not (1 <= reactor_index <= len(simulation_state.sim_params)):
+            return json.dumps({"success": False, "message": f"Reactor index must be between 1 and {len(simulation_state.sim_params)}."}, indent=2)
+        if mode not in ("dynamic", "steady_state"):
+            return json.dumps({"success": False, "message": "Mode must be 'dynamic' or 'steady_state'."}, indent=2)
+
+        base_kwargs = _scenario_base_kwargs(reactor_index - 1, mode, stop_at_steady_state)
+
+        try:
+            rows = sweep_parameters(base_kwargs, parameters, combine=combine, mode=mode,
+                                    parallel_run=parallel, use_cache=use_cache, engine=engine)
+        except ValueError as e:
+            return json.dumps({"success": False, "message": str(e)}, indent=2)
+
+        def compact(value):
+            return float(f"{value:.5g}") if isinstance(value, Number) else value
+
+        # Compact table: swept values followed by the KPIs, one list per point
+        swept = list(parameters)
+        kpi_names = list(KPI_UNITS)
+        table = []
+        failures = []
+        for n, row in enumerate(rows):
+            values = [compact(row['point'][name]) for name in swept]
+            if row['success']:
+                values += [compact(row['kpis'][name]) for name in kpi_names]
+            else:
+                values += [None] * len(kpi_names)
+                failures.append({"row": n, "point": row['point'], "error": row['error']})
+            table.append(values)
+
+        n_ok = len(rows) - len(failures)
+        return json.dumps({
+            "success": n_ok > 0,
+            "message": f"Parameter sweep finished: {n_ok} of {len(rows)} points succeeded "
+                       f"({sum(row['from_cache'] for row in rows)} from cache).",
+            "mode": mode,
+            "engine": engine,
+            "base_reactor_scenario": reactor_index,
+            "columns": swept + kpi_names,
+            "units": {name: KPI_UNITS[name] for name in kpi_names},
+            "rows": table,
+            "failures": failures
+        }, indent=2)
+
+    except Exception as e:
+        sys.stderr.write(f"DEBUG ERROR in run_parameter_sweep: {str(e)}\n")
+        sys.stderr.flush()
+        traceback.print_exc(file=sys.stderr)
+        return json.dumps({
+            "success": False,
+            "error": f"An unexpected error occurred during the parameter sweep: {str(e)}"
+        }, indent=2)
+
+
+@mcp.tool()
+@capture_response
+def run_monte_carlo_analysis(distributions: dict, n_samples: int = 100, reactor_index: int = 1,
+                             mode: str = "dynamic", outputs: list = None, percentiles: list = None,
+                             seed: int = None, stop_at_steady_state: bool = True,
+                             parallel: bool = True, use_cache: bool = True,
+                             engine: str = "individual") -> str:
+    """
+    Propagate kinetic parameter uncertainty to reactor performance by Monte Carlo simulation.
+
+    Kinetic parameters are sampled by Latin hypercube sampling and simulated in worker processes;
+    the running percentiles of the outputs are updated as each sample finishes.
+
+    Args:
+        distributions: Distribution per kinetic parameter (e.g. "k_ac", "K_ac", "KI_nh3"). Each is an object
+                       with "dist" and its settings:
+                       {"dist": "uniform", "low": 4, "high": 12},
+                       {"dist": "loguniform", "low": 1e-4, "high": 1e-2},
+                       {"dist": "triangular", "low": 4, "mode": 8, "high": 12},
+                       {"dist": "normal", "mean": 8, "std": 2} (or "cv": 0.25),
+                       {"dist": "lognormal", "median": 8, "sigma": 0.3} (or "cv": 0.3).
+                       A missing mean/median/mode defaults to the current kinetic parameter value.
+        n_samples: Number of samples (default 100).
+        reactor_index: Reactor scenario (1-based) to analyze (default 1).
+        mode: "dynamic" to integrate each sample over the simulation time (default), or "steady_state" to
+              solve for each sample's steady state directly (much faster).
+        outputs: KPIs to report (default ["methane_yield", "effluent_COD"]). Available: methane_flow,
+                 methane_percent, methane_yield, effluent_COD, COD_removal, total_VFA, pH, max_inhibition,
+                 or an ADM1 component ID for its effluent concentration in mg/L (e.g. "S_ac").
+        percentiles: Percentiles to report (default [5, 50, 95]).
+        seed: Random seed for reproducible samples (default: random).
+        stop_at_steady_state: In dynamic mode, end each run once the reactor reaches steady state (default True).
+        parallel: Run the samples in worker processes (default True).
+        use_cache: Reuse stored results of samples that were simulated before (default True).
+        engine: "individual" to simulate each sample on its own (default), or "ensemble" to integrate
+                batches of dynamic samples together as one system (faster for many samples; needs numba).
+
+    Returns:
+        Mean, standard deviation, median and the requested percentiles of each output, and how they settled as samples completed.
+    """
+    sys.stderr.write(f"DEBUG: Tool run_monte_carlo_analysis called with distributions={distributions}, n_samples={n_samples}, mode={mode}, engine={engine}\n")
+    sys.stderr.flush()
+    try:
+        if not simulation_state.influent_values:
+            return json.dumps({
+                "success": False,
+                "message": "Influent state variables are not set. Use describe_feedstock or describe_kinetics first."
+            }, indent=2)
+        if not (1 <= reactor_index <= len(simulation_state.sim_params)):
+            return json.dumps({"success": False, "message": f"Reactor index must be between 1 and {len(simulation_state.sim_params)}."}, indent=2)
+        if mode not in ("dynamic", "steady_state"):
+            return json.dumps({"success": False, "message": "Mode must be 'dynamic' or 'steady_state'."}, indent=2)
+
+        base_kwargs = _scenario_base_kwargs(reactor_index - 1, mode, stop_at_steady_state)
+
+        try:
+            mc = run_monte_carlo(base_kwargs, distributions, n_samples=n_samples,
+                                 outputs=tuple(outputs or ("methane_yield", "effluent_COD")),
+                                 percentiles=tuple(percentiles or (5, 50, 95)), seed=seed, mode=mode,
+                                 parallel_run=parallel, use_cache=use_cache, engine=engine)
+        except ValueError as e:
+            return json.dumps({"success": False, "message": str(e)}, indent=2)
+
+        def compact(summary):
+            return {k: (float(f"{v:.5g}") if isinstance(v, float) else v) for k, v in summary.items()}
+
+        n_ok = mc['completed'] - mc['failed']
+        return json.dumps({
+            "success": n_ok > 1,
+            "message": f"Monte Carlo analysis finished: {n_ok} of {mc['n_samples']} samples succeeded.",
+            "mode": mode,
+            "engine": engine,
+            "base_reactor_scenario": reactor_index,
+            "uncertain_parameters": list(distributions),
+            "units": {name: output_units(name) for name in mc['statistics']},
+            "statistics": {name: compact(summary) for name, summary in mc['statistics'].items()},
+            "convergence": [
+                {"completed": snap['completed'],
+                 "statistics": {name: compact(summary) for name, summary in snap['statistics'].items()}}
+                for snap in mc['convergence']
+            ]
+        }, indent=2)
+
+    except Exception as e:
+        sys.stderr.write(f"DEBUG ERROR in run_monte_carlo_analysis: {str(e)}\n")
+        sys.stderr.flush()
+        traceback.print_exc(file=sys.stderr)
+        return json.dumps({
+            "success": False,
+            "error": f"An unexpected error occurred during the Monte Carlo analysis: {str(e)}"
+        }, indent=2)
+
+
+@mcp.tool()
+@capture_response
+def run_sensitivity_analysis(parameters: dict, method: str = "morris", outputs: list = None,
+                             n_samples: int = None, reactor_index: int = 1, mode: str = "steady_state",
+                             seed: int = None, parallel: bool = True, use_cache: bool = True) -> str:
+    """
+    Rank kinetic, feedstock and operating inputs by their influence on reactor performance
+    (global sensitivity analysis by Morris screening or Sobol indices).
+
+    Args:
+        parameters: Input ranges keyed by name (Q, Temp, HRT, any feedstock component or kinetic parameter);
+                    each is [low, high], {"low": ..., "high": ...} or {"rel": 0.3} for +/-30% around the
+                    current value. At least two inputs.
+        method: "morris" for screening with elementary effects (default, about 10 x (inputs + 1) runs), or
+                "sobol" for first-order and total variance indices (about 64 x (inputs + 2) runs).
+        outputs: KPIs and effluent components to rank inputs for (default ["methane_flow", "S_ac", "pH"]).
+                 KPIs: methane_flow, methane_percent, methane_yield, effluent_COD, COD_removal, total_VFA,
+                 pH, max_inhibition; any ADM1 component ID gives its effluent concentration in mg/L.
+        n_samples: Morris trajectories (default 10) or Sobol base samples (default 64, rounded up to a power of 2).
+        reactor_index: Reactor scenario (1-based) that sets the values of inputs that are not varied (default 1).
+        mode: "steady_state" to solve each point's steady state directly (default), or "dynamic" to
+              integrate each point over the simulation time (much slower).
+        seed: Random seed for a reproducible design (default: random).
+        parallel: Evaluate the points in worker processes (default True).
+        use_cache: Reuse stored results of points that were simulated before (default True).
+
+    Returns:
+        For each output, the inputs ranked from most to least influential with their indices
+        (Morris: mu_star, sigma; Sobol: S1, ST) and confidence intervals.
+    """
+    sys.stderr.write(f"DEBUG: Tool run_sensitivity_analysis called with parameters={parameters}, method={method}, mode={mode}\n")
+    sys.stderr.flush()
+    try:
+        if not simulation_state.influent_values:
+            return json.dumps({
+                "success": False,
+                "message": "Influent state variables are not set. Use describe_feedstock or describe_kinetics first."
+            }, indent=2)
+        if not (1 <= reactor_index <= len(simulation_state.sim_params)):
+            return json.dumps({"success": False, "message": f"Reactor index must be between 1 and {len(simulation_state.sim_params)}."}, indent=2)
+        if mode not in ("dynamic", "steady_state"):
+            return json.dumps({"success": False, "message": "Mode must be 'dynamic' or 'steady_state'."}, indent=2)
+
+        base_kwargs = _scenario_base_kwargs(reactor_index - 1, mode, stop_at_steady_state=True)
+        try:
+            gsa = analyze_sensitivity(base_kwargs, parameters, method=method,
+                                      outputs=tuple(outputs or ("methane_flow", "S_ac", "pH")),
+                                      n_samples=n_samples, seed=seed, mode=mode,
+                                      parallel_run=parallel, use_cache=use_cache)
+        except ValueError as e:
+            return json.dumps({"success": False, "message": str(e)}, indent=2)
+
+        def compact(row):
+            return {k: (float(f"{v:.4g}") if isinstance(v, float) else v) for k, v in row.items()}
+
+        return json.dumps({
+            "success": True,
+            "message": f"{method.capitalize()} sensitivity analysis finished with {gsa['n_evaluations']} model "
+                       f"evaluations ({gsa['n_simulations']} distinct points, {gsa['n_discarded']} discarded after failures).",
+            "method": method,
+            "mode": mode,
+            "base_reactor_scenario": reactor_index,
+            "bounds": gsa['bounds'],
+            "units": {name: output_units(name) for name in gsa['sensitivities']},
+            "sensitivities": {name: [compact(row) for row in rows] for name, rows in gsa['sensitivities'].items()}
+        }, indent=2)
+
+    except Exception as e:
+        sys.stderr.write(f"DEBUG ERROR in run_sensitivity_analysis: {str(e)}\n")
+        sys.stderr.flush()
+        traceback.print_exc(file=sys.stderr)
+        return json.dumps({
+            "success": False,
+            "error": f"An unexpected error occurred during the sensitivity analysis: {str(e)}"
+        }, indent=2)
+
+
 @mcp.tool()
 @capture_response
 def get_stream_properties(stream_type: str) -> str:
@@ -1040,6 +1970,154 @@ def get_biomass_yields(simulation_index: int) -> str:
         }, indent=2)
 
 
+@mcp.tool()
+@capture_response
+def get_solver_statistics(simulation_index: int) -> str:
+    """
+    Get the integrator diagnostics of a simulation scenario's last run.
+
+    Use this to see why a run was slow or to choose an integration method: explicit methods
+    (RK45, RK23, DOP853) take very many small steps on stiff feedstocks, while implicit methods
+    (BDF, Radau, LSODA) trade fewer steps for Jacobian evaluations and LU decompositions.
+
+    Args:
+        simulation_index: Simulation scenario index (1, 2, or 3)
+
+    Returns:
+        JSON string with wall time (s), right-hand-side evaluations, Jacobian evaluations,
+        LU decompositions, accepted and rejected steps, and the final step size (days).
+    """
+    sys.stderr.write(f"DEBUG: Tool get_solver_statistics called for index: {simulation_index}\n")
+    sys.stderr.flush()
+    try:
+        if not (1 <= simulation_index <= len(simulation_state.sim_params)):
+            return json.dumps({"success": False, "message": f"Simulation index must be between 1 and {len(simulation_state.sim_params)}."}, indent=2)
+
+        sim_result_tuple = simulation_state.sim_results[simulation_index - 1]
+        if not sim_result_tuple:
+            return json.dumps({
+                "success": False,
+                "message": f"Simulation scenario {simulation_index} has not been run successfully or results are missing."
+            }, indent=2)
+
+        run_info = get_run_info(sim_result_tuple[0])
+        solver_stats = run_info.get("solver_stats")
+        if not solver_stats:
+            return json.dumps({
+                "success": False,
+                "message": f"No solver statistics were recorded for simulation scenario {simulation_index}."
+            }, indent=2)
+
+        return json.dumps({
+            "success": True,
+            "simulation_index": simulation_index,
+            "parameters": simulation_state.sim_params[simulation_index - 1],
+            "stop_time": run_info.get("stop_time"),
+            "stop_reason": run_info.get("stop_reason"),
+            "solver_message": run_info.get("solver_message"),
+            "solver_stats": solver_stats
+        }, indent=2)
+
+    except Exception as e:
+        sys.stderr.write(f"DEBUG ERROR in get_solver_statistics: {str(e)}\n")
+        sys.stderr.flush()
+        traceback.print_exc(file=sys.stderr)
+        return json.dumps({
+            "success": False,
+            "error": f"An unexpected error occurred: {str(e)}"
+        }, indent=2)
+
+
+@mcp.tool()
+@capture_response
+def get_time_series(simulation_index: int = 1, stream: str = "effluent", components: list = None,
+                    start_time: float = None, end_time: float = None, max_points: int = 200,
+                    run_id: str = None) -> str:
+    """
+    Get recorded concentrations and flow of a stream over time.
+
+    Trajectories are kept in an on-disk archive (ADM1_TRAJECTORY_DIR) and only the requested
+    window and columns are read, so past runs stay available for comparison without being held
+    in memory.
+
+    Args:
+        simulation_index: Simulation scenario index (1, 2, or 3) of the current results (default 1)
+        stream: "effluent" (mg/L) or "biogas" (mg/L of gas), with the flow "Q" in m3/d
+        components: Component IDs to return, plus "Q" for the flow (default all recorded columns)
+        start_time: Start of the time window in days (default start of the run)
+        end_time: End of the time window in days (default end of the run)
+        max_points: Upper limit on the time points returned; longer windows are thinned evenly (default 200)
+        run_id: Fingerprint of an archived run, as reported by run_simulation_tool or fork_simulation;
+                overrides simulation_index to read runs that are no longer current. A forked branch
+                includes the history of the run it was forked from.
+
+    Returns:
+        JSON string with the time points and one series per column.
+    """
+    sys.stderr.write(f"DEBUG: Tool get_time_series called for index: {simulation_index}, run: {run_id}\n")
+    sys.stderr.flush()
+    try:
+        if stream not in ("effluent", "biogas"):
+            return json.dumps({"success": False, "message": "Stream must be 'effluent' or 'biogas'."}, indent=2)
+
+        if run_id:
+            path = trajectory_path(run_id)
+            loaded = load_trajectory(path) if path else None
+            if loaded is None:
+                return json.dumps({
+                    "success": False,
+                    "message": f"No archived trajectory found for run {run_id}."
+                }, indent=2)
+            time_series, records, columns = loaded
+            labels = (columns or {}).get(stream)
+        else:
+            if not (1 <= simulation_index <= len(simulation_state.sim_params)):
+                return json.dumps({"success": False, "message": f"Simulation index must be between 1 and {len(simulation_state.sim_params)}."}, indent=2)
+            sim_result_tuple = simulation_state.sim_results[simulation_index - 1]
+            if not sim_result_tuple:
+                return json.dumps({
+                    "success": False,
+                    "message": f"Simulation scenario {simulation_index} has not been run successfully or results are missing."
+                }, indent=2)
+            result = sim_result_tuple[0]
+            time_series, records = result.time_series, result.records
+            labels = result.columns(stream) if stream in records else None
+        if time_series is None or stream not in records or not labels:
+            return json.dumps({"success": False, "message": f"No {stream} time series was recorded."}, indent=2)
+
+        components = list(components) if components else labels
+        unknown = [c for c in components if c not in labels]
+        if unknown:
+            return json.dumps({
+                "success": False,
+                "message": f"Not recorded: {', '.join(unknown)}. Recorded columns are: {', '.join(labels)}."
+            }, indent=2)
+
+        if run_id:
+            t, rows, _ = read_lineage_slice(path, stream, start_time, end_time, max_points)
+        else:
+            t, rows = read_slice(time_series, records[stream], start_time, end_time, max_points)
+        return json.dumps({
+            "success": True,
+            "simulation_index": None if run_id else simulation_index,
+            "run_id": run_id,
+            "stream": stream,
+            "recorded_points": int(len(time_series)),
+            "points": int(len(t)),
+            "time": t.tolist(),
+            "series": {c: rows[:, labels.index(c)].astype(float).tolist() for c in components}
+        }, indent=2)
+
+    except Exception as e:
+        sys.stderr.write(f"DEBUG ERROR in get_time_series: {str(e)}\n")
+        sys.stderr.flush()
+        traceback.print_exc(file=sys.stderr)
+        return json.dumps({
+            "success": False,
+            "error": f"An unexpected error occurred: {str(e)}"
+        }, indent=2)
+
+
 @mcp.tool()
 @capture_response
 def reset_simulation() -> str:
@@ -1122,7 +2200,7 @@ def check_nutrient_balance(simulation_index: int, element: str, inhibition_thres
         if not simulation_state.influent_values:
              return json.dumps({"success": False, "message": "Influent state variables not set."}, indent=2)
 
-        sys, inf_obj, eff_obj, gas_obj = sim_result_tuple
+        _, inf_obj, eff_obj, gas_obj = sim_result_tuple
 
         # 1. Get Inhibition Analysis
         inhibition_results = analyze_inhibition(sim_result_tuple)
@@ -1939,7 +3017,7 @@ def set_parameter(parameter_type: str, parameter_name: str, value, reactor_index
                         message = f"Invalid value for reactor parameter 'method'. Must be a string (e.g., 'BDF')."
                     else:
                         # Optional: Add validation against known methods
-                        valid_methods = ["BDF", "RK45", "RK23", "DOP853", "Radau", "LSODA"]
+                        valid_methods = ["BDF", "RK45", "RK23", "DOP853", "Radau", "LSODA", "auto"]
                         if processed_value not in valid_methods:
                             message = f"Warning: Integration method '{processed_value}' is not in the standard list: {valid_methods}. Using it anyway."
                         target_param[parameter_name] = processed_value
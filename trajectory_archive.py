@@ -0,0 +1,252 @@
+"""
+Memory-mapped archive of ADM1 simulation trajectories
+"""
+import os
+import sys
+import json
+import shutil
+import numpy as np
+
+# One directory per run, named by its fingerprint (`result_cache.result_key`),
+# holding the time vector and each stream's records as .npy files that are
+# read back memory-mapped. Runs beyond the limit are removed oldest first. Set
+# ADM1_TRAJECTORY_DIR to an empty string to keep trajectories in memory only.
+# A run forked from another one's state (see `branching`) holds only the rows
+# from the fork on and names its parent, whose rows give the history before.
+TRAJECTORY_DIR = os.environ.get(
+    'ADM1_TRAJECTORY_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'trajectories')
+)
+TRAJECTORY_MAX_RUNS = int(os.environ.get('ADM1_TRAJECTORY_MAX_RUNS', 500))
+
+_META_FILE = 'meta.json'
+
+def trajectory_path(key):
+    """Directory of an archived run, or None if archiving is disabled."""
+    if not TRAJECTORY_DIR:
+        return None
+    return os.path.join(TRAJECTORY_DIR, key)
+
+def archive_trajectory(key, time_series, records, columns=None, parent=None):
+    """
+    Write a run's time vector and stream records to the archive.
+
+    A run is written once: its fingerprint fixes the content, so an
+    existing entry is kept (and marked as recently used).
+
+    Parameters
+    ----------
+    key : str
+        Run fingerprint, see `result_cache.result_key`
+    time_series : numpy.ndarray
+        Time points in days
+    records : dict
+        Stream records keyed by stream name, one row per time point
+    columns : dict, optional
+        Labels of the record columns keyed like `records`
+    parent : dict, optional
+        {'run_id', 'fork_time'} of the archived run this one was forked from
+
+    Returns
+    -------
+    str or None
+        Directory of the archived run, None if archiving is disabled or failed
+    """
+    path = trajectory_path(key)
+    if path is None or time_series is None:
+        return None
+    if os.path.isdir(path):
+        os.utime(path)
+        return path
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(tmp_path, exist_ok=True)
+        np.save(os.path.join(tmp_path, 'time.npy'), np.asarray(time_series))
+        for name, record in records.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(record))
+        meta = {'streams': list(records), 'points': int(len(time_series)),
+                'columns': columns or {}}
+        if parent:
+            meta['parent'] = {'run_id': parent['run_id'], 'fork_time': float(parent['fork_time'])}
+        with open(os.path.join(tmp_path, _META_FILE), 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, path)  # readers never see a partial run
+        _prune_archive()
+        return path
+    except Exception as e:
+        sys.stderr.write(f"DEBUG WARNING: Could not archive trajectory {key}: {e}\n")
+        sys.stderr.flush()
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        return path if os.path.isdir(path) else None
+
+def load_trajectory(path):
+    """
+    Open an archived run with its arrays memory-mapped.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the archived run
+
+    Returns
+    -------
+    tuple or None
+        (time series, records, columns) with read-only memory-mapped
+        arrays, or None if the run is not archived
+    """
+    try:
+        with open(os.path.join(path, _META_FILE)) as f:
+            meta = json.load(f)
+        time_series = np.load(os.path.join(path, 'time.npy'), mmap_mode='r')
+        records = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+                   for name in meta['streams']}
+    except (OSError, ValueError, KeyError):
+        return None
+    return time_series, records, meta.get('columns') or None
+
+def read_slice(time_series, record, start_time=None, end_time=None, max_points=None):
+    """
+    Rows of a record within a time window, thinned to at most `max_points`.
+
+    Only the selected rows are read from a memory-mapped record.
+
+    Parameters
+    ----------
+    time_series : numpy.ndarray
+        Time points of the record
+    record : numpy.ndarray
+        Record with one row per time point
+    start_time, end_time : float, optional
+        Window in days, by default the whole run
+    max_points : int, optional
+        Upper limit on the rows returned, by default all rows in the window
+
+    Returns
+    -------
+    tuple
+        (time points, rows) as in-memory arrays
+    """
+    i0 = 0 if start_time is None else int(np.searchsorted(time_series, start_time, side='left'))
+    i1 = len(time_series) if end_time is None else int(np.searchsorted(time_series, end_time, side='right'))
+    stride = 1
+    if max_points and i1 - i0 > max_points:
+        stride = -(-(i1 - i0)//max_points)
+    rows = np.arange(i0, i1, stride)
+    if len(rows) and rows[-1] != i1 - 1:
+        rows[-1] = i1 - 1  # keep the end of the window
+    return np.array(time_series[rows]), np.array(record[rows])
+
+def trajectory_parent(path):
+    """{'run_id', 'fork_time'} of the run an archived run was forked from, or None."""
+    try:
+        with open(os.path.join(path, _META_FILE)) as f:
+            return json.load(f).get('parent')
+    except (OSError, ValueError):
+        return None
+
+def read_lineage_slice(path, name, start_time=None, end_time=None, max_points=None):
+    """
+    Rows of a record over an archived run and the runs it was forked from.
+
+    Each parent contributes its rows before the fork time, so branches of
+    one run share its history on disk. Only the selected rows are read.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the archived run
+    name : str
+        Stream name, 'effluent' or 'biogas'
+    start_time, end_time : float, optional
+        Window in days, by default the whole history
+    max_points : int, optional
+        Upper limit on the rows returned, by default all rows in the window
+
+    Returns
+    -------
+    tuple or None
+        (time points, rows, column labels) as in-memory arrays and a list,
+        or None if the run is not archived. History of pruned parents is
+        left out.
+    """
+    segments = []
+    until, seen = np.inf, set()
+    while path is not None and path not in seen:
+        seen.add(path)
+        loaded = load_trajectory(path)
+        if loaded is None:
+            break
+        time_series, records, columns = loaded
+        if name not in records:
+            raise KeyError(f"No {name} records in run {os.path.basename(path)}.")
+        labels = (columns or {}).get(name)
+        if segments and labels != segments[0][2]:
+            break  # parent tracked other columns; history starts at the fork
+        lo = 0 if start_time is None else int(np.searchsorted(time_series, start_time, side='left'))
+        hi = len(time_series) if end_time is None else int(np.searchsorted(time_series, end_time, side='right'))
+        hi = min(hi, int(np.searchsorted(time_series, until, side='left')))
+        segments.append((time_series, records[name], labels, lo, max(lo, hi)))
+        parent = trajectory_parent(path)
+        if not parent:
+            break
+        until = parent['fork_time']
+        path = trajectory_path(parent['run_id'])
+    if not segments:
+        return None
+    segments.reverse()
+    total = sum(hi - lo for _, _, _, lo, hi in segments)
+    stride = 1
+    if max_points and total > max_points:
+        stride = -(-total//max_points)
+    picks = np.arange(0, total, stride)
+    if len(picks) and picks[-1] != total - 1:
+        picks[-1] = total - 1  # keep the end of the window
+    t, rows, offset = [], [], 0
+    for time_series, record, _, lo, hi in segments:
+        idx = picks[(picks >= offset) & (picks < offset + hi - lo)] - offset + lo
+        t.append(np.array(time_series[idx]))
+        rows.append(np.array(record[idx]))
+        offset += hi - lo
+    return np.concatenate(t), np.concatenate(rows), segments[-1][2]
+
+def list_trajectories():
+    """
+    Archived runs, most recently used first.
+
+    Returns
+    -------
+    list of dict
+        'run_id', 'points' and 'streams' per run
+    """
+    if not TRAJECTORY_DIR or not os.path.isdir(TRAJECTORY_DIR):
+        return []
+    runs = []
+    for name in os.listdir(TRAJECTORY_DIR):
+        path = os.path.join(TRAJECTORY_DIR, name)
+        try:
+            with open(os.path.join(path, _META_FILE)) as f:
+                meta = json.load(f)
+            run = {'run_id': name, 'points': meta['points'], 'streams': meta['streams']}
+            if meta.get('parent'):
+                run['parent'] = meta['parent']
+            runs.append((os.path.getmtime(path), run))
+        except (OSError, ValueError, KeyError):
+            continue  # in progress or not a run
+    runs.sort(key=lambda item: item[0], reverse=True)
+    return [run for _, run in runs]
+
+def _prune_archive():
+    """Remove the oldest archived runs beyond TRAJECTORY_MAX_RUNS."""
+    entries = [os.path.join(TRAJECTORY_DIR, name) for name in os.listdir(TRAJECTORY_DIR)
+               if not name.endswith('.tmp')]
+    if len(entries) <= TRAJECTORY_MAX_RUNS:
+        return
+    entries.sort(key=os.path.getmtime)
+    for path in entries[:len(entries) - TRAJECTORY_MAX_RUNS]:
+        shutil.rmtree(path, ignore_errors=True)  # runs still mapped elsewhere may stay
+
+def clear_trajectories():
+    """Delete every archived run."""
+    if TRAJECTORY_DIR and os.path.isdir(TRAJECTORY_DIR):
+        for name in os.listdir(TRAJECTORY_DIR):
+            shutil.rmtree(os.path.join(TRAJECTORY_DIR, name), ignore_errors=True)
@@ -11,6 +11,25 @@ from qsdsan import WasteStream
 C_mw = get_mw({'C': 1})
 N_mw = get_mw({'N': 1})
 
+# Influent component keys (concentrations) and ADM1 kinetic parameter keys
+# accepted from users and AI recommendations
+FEEDSTOCK_KEYS = frozenset({
+    "S_su", "S_aa", "S_fa", "S_va", "S_bu", "S_pro", "S_ac", "S_h2", "S_ch4", "S_IC", "S_IN", "S_I",
+    "X_c", "X_ch", "X_pr", "X_li", "X_su", "X_aa", "X_fa", "X_c4", "X_pro", "X_ac", "X_h2", "X_I",
+    "S_cat", "S_an"
+})
+KINETIC_KEYS = frozenset({
+    "q_dis", "q_ch_hyd", "q_pr_hyd", "q_li_hyd",
+    "k_su", "k_aa", "k_fa", "k_c4", "k_pro", "k_ac", "k_h2",
+    "b_su", "b_aa", "b_fa", "b_c4", "b_pro", "b_ac", "b_h2",
+    "K_su", "K_aa", "K_fa", "K_c4", "K_pro", "K_ac", "K_h2",
+    "KI_h2_fa", "KI_h2_c4", "KI_h2_pro", "KI_nh3", "KS_IN",
+    "Y_su", "Y_aa", "Y_fa", "Y_c4", "Y_pro", "Y_ac", "Y_h2",
+    "f_bu_su", "f_pro_su", "f_ac_su", "f_va_aa", "f_bu_aa",
+    "f_pro_aa", "f_ac_aa", "f_ac_fa", "f_pro_va", "f_ac_va",
+    "f_ac_bu", "f_ac_pro"
+})
+
 # Add the parent directory to sys.path
 parent_dir = os.path.dirname(os.path.abspath(__file__))
 adm1_dir = os.path.join(os.path.dirname(parent_dir), "adm1")